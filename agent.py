@@ -1,44 +1,246 @@
+import copy
+import inspect
 import os
-from typing import TypedDict, List, Optional
-from dotenv import load_dotenv
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, TypedDict, List, Optional, Tuple
 import arxiv
-from langchain_community.tools import DuckDuckGoSearchRun
+import numpy as np
 from langchain_core.tools import tool
-from langgraph.prebuilt import create_react_agent
-
-from langchain_openai import ChatOpenAI
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.func import task
+from langgraph.config import get_stream_writer
+from langgraph.errors import GraphRecursionError
 from langgraph.graph import StateGraph, END, START
+from langgraph.runtime import Runtime
+from langgraph.types import StateSnapshot
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from pydantic import BaseModel, Field
 
-load_dotenv()
-if os.getenv("OPENAI_API_KEY") is None:
-    raise ValueError("OPENAI_API_KEYが.envファイルに設定されていません")
+from budget import (
+    BUDGET_TOOL_CALLS,
+    RunBudget,
+    ToolCallBudget,
+    UsageCounter,
+    current_run_budget,
+    limit_tool_calls,
+    record_usage,
+    tool_call_refusal,
+)
+from fulltext import FULLTEXT_CACHE_DIR, FullTextStore
+from http_clients import TimeoutSession, resilient_http_client
+from llm_cache import LLMCache
+from model_router import (
+    NEEDS_LOOKUP,
+    NODE_ANALYZE_PAPER,
+    NODE_GENERATE_QUERIES,
+    REASON_ERROR,
+    TIER_AGENT,
+    TIER_FAST,
+    TIER_STRONG,
+    ModelRouter,
+    RouteDecision,
+    check_analysis,
+    check_queries,
+    new_decision,
+    record_attempt,
+)
+import llm_metrics  # noqa: F401 (LangChainの呼び出しにメトリクスのコールバックを登録する)
+from observability import (
+    NODE_DURATION,
+    NODE_ERRORS,
+    NODE_TOKENS,
+    RATE_LIMIT_WAIT,
+    get_logger,
+    instrument_call,
+    record_cache,
+    span,
+)
+from paper_index import PaperIndex, near_duplicate_mask, normalize_rows
+from paper_store import PaperStore, canonical_arxiv_id
+from ranking import bm25_scores, fuse_scores, normalize_title, tokenize
+from ratelimit import TokenBucket
+from resilience import (
+    SERVICE_TIMEOUTS,
+    CircuitOpenError,
+    hedge,
+    is_retryable,
+)
+from resilience import call as call_upstream
+from schemas import ANALYSIS_MODE_AGENT, ANALYSIS_MODE_BATCHED, ARXIV_CANDIDATE_PAPERS
+from search_cache import SearchCache, SearchStats, current_search_stats
+from state_backend import STATE_BACKEND_PATH, get_state_backend
 
+if TYPE_CHECKING:
+    # 読み込みに時間がかかるため、クライアントを作る create_agent_context() の中でインポートする
+    import httpx
+    from langchain_community.tools import DuckDuckGoSearchRun
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+logger = get_logger("agent")
+
+# 論文分析を同時に実行する最大数 (OpenAI / DuckDuckGo のレート制限に合わせて調整)
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "4"))
+
+LLM_MODEL = "gpt-4o-mini"
+
+# batched モードで1回のLLM呼び出しにまとめる論文数
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "5"))
+# 1本の論文の分析で使えるWeb検索の回数 (リクエストで max_tool_calls_per_paper を指定しなかった場合)
+ANALYSIS_MAX_TOOL_CALLS_PER_PAPER = int(
+    os.getenv("ANALYSIS_MAX_TOOL_CALLS_PER_PAPER", "5")
+)
+# ReActエージェントの既定のステップ上限 (LangGraphのデフォルトと同じ)
+AGENT_DEFAULT_RECURSION_LIMIT = 25
+# ステップ上限が近づいたときにReActエージェントが回答の代わりに返す文言
+_AGENT_STEP_LIMIT_MESSAGE = "Sorry, need more steps"
+
+# LLM呼び出しキャッシュの設定
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+# 論文ごとの分析結果ストアの保存先
+PAPER_STORE_PATH = os.getenv("PAPER_STORE_PATH", ".cache/papers.sqlite3")
+
+# グラフのチェックポイント(SQLite)の保存先。空にすると無効 (失敗した実行は最初からやり直す)
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", ".cache/checkpoints.sqlite3")
+
+# arXiv検索の設定
+# 分析に回す論文数 (リクエストで top_k を指定しなかった場合)
+ARXIV_MAX_PAPERS = 10
+ARXIV_RESULTS_PER_QUERY = int(os.getenv("ARXIV_RESULTS_PER_QUERY", "7"))
+# arXivのマナー (3秒に1リクエスト) をプロセス内の全リクエスト (リトライ・ヘッジを含む) で守る。
+# ARXIV_BURST 件までは間隔を空けずに送れる (デフォルトの1ではバーストを許さない)
+ARXIV_DELAY_SECONDS = float(os.getenv("ARXIV_DELAY_SECONDS", "3"))
+ARXIV_BURST = int(os.getenv("ARXIV_BURST", "1"))
+# OpenAI APIへのリクエスト数の上限 (1分あたり、0 で無制限) と、間隔を空けずに送れる数
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+OPENAI_BURST = int(os.getenv("OPENAI_BURST", "10"))
+# arXivの応答がこの秒数を超えたら同じリクエストをもう1つ送る (0で無効)
+ARXIV_HEDGE_AFTER_SECONDS = float(os.getenv("ARXIV_HEDGE_AFTER_SECONDS", "5"))
+# 購読 (新着論文だけの差分実行) で1クエリから取得する論文数の上限と、1ページの件数
+# 新しい順に取得して前回の watermark で打ち切るため、普段は1ページ目で終わる
+SUBSCRIPTION_MAX_RESULTS_PER_QUERY = int(os.getenv("SUBSCRIPTION_MAX_RESULTS_PER_QUERY", "50"))
+SUBSCRIPTION_PAGE_SIZE = int(os.getenv("SUBSCRIPTION_PAGE_SIZE", "20"))
+
+# Web検索結果キャッシュの設定 (SEARCH_CACHE_PATH を指定するとディスクにも保存する)
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "")
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# 取得済み論文のローカル意味検索インデックスの設定 (PAPER_INDEX_DIR を空にすると無効)
+PAPER_INDEX_DIR = os.getenv("PAPER_INDEX_DIR", ".cache/paper_index")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "512"))
+# クエリの上位結果がすべてこの類似度以上なら、arXivに問い合わせずインデックスから返す
+PAPER_INDEX_MIN_SIMILARITY = float(os.getenv("PAPER_INDEX_MIN_SIMILARITY", "0.45"))
+# これより前に取得した論文はインデックスから返さない (新しい論文を取りこぼさないため)
+PAPER_INDEX_MAX_AGE_SECONDS = float(
+    os.getenv("PAPER_INDEX_MAX_AGE_SECONDS", str(7 * 24 * 3600))
+)
+# 埋め込みのコサイン類似度がこれ以上のクエリ・論文は重複とみなす
+QUERY_DUPLICATE_THRESHOLD = float(os.getenv("QUERY_DUPLICATE_THRESHOLD", "0.95"))
+PAPER_DUPLICATE_THRESHOLD = float(os.getenv("PAPER_DUPLICATE_THRESHOLD", "0.97"))
+
+# 関連度スコアの設定
+# スコアは0〜1 (BM25は候補内の最大値で割る)。これ未満の論文は分析しない (リクエストで上書き可)
+RANK_MIN_SCORE = float(os.getenv("RANK_MIN_SCORE", "0"))
+# 埋め込みのコサイン類似度を混ぜる割合 (インデックスが無効なときはBM25のみ)
+RANK_EMBEDDING_WEIGHT = float(os.getenv("RANK_EMBEDDING_WEIGHT", "0.5"))
+
+
+def _make_web_search_tool(search: "DuckDuckGoSearchRun", cache: SearchCache):
+    """共有の検索クライアントとキャッシュを使う web_search ツールを作る"""
+
+    @tool
+    def web_search(query: str) -> str:
+        """
+        論文内の不明な専門用語や、GitHubの実装リポジトリを探すためにWeb検索を行う
+        Google検索の代わりに使用します。
+        """
+        return _run_web_search(search, cache, query)
+
+    return web_search
+
+
+def _run_web_search(
+    search: "DuckDuckGoSearchRun", cache: SearchCache, query: str
+) -> str:
+    refusal = tool_call_refusal()
+    if refusal is not None:
+        logger.debug("web search refused", query=query)
+        return refusal
+
+    def fetch(q: str) -> str:
+        def invoke() -> str:
+            with instrument_call("duckduckgo", "search"):
+                return search.invoke(q)
+
+        return call_upstream(
+            "duckduckgo",
+            invoke,
+            retryable=_search_retryable,
+            timeout=SERVICE_TIMEOUTS["duckduckgo"],
+        )
 
-@tool
-def web_search(query: str) -> str:
-    """
-    論文内の不明な専門用語や、GitHubの実装リポジトリを探すためにWeb検索を行う
-    Google検索の代わりに使用します。
-    """
-    print(f"\n  🔎 [Tool使用] Web検索を実行中: '{query}'")
     try:
-        search = DuckDuckGoSearchRun()
-        result = search.invoke(query)
-        # 結果の長さも表示してみる
-        print(f"     -> 結果取得成功 ({len(result)}文字)")
+        result, hit = cache.get_or_fetch(query, fetch)
+        record_cache("search", hit)
+        stats = current_search_stats.get()
+        if stats is not None:
+            stats.record(hit)
+        logger.debug("web search", query=query, cache_hit=hit, chars=len(result))
         return result
+    except CircuitOpenError as e:
+        # 障害中は待たずに、検索なしで回答するよう伝える
+        logger.debug("web search skipped", query=query, error=str(e))
+        return f"Web検索は現在利用できません ({e})。検索せずに、わかっている情報で回答してください。"
     except Exception as e:
-        print(f"     -> 検索エラー: {e}")
+        logger.warning("web search failed", query=query, error=str(e))
         return f"検索中にエラーが発生しました: {e}"
 
 
+def _search_retryable(error: BaseException) -> bool:
+    """DuckDuckGo のレート制限・タイムアウトはリトライする (「結果なし」などはしない)"""
+    return is_retryable(error) or type(error).__name__ in (
+        "RatelimitException",
+        "TimeoutException",
+    )
+
+
 class PaperInfo(TypedDict):
+    arxiv_id: str  # バージョン番号を除いたarXiv ID (例: 2301.00001)
     title: str
     summary: str
     url: str
 
 
+class NodeUsage(TypedDict):
+    llm_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    seconds: float
+
+
+class PaperUsage(TypedDict):
+    arxiv_id: str
+    source: str  # store / cache / fast / strong / agent / batch / skipped
+    llm_calls: int
+    total_tokens: int
+    tool_calls: int
+    seconds: float
+    degraded: Optional[str]  # 予算切れで分析を省略・打ち切った理由 (tokens / time / tool_calls)
+    full_text: bool  # PDFの本文から選んだ箇所を分析に使ったか
+    route: Optional[RouteDecision]  # モデルの振り分けの記録 (ストア・キャッシュ・batch の場合は None)
+
+
 class AgentState(TypedDict):
     keyword: str
     queries: List[str]  # [NEW] 生成された検索クエリリスト
@@ -46,15 +248,346 @@ class AgentState(TypedDict):
     analysis: Optional[List[str]]
     web_search_logs: Optional[List[str]]
     report_markdown: Optional[str]
+    bypass_cache: Optional[bool]  # True ならLLMキャッシュを参照せずに再実行する
+    analysis_mode: Optional[str]  # "agent" (デフォルト) または "batched"
+    full_text: Optional[bool]  # True ならPDFの本文から関連する箇所を選んで分析に使う
+    agent_analyzed_ids: Optional[List[str]]  # ReActエージェントでの分析に回した論文のarXiv ID
+    top_k: Optional[int]  # 分析に回す論文数 (None なら ARXIV_MAX_PAPERS)
+    min_score: Optional[float]  # 分析に回す関連度スコアの下限 (None なら RANK_MIN_SCORE)
+    candidate_count: Optional[int]  # 絞り込み前の候補数
+    relevance_scores: Optional[List[float]]  # core_papers と同じ順の関連度スコア
+    # 購読 (新着論文だけの差分実行)
+    incremental: Optional[bool]  # True ならarXivを投稿日の新しい順に検索し、新着論文だけを分析する
+    since: Optional[str]  # この投稿日時 (ISO 8601) より古い論文が来たら取得を打ち切る
+    exclude_ids: Optional[List[str]]  # 前回までに見た論文のarXiv ID (候補から除く)
+    candidate_published: Optional[Dict[str, str]]  # 今回見た新着論文のarXiv ID -> 投稿日時
+    # 予算 (None は無制限)
+    max_tokens: Optional[int]  # リクエスト全体で使うトークン数の上限
+    max_tool_calls_per_paper: Optional[int]  # None なら ANALYSIS_MAX_TOOL_CALLS_PER_PAPER
+    max_seconds: Optional[float]  # リクエスト全体の実行時間の上限
+    # 使用量
+    started_at: Optional[float]
+    tokens_used: Optional[int]
+    node_usage: Optional[Dict[str, NodeUsage]]
+    paper_usage: Optional[List[PaperUsage]]  # core_papers と同じ順
+    routing: Optional[List[RouteDecision]]  # generate_queries と論文ごとのモデルの振り分け
+    budget_exhausted: Optional[str]  # 予算切れで分析を省略・打ち切った理由
+
+
+class BatchPaperSummary(BaseModel):
+    """batched モードで1論文ごとに返してもらう内容"""
+
+    index: int = Field(description="The paper number given in the input")
+    summary: str = Field(description="Core contribution in Japanese (about 300 characters)")
+    needs_lookup: bool = Field(
+        description="True if unknown technical terms or implementation status "
+        "must be looked up on the web to write a good summary"
+    )
+
+
+class BatchAnalysis(BaseModel):
+    items: List[BatchPaperSummary]
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """プロセス共有のLLMキャッシュを返す (初回呼び出し時に生成)"""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache(
+                get_state_backend(LLM_CACHE_PATH),
+                ttl_seconds=LLM_CACHE_TTL_SECONDS,
+                max_entries=LLM_CACHE_MAX_ENTRIES,
+            )
+        return _llm_cache
+
+
+_paper_store: Optional[PaperStore] = None
+_paper_store_lock = threading.Lock()
+
+
+def get_paper_store() -> PaperStore:
+    """
+    プロセス共有の論文分析ストアを返す (初回呼び出し時に生成)
+    同じ論文の分析の占有は状態の保存先に置き、同じファイル (STATE_BACKEND_PATH) を使うワーカー間でも待ち合わせる
+    """
+    global _paper_store
+    with _paper_store_lock:
+        if _paper_store is None:
+            _paper_store = PaperStore(
+                PAPER_STORE_PATH, claims=get_state_backend(PAPER_STORE_PATH)
+            )
+        return _paper_store
+
+
+_paper_index: Optional[PaperIndex] = None
+_paper_index_lock = threading.Lock()
+
+
+def get_paper_index() -> Optional[PaperIndex]:
+    """プロセス共有の論文インデックスを返す (PAPER_INDEX_DIR が空なら None)"""
+    global _paper_index
+    if not PAPER_INDEX_DIR:
+        return None
+    with _paper_index_lock:
+        if _paper_index is None:
+            _paper_index = PaperIndex(
+                PAPER_INDEX_DIR, dim=EMBEDDING_DIMENSIONS, model=EMBEDDING_MODEL
+            )
+        return _paper_index
+
+
+_fulltext_store: Optional[FullTextStore] = None
+_fulltext_store_lock = threading.Lock()
+
+
+def get_fulltext_store() -> FullTextStore:
+    """プロセス共有の論文本文のキャッシュを返す (初回呼び出し時に生成)"""
+    global _fulltext_store
+    with _fulltext_store_lock:
+        if _fulltext_store is None:
+            _fulltext_store = FullTextStore(FULLTEXT_CACHE_DIR)
+        return _fulltext_store
+
+
+_checkpointer: Optional[SqliteSaver] = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> Optional[SqliteSaver]:
+    """プロセス共有のチェックポイント保存先を返す (CHECKPOINT_PATH が空なら None)"""
+    global _checkpointer
+    if not CHECKPOINT_PATH:
+        return None
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            if CHECKPOINT_PATH != ":memory:":
+                os.makedirs(
+                    os.path.dirname(os.path.abspath(CHECKPOINT_PATH)), exist_ok=True
+                )
+            conn = sqlite3.connect(CHECKPOINT_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            _checkpointer = SqliteSaver(conn)
+            _checkpointer.setup()
+        return _checkpointer
+
+
+class RateLimitedArxivClient(arxiv.Client):
+    """
+    プロセス全体で共有するarXivクライアント
+    arxiv.Client 自身の待機 (インスタンス単位) の代わりに、共有トークンバケットで
+    全スレッドからのリクエスト間隔を制御する (リトライ・ヘッジも1リクエストとして数える)
+    リトライ・タイムアウト・ブレーカー・ヘッジは resilience.py の共通の層で行う
+
+    arxiv.Client には1ページ (1リクエスト) ごとの処理やセッションを差し替える公開の方法がないため、
+    非公開の _parse_feed と _session を上書きしている (公開の results() の外側では
+    ページ送りのリクエストを数えられない)。動作を確かめた範囲に pyproject.toml でバージョンを固定している
+    """
+
+    def __init__(self, bucket: TokenBucket, **kwargs):
+        super().__init__(delay_seconds=0, num_retries=0, **kwargs)
+        self.bucket = bucket
+        self._session = TimeoutSession(SERVICE_TIMEOUTS["arxiv"])
+
+    def with_page_size(self, page_size: int) -> "RateLimitedArxivClient":
+        """1ページの件数だけを変えたクライアント (トークンバケットとセッションは共有する)"""
+        client = copy.copy(self)
+        client.page_size = page_size
+        return client
+
+    def _parse_feed(self, url, first_page=True, _try_index=0):
+        return call_upstream(
+            "arxiv",
+            lambda: hedge(
+                "arxiv",
+                lambda: self._request_feed(url, first_page),
+                ARXIV_HEDGE_AFTER_SECONDS,
+                acquire=self._acquire,
+            ),
+            retryable=_arxiv_retryable,
+        )
+
+    def _acquire(self) -> None:
+        RATE_LIMIT_WAIT.observe(self.bucket.acquire(), service="arxiv")
+
+    def _request_feed(self, url, first_page):
+        with instrument_call("arxiv", "query"):
+            return super()._parse_feed(url, first_page=first_page)
+
+
+def _arxiv_retryable(error: BaseException) -> bool:
+    """429/5xx と、途中のページが空で返る一時的な不具合はリトライする"""
+    if isinstance(error, arxiv.HTTPError):
+        return error.status == 429 or error.status >= 500
+    return is_retryable(error) or isinstance(error, arxiv.UnexpectedEmptyPageError)
+
+
+_arxiv_client: Optional[RateLimitedArxivClient] = None
+_arxiv_client_lock = threading.Lock()
+
+
+def get_arxiv_client() -> RateLimitedArxivClient:
+    """プロセス共有のarXivクライアントを返す (初回呼び出し時に生成)"""
+    global _arxiv_client
+    with _arxiv_client_lock:
+        if _arxiv_client is None:
+            _arxiv_client = RateLimitedArxivClient(
+                TokenBucket(
+                    interval=ARXIV_DELAY_SECONDS,
+                    capacity=ARXIV_BURST,
+                    backend=get_state_backend(),
+                    name="arxiv",
+                )
+            )
+        return _arxiv_client
+
+
+def _openai_rate_limit() -> Optional[TokenBucket]:
+    """OpenAI APIのリクエスト数の上限 (OPENAI_REQUESTS_PER_MINUTE が 0 なら None)"""
+    if OPENAI_REQUESTS_PER_MINUTE <= 0:
+        return None
+    return TokenBucket(
+        interval=60 / OPENAI_REQUESTS_PER_MINUTE,
+        capacity=OPENAI_BURST,
+        backend=get_state_backend(),
+        name="openai",
+    )
+
+
+@dataclass
+class AgentContext:
+    """
+    グラフの実行に使う長寿命のクライアント群
+    プロセス起動時 (APIのlifespan / CLIの開始時) に1回だけ作り、
+    `agent.invoke(state, context=...)` で各ノードに渡す
+    """
 
+    router: ModelRouter
+    tier_llms: Dict[str, "ChatOpenAI"]  # tier (fast / strong) ごとのツールなしのLLM
+    search_cache: SearchCache
+    batch_llm: Any  # BatchAnalysis を返す構造化出力のLLM
+    analysis_agent: Any  # web_search ツール付きのReActエージェント
+    tools: List[Any]
+    arxiv_client: RateLimitedArxivClient
+    llm_cache: LLMCache
+    paper_store: PaperStore
+    embeddings: "OpenAIEmbeddings"
+    paper_index: Optional[PaperIndex]  # 無効な場合は None
+    fulltext: FullTextStore
 
-def generate_queries(state: AgentState) -> AgentState:
+
+def create_agent_context(
+    openai_transport: Optional["httpx.BaseTransport"] = None,
+    search: Optional["DuckDuckGoSearchRun"] = None,
+    arxiv_client: Optional[RateLimitedArxivClient] = None,
+) -> AgentContext:
+    """
+    LLM・検索・arXivのクライアントを用意する (HTTP接続はクライアントごとに再利用される)
+    引数を指定すると外部への通信先だけを差し替える (ベンチマークの代役など)。
+    OpenAIは openai_transport の手前まで、本番と同じリトライ・ブレーカーの層を通す
+    """
+    from langchain_community.tools import DuckDuckGoSearchRun
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+    from langgraph.prebuilt import create_react_agent
+
+    search_cache = SearchCache(
+        max_entries=SEARCH_CACHE_MAX_ENTRIES,
+        disk=(
+            LLMCache(
+                get_state_backend(SEARCH_CACHE_PATH),
+                ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+                max_entries=SEARCH_CACHE_MAX_ENTRIES,
+                namespace="search_cache",
+            )
+            if SEARCH_CACHE_PATH or STATE_BACKEND_PATH
+            else None
+        ),
+    )
+    tools = [_make_web_search_tool(search or DuckDuckGoSearchRun(), search_cache)]
+    # OpenAIへのリクエストはすべて共通の耐障害性レイヤーを通す (SDK自身のリトライは使わない)
+    openai_http_client = resilient_http_client(
+        "openai", openai_transport, bucket=_openai_rate_limit()
+    )
+
+    def chat_model(model: str = LLM_MODEL) -> "ChatOpenAI":
+        return ChatOpenAI(
+            model=model,
+            temperature=0,
+            http_client=openai_http_client,
+            max_retries=0,
+            timeout=SERVICE_TIMEOUTS["openai"],
+        )
+
+    analysis_llm = chat_model().bind_tools(tools)
+    router = ModelRouter.from_env(agent_model=LLM_MODEL)
+    return AgentContext(
+        router=router,
+        tier_llms={tier: chat_model(router.model(tier)) for tier in (TIER_FAST, TIER_STRONG)},
+        search_cache=search_cache,
+        batch_llm=chat_model().with_structured_output(BatchAnalysis),
+        analysis_agent=create_react_agent(analysis_llm, tools),
+        tools=tools,
+        arxiv_client=arxiv_client or get_arxiv_client(),
+        llm_cache=get_llm_cache(),
+        paper_store=get_paper_store(),
+        embeddings=OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
+            dimensions=EMBEDDING_DIMENSIONS,
+            http_client=openai_http_client,
+            max_retries=0,
+            request_timeout=SERVICE_TIMEOUTS["openai"],
+        ),
+        paper_index=get_paper_index(),
+        fulltext=get_fulltext_store(),
+    )
+
+
+_agent_context: Optional[AgentContext] = None
+_agent_context_lock = threading.Lock()
+
+
+def get_agent_context() -> AgentContext:
+    """プロセス共有の AgentContext を返す (初回呼び出し時に生成)"""
+    global _agent_context
+    with _agent_context_lock:
+        if _agent_context is None:
+            _agent_context = create_agent_context()
+        return _agent_context
+
+
+def _context(runtime: Runtime[AgentContext]) -> AgentContext:
+    """context を渡さずに実行された場合はプロセス共有のものを使う"""
+    return runtime.context or get_agent_context()
+
+
+def _get_event_writer():
+    """
+    進捗イベントの送信先を返す
+    stream_mode="custom" で実行されていれば各ノードの途中経過がストリームに流れる。
+    グラフの外から直接呼ばれた場合は何もしない関数を返す
+    """
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda event: None
+
+
+def generate_queries(
+    state: AgentState, runtime: Runtime[AgentContext]
+) -> AgentState:
     """ノード0: [NEW] ユーザー入力をarXiv用の英語クエリに変換する"""
-    print("generating search queries...")
+    if state.get("queries"):
+        # 購読の2回目以降は初回に生成したクエリで検索する (同じ条件で新着だけを探すため)
+        logger.info("reusing queries", queries=state["queries"])
+        _get_event_writer()({"type": "queries", "queries": state["queries"]})
+        return state
+    ctx = _context(runtime)
     keyword = state["keyword"]
 
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
     prompt = f"""
     You are an expert AI researcher.
     Please generate 3 effective search queries for arXiv based on the user's input topic.
@@ -67,73 +600,655 @@ def generate_queries(state: AgentState) -> AgentState:
     User Input: "{keyword}"
     """
 
-    response = llm.invoke([HumanMessage(content=prompt)])
+    cache = ctx.llm_cache
+
+    def generate(tier: str, model: str) -> str:
+        cache_key = cache.make_key("generate_queries", model, prompt)
+        content = None if state.get("bypass_cache") else cache.get(cache_key)
+        record_cache("llm", content is not None)
+        if content is None:
+            response = ctx.tier_llms[tier].invoke([HumanMessage(content=prompt)])
+            content = response.content
+            cache.set(cache_key, content)
+        return content
+
+    # 安い tier から試し、クエリの数・形式が検査に通らなければ強い tier で生成し直す
+    content, route = ctx.router.run(NODE_GENERATE_QUERIES, generate, check_queries)
+    if route["escalated"]:
+        logger.info("escalated query generation", attempts=route["attempts"])
 
     # 改行で分割してリスト化し、空白を除去
-    queries = [q.strip() for q in response.content.split("\n") if q.strip()]
+    queries = [q.strip() for q in content.split("\n") if q.strip()]
 
-    print(f"Generated Queries: {queries}")
-    return {**state, "queries": queries}
+    logger.info("generated queries", queries=queries, tier=route["tier"])
+    _get_event_writer()({"type": "queries", "queries": queries})
+    return {**state, "queries": queries, "routing": [route]}
 
 
-def find_core_papers(state: AgentState) -> AgentState:
-    """ノード1: 生成されたクエリを使って論文を検索する"""
-    print("finding core papers...")
+def _fetch_arxiv_query(
+    client: arxiv.Client,
+    search: arxiv.Search,
+    results: queue.Queue,
+    stop: threading.Event,
+    errors: List[Exception],
+    since: Optional[datetime] = None,
+) -> None:
+    """
+    1クエリ分の検索結果を取得した順に results へ流す (終了時に None を送る。失敗は errors へ)
+    since を指定した場合 (投稿日の新しい順の検索) は、それより古い論文が来たところで打ち切る
+    """
+    logger.debug("search arxiv", query=search.query)
+    try:
+        for result in client.results(search):
+            if stop.is_set():
+                break
+            if since is not None and result.published < since:
+                break
+            results.put(result)
+    except Exception as e:
+        logger.warning("arxiv search failed", query=search.query, error=str(e))
+        errors.append(e)
+    finally:
+        results.put(None)
 
-    # 生成されたクエリがない場合は元のキーワードを使う（フォールバック）
-    queries = state.get("queries", [state["keyword"]])
 
-    client = arxiv.Client()
-    all_papers: List[PaperInfo] = []
+def _fetch_remote_papers(
+    client: arxiv.Client, queries: List[str], on_paper=None
+) -> List[PaperInfo]:
+    """
+    全クエリを並列にarXivへ発行し、届いた順にURLで重複を除いてマージする
+    上限に達したら残りの取得を打ち切る。on_paper(index, paper) で1件ずつ通知する
+    1件も取れず失敗したクエリがあれば、「見つからなかった」ではなくその失敗を送出する
+    """
+    papers: List[PaperInfo] = []
     seen_urls = set()
+    results: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    errors: List[Exception] = []
 
-    # 各クエリで検索を実行
+    executor = ThreadPoolExecutor(max_workers=len(queries))
     for query in queries:
-        print(f"  Search arXiv with: '{query}'")
         search = arxiv.Search(
             query=query,
-            max_results=3,
+            max_results=ARXIV_RESULTS_PER_QUERY,
             sort_by=arxiv.SortCriterion.Relevance,
         )
+        executor.submit(_fetch_arxiv_query, client, search, results, stop, errors)
 
+    pending = len(queries)
+    while pending:
+        result = results.get()
+        if result is None:
+            pending -= 1
+            continue
+        if result.pdf_url in seen_urls:
+            continue
+        paper = PaperInfo(
+            arxiv_id=canonical_arxiv_id(result.entry_id),
+            title=result.title,
+            summary=result.summary,
+            url=result.pdf_url,
+        )
+        papers.append(paper)
+        seen_urls.add(result.pdf_url)
+        if on_paper is not None:
+            on_paper(len(papers) - 1, paper)
+        if len(papers) >= ARXIV_CANDIDATE_PAPERS:
+            stop.set()
+            break
+    executor.shutdown(wait=False, cancel_futures=True)
+    if not papers and errors:
+        raise errors[0]
+    return papers
+
+
+def _fetch_new_papers(
+    client: RateLimitedArxivClient,
+    queries: List[str],
+    since: Optional[str],
+    exclude_ids: List[str],
+) -> Tuple[List[PaperInfo], Dict[str, str]]:
+    """
+    購読用: 全クエリを投稿日の新しい順に並列で検索し、since より古い論文が来たら打ち切る
+    前回までに見た論文 (exclude_ids) を除いた新着論文と、その投稿日時 (arXiv ID -> ISO 8601) を返す
+    since が None (初回) なら、各クエリの新しい方から SUBSCRIPTION_MAX_RESULTS_PER_QUERY 件まで
+    """
+    since_at = datetime.fromisoformat(since) if since else None
+    exclude = set(exclude_ids)
+    # 新着だけなら数件で済むので、1ページの件数を小さくして余分な結果を取らない
+    client = client.with_page_size(SUBSCRIPTION_PAGE_SIZE)
+    papers: List[PaperInfo] = []
+    published: Dict[str, str] = {}
+    results: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    errors: List[Exception] = []
+
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    for query in queries:
+        search = arxiv.Search(
+            query=query,
+            max_results=SUBSCRIPTION_MAX_RESULTS_PER_QUERY,
+            sort_by=arxiv.SortCriterion.SubmittedDate,
+            sort_order=arxiv.SortOrder.Descending,
+        )
+        executor.submit(
+            _fetch_arxiv_query, client, search, results, stop, errors, since_at
+        )
+
+    pending = len(queries)
+    while pending:
+        result = results.get()
+        if result is None:
+            pending -= 1
+            continue
+        arxiv_id = canonical_arxiv_id(result.entry_id)
+        if arxiv_id in exclude or arxiv_id in published:
+            continue
+        published[arxiv_id] = result.published.isoformat()
+        papers.append(
+            PaperInfo(
+                arxiv_id=arxiv_id,
+                title=result.title,
+                summary=result.summary,
+                url=result.pdf_url,
+            )
+        )
+    executor.shutdown()
+    # 一部のクエリが失敗したまま watermark を進めると、その分の論文を取りこぼすので失敗にする
+    if errors:
+        raise errors[0]
+    return papers, published
+
+
+def _paper_text(paper: PaperInfo) -> str:
+    """論文の埋め込みに使うテキスト"""
+    return f"{paper['title']}\n\n{paper['summary']}"
+
+
+def _embed_queries(ctx: AgentContext, queries: List[str]) -> np.ndarray:
+    """クエリを埋め込む (同じクエリの埋め込みはLLMキャッシュから再利用する)"""
+    cache = ctx.llm_cache
+    model = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}"
+    keys = [cache.make_key("embed_query", model, query) for query in queries]
+    vectors = [cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    for vector in vectors:
+        record_cache("embedding", vector is not None)
+    if missing:
+        with instrument_call("openai", "embeddings"):
+            embedded = ctx.embeddings.embed_documents([queries[i] for i in missing])
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+            cache.set(keys[i], vector)
+    return normalize_rows(np.array(vectors))
+
+
+def _index_papers(ctx: AgentContext, index: PaperIndex, papers: List[PaperInfo]) -> None:
+    """インデックスにまだない論文を埋め込んで追加する"""
+    new_papers = [paper for paper in papers if paper["arxiv_id"] not in index]
+    if not new_papers:
+        return
+    try:
+        with instrument_call("openai", "embeddings"):
+            vectors = ctx.embeddings.embed_documents(
+                [_paper_text(paper) for paper in new_papers]
+            )
+        index.add(new_papers, np.array(vectors))
+    except Exception as e:
+        # 取得済みの結果は捨てずに使う (埋め込みによる重複除去だけ行わない)
+        logger.warning("indexing papers failed", error=str(e))
+
+
+def _find_with_index(
+    ctx: AgentContext, index: PaperIndex, queries: List[str], use_index: bool
+) -> List[PaperInfo]:
+    """
+    ローカルインデックスを使って論文を探す
+    1. ほぼ同じ意味のクエリをまとめる
+    2. 上位結果が十分に似ていて新しいクエリはインデックスから返す
+    3. 残りのクエリだけarXivに問い合わせ、取得した論文をインデックスに追加する
+    4. 埋め込みがほぼ同じ論文 (別バージョン・重複投稿など) を除く
+    use_index が False ならすべてのクエリをarXivに問い合わせる (インデックスの更新は行う)
+    """
+    query_vectors = _embed_queries(ctx, queries)
+    keep = near_duplicate_mask(query_vectors, QUERY_DUPLICATE_THRESHOLD)
+    if not keep.all():
+        logger.info("skipped near-duplicate queries", count=int((~keep).sum()))
+    queries = [query for query, kept in zip(queries, keep) if kept]
+    query_vectors = query_vectors[keep]
+
+    local: List[PaperInfo] = []
+    remote_queries: List[str] = []
+    for query, vector in zip(queries, query_vectors):
+        hits = []
+        if use_index:
+            hits = index.search(
+                vector,
+                ARXIV_RESULTS_PER_QUERY,
+                max_age_seconds=PAPER_INDEX_MAX_AGE_SECONDS,
+            )
+        if len(hits) == ARXIV_RESULTS_PER_QUERY and all(
+            score >= PAPER_INDEX_MIN_SIMILARITY for _, score in hits
+        ):
+            logger.debug("served from local index", query=query)
+            local.extend(
+                PaperInfo(
+                    arxiv_id=hit["arxiv_id"],
+                    title=hit["title"],
+                    summary=hit["summary"],
+                    url=hit["url"],
+                )
+                for hit, _ in hits
+            )
+        else:
+            remote_queries.append(query)
+
+    remote: List[PaperInfo] = []
+    if remote_queries:
+        try:
+            remote = _fetch_remote_papers(ctx.arxiv_client, remote_queries)
+        except Exception as e:
+            # arXivの障害中でも、インデックスから見つかった論文があればそれで続ける
+            if not local:
+                raise
+            logger.warning("arxiv unavailable, using local index only", error=str(e))
+    _index_papers(ctx, index, remote)
+
+    candidates: List[PaperInfo] = []
+    seen_ids = set()
+    for paper in local + remote:
+        if paper["arxiv_id"] not in seen_ids:
+            seen_ids.add(paper["arxiv_id"])
+            candidates.append(paper)
+    vectors = index.vectors_for([paper["arxiv_id"] for paper in candidates])
+    if vectors is not None:
+        keep = near_duplicate_mask(vectors, PAPER_DUPLICATE_THRESHOLD)
+        candidates = [paper for paper, kept in zip(candidates, keep) if kept]
+    return candidates[:ARXIV_CANDIDATE_PAPERS]
+
+
+def find_core_papers(
+    state: AgentState, runtime: Runtime[AgentContext]
+) -> AgentState:
+    """
+    ノード1: 生成されたクエリを使って論文の候補を検索する
+    ローカルインデックスで足りるクエリはその場で返し、残りのクエリをarXivへ並列に発行する
+    分析する論文は次の rank_papers で絞り込むので、ここでは多めに集める
+    購読 (incremental) では前回より後に投稿された論文だけを候補にする
+    """
+    ctx = _context(runtime)
+
+    # 生成されたクエリがない場合は元のキーワードを使う（フォールバック）
+    queries = state.get("queries") or [state["keyword"]]
+    emit = _get_event_writer()
+
+    def emit_paper(index: int, paper: PaperInfo) -> None:
+        emit({"type": "paper", "index": index, "paper": paper})
+
+    if state.get("incremental"):
+        return _find_new_papers(ctx, state, queries, emit_paper)
+
+    final_papers: Optional[List[PaperInfo]] = None
+    if ctx.paper_index is not None:
         try:
-            for result in client.results(search):
-                if result.pdf_url not in seen_urls:
-                    paper = PaperInfo(
-                        title=result.title,
-                        summary=result.summary,
-                        url=result.pdf_url,
-                    )
-                    all_papers.append(paper)
-                    seen_urls.add(result.pdf_url)
+            final_papers = _find_with_index(
+                ctx, ctx.paper_index, queries, use_index=not state.get("bypass_cache")
+            )
+            for i, paper in enumerate(final_papers):
+                emit_paper(i, paper)
         except Exception as e:
-            print(f"  Error searching for '{query}': {e}")
-    final_papers = all_papers[:10]
+            # 埋め込みが使えない場合などはarXivのみで検索する
+            logger.warning("local index unavailable, falling back to arXiv", error=str(e))
+            final_papers = None
+    if final_papers is None:
+        # 届いた順にマージし、その場で通知する
+        final_papers = _fetch_remote_papers(ctx.arxiv_client, queries, emit_paper)
 
     if not final_papers:
         raise ValueError(f"論文が見つかりませんでした。Queries: {queries}")
 
-    print(f"Total {len(final_papers)} unique papers found.")
+    logger.info("found candidate papers", count=len(final_papers))
     return {**state, "core_papers": final_papers}
 
 
-def analyze_paper_with_llm(state: AgentState) -> AgentState:
+def _find_new_papers(
+    ctx: AgentContext, state: AgentState, queries: List[str], emit_paper
+) -> AgentState:
     """
-    ノード2: LLMで論文を分析する
-    必要なら検索する機能を追加
+    購読用の find_core_papers: 前回までに見ていない新着論文だけを候補にする
+    新着がなくても失敗にはしない (後続のノードは分析する論文がないまま進む)
     """
-    print("analyzing papers with llm...")
-    papers = state.get("core_papers")
-    if not papers:
-        return state
-    tools = [web_search]
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0).bind_tools(tools)
-    agent_executor = create_react_agent(llm, tools)
-    analysis_results: List[str] = []
-    all_web_search_logs: List[str] = []
+    papers, published = _fetch_new_papers(
+        ctx.arxiv_client, queries, state.get("since"), state.get("exclude_ids") or []
+    )
+    if ctx.paper_index is not None:
+        # rank_papers で埋め込みの類似度を使えるよう、新着論文だけを埋め込む
+        _index_papers(ctx, ctx.paper_index, papers)
     for i, paper in enumerate(papers):
-        print(f"Analyzing ({i+1}/{len(papers)}): {paper['title'][:30]}...")
-        prompt = f"""
+        emit_paper(i, paper)
+    logger.info("found new papers", count=len(papers), since=state.get("since"))
+    return {**state, "core_papers": papers, "candidate_published": published}
+
+
+def _semantic_scores(
+    ctx: AgentContext, keyword: str, papers: List[PaperInfo]
+) -> Optional[List[float]]:
+    """キーワードと各論文の埋め込みのコサイン類似度 (インデックスにない論文があれば None)"""
+    if ctx.paper_index is None:
+        return None
+    try:
+        vectors = ctx.paper_index.vectors_for([paper["arxiv_id"] for paper in papers])
+        if vectors is None:
+            return None
+        return (vectors @ _embed_queries(ctx, [keyword])[0]).tolist()
+    except Exception as e:
+        logger.warning("embedding similarity unavailable, using BM25 only", error=str(e))
+        return None
+
+
+def rank_papers(state: AgentState, runtime: Runtime[AgentContext]) -> AgentState:
+    """
+    ノード2: 候補の論文をキーワードとの関連度で並べ替え、上位だけを分析に回す
+    タイトル+アブストラクトに対するBM25 (キーワードと生成クエリ) と埋め込み類似度を融合し、
+    同じタイトルの論文 (別バージョンなど) は最も高いものだけを残す
+    """
+    ctx = _context(runtime)
+    candidates = state.get("core_papers") or []
+    keyword = state["keyword"]
+    top_k = state.get("top_k") or ARXIV_MAX_PAPERS
+    min_score = state.get("min_score")
+    if min_score is None:
+        min_score = RANK_MIN_SCORE
+    if not candidates and state.get("incremental"):
+        # 購読で新着論文がなかった
+        return {**state, "core_papers": [], "candidate_count": 0, "relevance_scores": []}
+
+    # キーワードが日本語の場合は英語の生成クエリの語がBM25に効く
+    query_tokens = tokenize(" ".join([keyword, *(state.get("queries") or [])]))
+    lexical = bm25_scores(
+        query_tokens, [tokenize(_paper_text(paper)) for paper in candidates]
+    )
+    scores = fuse_scores(
+        lexical, _semantic_scores(ctx, keyword, candidates), RANK_EMBEDDING_WEIGHT
+    )
+
+    selected: List[int] = []
+    seen_titles = set()
+    for i in sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True):
+        title = normalize_title(candidates[i]["title"])
+        if title in seen_titles:
+            continue
+        seen_titles.add(title)
+        if scores[i] < min_score or len(selected) >= top_k:
+            break
+        selected.append(i)
+    if not selected and not state.get("incremental"):
+        raise ValueError(
+            f"関連度スコアが {min_score} 以上の論文がありませんでした "
+            f"(候補 {len(candidates)}件)"
+        )
+
+    papers = [candidates[i] for i in selected]
+    relevance_scores = [round(scores[i], 4) for i in selected]
+    logger.info("selected papers", selected=len(papers), candidates=len(candidates))
+    _get_event_writer()(
+        {
+            "type": "ranked",
+            "candidate_count": len(candidates),
+            "papers": papers,
+            "scores": relevance_scores,
+        }
+    )
+    return {
+        **state,
+        "core_papers": papers,
+        "candidate_count": len(candidates),
+        "relevance_scores": relevance_scores,
+    }
+
+
+def _store_analysis(
+    store: PaperStore,
+    paper: PaperInfo,
+    analysis: str,
+    web_search_logs: List[str],
+    model: str = LLM_MODEL,
+) -> None:
+    store.put(
+        arxiv_id=paper["arxiv_id"],
+        title=paper["title"],
+        summary=paper["summary"],
+        analysis=analysis,
+        web_search_logs=web_search_logs,
+        model=model,
+    )
+
+
+def _reusable_analysis(ctx: AgentContext, stored: Optional[dict]) -> bool:
+    """ストアの分析結果が、今の設定で分析に使うモデルのどれかで作られたものか"""
+    return stored is not None and (
+        stored["model"] == LLM_MODEL
+        or stored["model"] in ctx.router.node_models(NODE_ANALYZE_PAPER)
+    )
+
+
+def _paper_usage(
+    paper: PaperInfo,
+    source: str,
+    started: float,
+    counter: Optional[UsageCounter] = None,
+    tool_calls: int = 0,
+    degraded: Optional[str] = None,
+    full_text: bool = False,
+    route: Optional[RouteDecision] = None,
+) -> PaperUsage:
+    usage = counter.snapshot() if counter is not None else {}
+    return PaperUsage(
+        arxiv_id=paper["arxiv_id"],
+        source=source,
+        llm_calls=usage.get("llm_calls", 0),
+        total_tokens=usage.get("total_tokens", 0),
+        tool_calls=tool_calls,
+        seconds=round(time.monotonic() - started, 3),
+        degraded=degraded,
+        full_text=full_text,
+        route=route,
+    )
+
+
+def _skipped_analysis(reason: str) -> str:
+    return f"予算の上限 ({reason}) に達したため、この論文の分析は省略されました。"
+
+
+def _agent_recursion_limit(max_tool_calls: Optional[int]) -> int:
+    """
+    ReActエージェントのステップ上限
+    ツール1回につきLLMとツールの2ステップ。上限に達した後の拒否と最終回答の分も見込む
+    """
+    if max_tool_calls is None:
+        return AGENT_DEFAULT_RECURSION_LIMIT
+    return 2 * (max_tool_calls + 2) + 1
+
+
+def _best_answer(messages: List[Any]) -> str:
+    """途中で打ち切ったときに、それまでで最後に得られたLLMの回答を返す"""
+    for msg in reversed(messages):
+        if (
+            isinstance(msg, AIMessage)
+            and isinstance(msg.content, str)
+            and msg.content
+            and not msg.content.startswith(_AGENT_STEP_LIMIT_MESSAGE)
+        ):
+            return msg.content
+    return "予算の上限に達したため、分析を完了できませんでした。"
+
+
+def _full_text_query(state: AgentState) -> str:
+    """本文から関連する箇所を選ぶためのクエリ (キーワードと生成された検索クエリ)"""
+    return " ".join([state["keyword"], *(state.get("queries") or [])])
+
+
+def _full_text_excerpt(ctx: AgentContext, paper: PaperInfo, query: str) -> Optional[str]:
+    """
+    論文の本文のうちクエリに関連する箇所を返す
+    PDFが取得・抽出できなかった場合は None (アブストラクトだけで分析する)
+    """
+    try:
+        return ctx.fulltext.excerpt(paper["arxiv_id"], paper["url"], query) or None
+    except Exception as e:
+        logger.warning(
+            "full text unavailable, using abstract", arxiv_id=paper["arxiv_id"], error=str(e)
+        )
+        return None
+
+
+def _excerpt_section(excerpt: Optional[str]) -> str:
+    """プロンプトのアブストラクトの後に続ける本文の抜粋 (なければ空文字)"""
+    if not excerpt:
+        return ""
+    return (
+        "\n\nExcerpts from the full text (selected for relevance; "
+        "use them for implementation details):\n" + excerpt
+    )
+
+
+def _first_pass_prompt(paper: PaperInfo, excerpt: Optional[str], can_escalate: bool) -> str:
+    """ツールなしの tier で分析するプロンプト (次の tier があれば、Web検索が必要なときの返答を指定する)"""
+    lookup = (
+        f"""
+        If a good summary would require investigating "unknown technical terms" or
+        "implementation status" on the web, output only {NEEDS_LOOKUP} instead.
+        """
+        if can_escalate
+        else ""
+    )
+    return f"""
+        You are a thorough researcher.
+        Read the abstract below and summarize the "Core Contribution" in Japanese (about 300 characters).
+        {lookup}
+        Title: {paper['title']}
+        Abstract:
+        {paper['summary']}{_excerpt_section(excerpt)}
+        
+        Core Contribution (Japanese):
+        """
+
+
+def _first_pass_analysis(
+    ctx: AgentContext,
+    paper: PaperInfo,
+    tiers: List[str],
+    excerpt: Optional[str],
+    use_cache: bool,
+    counter: UsageCounter,
+    route: RouteDecision,
+) -> Optional[Tuple[str, str]]:
+    """
+    agent より前のツールなしの tier (fast / strong) で順に分析し、検査に通った (分析結果, tier) を返す
+    すべて検査に落ちた・予算を使い切っている・最後の tier の呼び出しに失敗した場合は None
+    agent を含まない並びでは、最後の tier の結果を検査によらず使う
+    """
+    cache = ctx.llm_cache
+    budget = current_run_budget()
+    for n, tier in enumerate(tiers):
+        if tier == TIER_AGENT:
+            break
+        final = n == len(tiers) - 1
+        model = ctx.router.model(tier)
+        prompt = _first_pass_prompt(paper, excerpt, can_escalate=not final)
+        started = time.monotonic()
+        cache_key = cache.make_key("analyze_paper_first_pass", model, prompt)
+        analysis = cache.get(cache_key) if use_cache else None
+        if use_cache:
+            record_cache("llm", analysis is not None)
+        if analysis is None:
+            if budget is not None and budget.exhausted() is not None:
+                return None
+            try:
+                with record_usage(counter):
+                    response = ctx.tier_llms[tier].invoke([HumanMessage(content=prompt)])
+                analysis = response.content
+            except Exception as e:
+                logger.warning(
+                    "first-pass analysis failed",
+                    arxiv_id=paper["arxiv_id"],
+                    tier=tier,
+                    error=str(e),
+                )
+                record_attempt(route, tier, model, started, REASON_ERROR)
+                continue
+            cache.set(cache_key, analysis)
+        reason = check_analysis(analysis, paper["title"])
+        record_attempt(route, tier, model, started, reason)
+        if reason is None or final:
+            return analysis, tier
+        logger.info(
+            "escalating paper analysis", arxiv_id=paper["arxiv_id"], tier=tier, reason=reason
+        )
+    return None
+
+
+def _analyze_single_paper(
+    ctx: AgentContext,
+    paper: PaperInfo,
+    index: int,
+    total: int,
+    use_cache: bool,
+    emit,
+    max_tool_calls: Optional[int],
+    tiers: List[str],
+    excerpt: Optional[str] = None,
+) -> Tuple[str, List[str], PaperUsage]:
+    """
+    1本の論文を tiers の順に分析し、(分析結果, Web検索ログ, 使用量) を返す
+    別の実行 (バッチの他のキーワードなど) が同じ論文を分析中なら、
+    終わるのを待ってストアに保存された結果を使う
+    """
+    if not use_cache:
+        return _run_paper_analysis(
+            ctx, paper, index, total, use_cache, emit, max_tool_calls, tiers, excerpt
+        )
+    with ctx.paper_store.claim(paper["arxiv_id"]):
+        return _run_paper_analysis(
+            ctx, paper, index, total, use_cache, emit, max_tool_calls, tiers, excerpt
+        )
+
+
+def _run_paper_analysis(
+    ctx: AgentContext,
+    paper: PaperInfo,
+    index: int,
+    total: int,
+    use_cache: bool,
+    emit,
+    max_tool_calls: Optional[int],
+    tiers: List[str],
+    excerpt: Optional[str] = None,
+) -> Tuple[str, List[str], PaperUsage]:
+    """
+    分析済みの結果 (ストア・キャッシュ) があれば使い、なければ tiers の順に分析する
+    ツールなしの tier の結果が検査に通ればそれを使い、通らなければエージェントで分析する
+    予算を使い切っていれば分析を省略し、途中で使い切った場合はそれまでの回答を返す
+    本文の抜粋 (excerpt) を使う分析はクエリによって内容が変わるので、論文ストアには保存しない
+    """
+    logger.debug("analyzing paper", index=index, total=total, title=paper["title"][:30])
+    started = time.monotonic()
+    store = ctx.paper_store
+    full_text = excerpt is not None
+    use_store = use_cache and not full_text
+    if use_store:
+        stored = store.get(paper["arxiv_id"])
+        reusable = _reusable_analysis(ctx, stored)
+        record_cache("paper_store", reusable)
+        if reusable:
+            logger.debug("reused stored analysis", index=index)
+            return (
+                stored["analysis"],
+                stored["web_search_logs"],
+                _paper_usage(paper, "store", started),
+            )
+
+    prompt = f"""
         You are a thorough researcher.
         Read the abstract below and summarize the "Core Contribution" in Japanese (about 300 characters).
         
@@ -143,40 +1258,535 @@ def analyze_paper_with_llm(state: AgentState) -> AgentState:
             
         Title: {paper['title']}
         Abstract:
-        {paper['summary']}
+        {paper['summary']}{_excerpt_section(excerpt)}
         
         Core Contribution (Japanese):
         """
-        try:
-            result = agent_executor.invoke(
-                {"messages": [HumanMessage(content=prompt)]}
+    cache = ctx.llm_cache
+    cache_key = cache.make_key("analyze_paper", LLM_MODEL, prompt, ctx.tools)
+    use_agent = TIER_AGENT in tiers
+    # エージェントで分析済みの結果があれば、安い tier も呼ばずにそれを使う
+    if use_cache and use_agent:
+        cached = cache.get(cache_key)
+        record_cache("llm", cached is not None)
+        if cached is not None:
+            logger.debug("used cached analysis", index=index)
+            if not full_text:
+                _store_analysis(
+                    store, paper, cached["analysis"], cached["web_search_logs"]
+                )
+            return (
+                cached["analysis"],
+                cached["web_search_logs"],
+                _paper_usage(paper, "cache", started, full_text=full_text),
             )
-            messages = result["messages"]
-            for msg in messages:
-                if isinstance(msg, AIMessage) and msg.tool_calls:
-                    for tool_call in msg.tool_calls:
-                        if tool_call["name"] == "web_search":
-                            query = tool_call["args"].get("query")
-                            log_entry = (
-                                f"{query} (Context: {paper['title'][:20]}...)"
-                            )
-                            all_web_search_logs.append(log_entry)
-            final_response = messages[-1].content
-            analysis_results.append(final_response)
-        except Exception as e:
-            print(f"Error analyzing paper {i}: {e}")
-            analysis_results.append("分析中にエラーが発生しました。")
+
+    counter = UsageCounter()
+    route = new_decision(NODE_ANALYZE_PAPER, paper["arxiv_id"])
+    first_pass = _first_pass_analysis(
+        ctx, paper, tiers, excerpt, use_cache, counter, route
+    )
+    if first_pass is not None:
+        analysis, tier = first_pass
+        if not full_text:
+            _store_analysis(store, paper, analysis, [], ctx.router.model(tier))
+        return (
+            analysis,
+            [],
+            _paper_usage(
+                paper, tier, started, counter, full_text=full_text, route=route
+            ),
+        )
+
+    budget = current_run_budget()
+    reason = budget.exhausted() if budget is not None else None
+    if reason is not None:
+        logger.info("skipped paper: budget exhausted", index=index, reason=reason)
+        return (
+            _skipped_analysis(reason),
+            [],
+            _paper_usage(
+                paper,
+                "skipped",
+                started,
+                counter,
+                degraded=reason,
+                full_text=full_text,
+                route=route if route["attempts"] else None,
+            ),
+        )
+    if not use_agent:
+        # 最後の tier の呼び出しに失敗した
+        return (
+            "分析中にエラーが発生しました。",
+            [],
+            _paper_usage(
+                paper, route["tier"], started, counter, full_text=full_text, route=route
+            ),
+        )
+
+    web_search_logs: List[str] = []
+    tool_budget = ToolCallBudget(max_tool_calls)
+    agent_started = time.monotonic()
+    # ツール呼び出しをその場で通知できるよう、ステップごとに状態を受け取る
+    messages = []
+    try:
+        with record_usage(counter), limit_tool_calls(tool_budget):
+            for step in ctx.analysis_agent.stream(
+                {"messages": [HumanMessage(content=prompt)]},
+                {"recursion_limit": _agent_recursion_limit(max_tool_calls)},
+                stream_mode="values",
+            ):
+                new_messages = step["messages"][len(messages) :]
+                messages = step["messages"]
+                for msg in new_messages:
+                    if isinstance(msg, AIMessage) and msg.tool_calls:
+                        for tool_call in msg.tool_calls:
+                            if tool_call["name"] == "web_search":
+                                query = tool_call["args"].get("query")
+                                log_entry = f"{query} (Context: {paper['title'][:20]}...)"
+                                web_search_logs.append(log_entry)
+                                emit(
+                                    {
+                                        "type": "tool_call",
+                                        "index": index,
+                                        "tool": tool_call["name"],
+                                        "query": query,
+                                    }
+                                )
+        analysis = messages[-1].content
+        degraded = tool_budget.refused_reason
+        if analysis.startswith(_AGENT_STEP_LIMIT_MESSAGE):
+            logger.info("stopped agent at step limit", index=index)
+            analysis = _best_answer(messages)
+            degraded = degraded or BUDGET_TOOL_CALLS
+    except GraphRecursionError:
+        # 拒否してもツールを呼び続けた場合は、それまでの回答で打ち切る
+        logger.info("stopped agent at step limit", index=index)
+        analysis = _best_answer(messages)
+        degraded = BUDGET_TOOL_CALLS
+    except Exception as e:
+        # 1本の失敗が他の論文の分析に波及しないようにする
+        logger.error("analyzing paper failed", index=index, error=str(e))
+        record_attempt(route, TIER_AGENT, LLM_MODEL, agent_started, REASON_ERROR)
+        return (
+            "分析中にエラーが発生しました。",
+            web_search_logs,
+            _paper_usage(
+                paper,
+                "agent",
+                started,
+                counter,
+                tool_budget.calls,
+                full_text=full_text,
+                route=route,
+            ),
+        )
+    # エージェントの結果は検査によらず使う (検査の結果は記録だけする)
+    record_attempt(
+        route, TIER_AGENT, LLM_MODEL, agent_started, check_analysis(analysis, paper["title"])
+    )
+
+    # 予算切れで打ち切った結果は、予算に余裕のある次回の分析で上書きできるよう保存しない
+    if degraded is None:
+        cache.set(
+            cache_key, {"analysis": analysis, "web_search_logs": web_search_logs}
+        )
+        if not full_text:
+            _store_analysis(store, paper, analysis, web_search_logs)
+    return (
+        analysis,
+        web_search_logs,
+        _paper_usage(
+            paper,
+            "agent",
+            started,
+            counter,
+            tool_budget.calls,
+            degraded,
+            full_text,
+            route,
+        ),
+    )
+
+
+def _emit_analysis(
+    emit, index: int, paper: PaperInfo, analysis: str, web_search_logs: List[str]
+) -> None:
+    """完了した論文から順に通知する"""
+    emit(
+        {
+            "type": "analysis",
+            "index": index,
+            "title": paper["title"],
+            "analysis": analysis,
+            "web_search_logs": web_search_logs,
+        }
+    )
+
+
+def _summarize_batch(
+    ctx: AgentContext,
+    papers: List[PaperInfo],
+    use_cache: bool,
+    excerpts: List[Optional[str]],
+) -> Tuple[List[Optional[dict]], Dict[str, int]]:
+    """
+    複数の論文を1回のLLM呼び出しでまとめて要約する
+    論文ごとの {"summary", "needs_lookup"} (結果が得られなかった論文は None) と、
+    この呼び出しの使用量を返す。予算を使い切っていれば呼び出さない
+    excerpts は論文ごとの本文の抜粋 (full_text モードでなければすべて None)
+    """
+    abstracts = "\n\n".join(
+        f"[{i}] Title: {paper['title']}\nAbstract:\n{paper['summary']}"
+        f"{_excerpt_section(excerpt)}"
+        for i, (paper, excerpt) in enumerate(zip(papers, excerpts))
+    )
+    prompt = f"""
+    You are a thorough researcher.
+    For each paper below, read the abstract and summarize the "Core Contribution" in Japanese (about 300 characters).
+    Set needs_lookup to true only if the summary would require investigating
+    "unknown technical terms" or "implementation status" on the web.
+    Return exactly one item per paper, using the paper number as index.
+
+    {abstracts}
+    """
+    counter = UsageCounter()
+    cache = ctx.llm_cache
+    cache_key = cache.make_key("analyze_batch", LLM_MODEL, prompt)
+    if use_cache:
+        cached = cache.get(cache_key)
+        record_cache("llm", cached is not None)
+        if cached is not None:
+            return cached, counter.snapshot()
+
+    budget = current_run_budget()
+    if budget is not None and budget.exhausted() is not None:
+        return [None] * len(papers), counter.snapshot()
+
+    try:
+        with record_usage(counter):
+            response = ctx.batch_llm.invoke([HumanMessage(content=prompt)])
+    except Exception as e:
+        # まとめて要約できなかった論文はすべてエージェントでの分析に回す
+        logger.error("batch analysis failed", error=str(e))
+        return [None] * len(papers), counter.snapshot()
+
+    by_index = {
+        item.index: {"summary": item.summary, "needs_lookup": item.needs_lookup}
+        for item in response.items
+    }
+    items = [by_index.get(i) for i in range(len(papers))]
+    cache.set(cache_key, items)
+    return items, counter.snapshot()
+
+
+# 論文ごと・バッチごとの分析は LangGraph のタスクとして実行する。
+# 完了したタスクの結果はチェックポイントに残り、ノードを再開したときは実行せずにその結果を返す。
+# 再開時の結果の対応付けは呼び出し順で行われるため、タスクはノードのスレッドから決まった順に呼び出す
+
+
+@task(name="extract_full_text")
+def _full_text_task(ctx: AgentContext, paper: PaperInfo, query: str) -> Optional[str]:
+    return _full_text_excerpt(ctx, paper, query)
+
+
+@task(name="analyze_single_paper")
+def _analyze_paper_task(
+    ctx: AgentContext,
+    paper: PaperInfo,
+    index: int,
+    total: int,
+    use_cache: bool,
+    emit,
+    max_tool_calls: Optional[int],
+    tiers: List[str],
+    slots: threading.Semaphore,
+    full_text_query: Optional[str],
+) -> Tuple[str, List[str], PaperUsage]:
+    """
+    1本の論文の分析 (slots で同時に実行する数を制限する)
+    full_text_query があれば、分析の枠を待つ前に本文を取得しておく
+    (ダウンロードの同時実行数は FullTextStore が制限する)
+    """
+    excerpt = (
+        _full_text_excerpt(ctx, paper, full_text_query)
+        if full_text_query is not None
+        else None
+    )
+    with slots:
+        analysis, web_search_logs, usage = _analyze_single_paper(
+            ctx, paper, index, total, use_cache, emit, max_tool_calls, tiers, excerpt
+        )
+    _emit_analysis(emit, index, paper, analysis, web_search_logs)
+    return analysis, web_search_logs, usage
+
+
+@task(name="plan_batched_analysis")
+def _plan_batched_task(
+    ctx: AgentContext, papers: List[PaperInfo], use_cache: bool
+) -> Dict[str, list]:
+    """
+    ストアにある論文の結果 ([番号, 分析結果, Web検索ログ]) と、まとめて要約する論文の番号を返す
+    再開時にストアの内容が変わっていても同じ分け方になるようタスクにしている
+    """
+    stored_results = []
+    pending = []
+    for i, paper in enumerate(papers):
+        stored = ctx.paper_store.get(paper["arxiv_id"]) if use_cache else None
+        reusable = _reusable_analysis(ctx, stored)
+        if use_cache:
+            record_cache("paper_store", reusable)
+        if reusable:
+            stored_results.append([i, stored["analysis"], stored["web_search_logs"]])
+        else:
+            pending.append(i)
+    return {"stored": stored_results, "pending": pending}
+
+
+@task(name="summarize_batch")
+def _summarize_batch_task(
+    ctx: AgentContext,
+    papers: List[PaperInfo],
+    use_cache: bool,
+    excerpts: List[Optional[str]],
+    slots: threading.Semaphore,
+) -> Tuple[List[Optional[dict]], Dict[str, int]]:
+    with slots:
+        return _summarize_batch(ctx, papers, use_cache, excerpts)
+
+
+def _analyze_batched(
+    ctx: AgentContext,
+    papers: List[PaperInfo],
+    use_cache: bool,
+    slots: threading.Semaphore,
+    results: List[Optional[tuple]],
+    usages: List[Optional[PaperUsage]],
+    emit,
+    full_text_query: Optional[str],
+) -> List[int]:
+    """
+    batched モードの分析
+    ストアにある論文とまとめて要約できた論文の結果と使用量を results / usages に書き込み、
+    Web検索が必要 (またはまとめて要約できなかった) 論文の番号を返す
+    full_text_query があれば、ストアは使わずに全論文の本文を並列に取得してから要約する
+    """
+    started = time.monotonic()
+    plan = _plan_batched_task(
+        ctx, papers, use_cache and full_text_query is None
+    ).result()
+    for i, analysis, web_search_logs in plan["stored"]:
+        results[i] = (analysis, web_search_logs)
+        usages[i] = _paper_usage(papers[i], "store", started)
+        _emit_analysis(emit, i, papers[i], *results[i])
+    pending: List[int] = plan["pending"]
+    excerpts: List[Optional[str]] = [None] * len(papers)
+    if full_text_query is not None:
+        excerpt_futures = [
+            (i, _full_text_task(ctx, papers[i], full_text_query)) for i in pending
+        ]
+        for i, future in excerpt_futures:
+            excerpts[i] = future.result()
+
+    batches = [
+        pending[start : start + ANALYSIS_BATCH_SIZE]
+        for start in range(0, len(pending), ANALYSIS_BATCH_SIZE)
+    ]
+    logger.info("batched analysis", papers=len(pending), calls=len(batches))
+    futures = [
+        _summarize_batch_task(
+            ctx,
+            [papers[i] for i in batch],
+            use_cache,
+            [excerpts[i] for i in batch],
+            slots,
+        )
+        for batch in batches
+    ]
+
+    needs_lookup: List[int] = []
+    for batch, future in zip(batches, futures):
+        items, batch_usage = future.result()
+        for i, item in zip(batch, items):
+            if item is None or item["needs_lookup"]:
+                needs_lookup.append(i)
+                continue
+            # 自己申告で検索が不要でも、要約が検査 (長さ・日本語・主要な用語) に落ちたらエージェントに回す
+            reason = check_analysis(item["summary"], papers[i]["title"])
+            if reason is not None:
+                logger.info(
+                    "escalating batch summary", arxiv_id=papers[i]["arxiv_id"], reason=reason
+                )
+                needs_lookup.append(i)
+                continue
+            results[i] = (item["summary"], [])
+            # まとめて呼び出した分の使用量は論文数で等分する
+            usages[i] = PaperUsage(
+                arxiv_id=papers[i]["arxiv_id"],
+                source="batch",
+                llm_calls=batch_usage["llm_calls"],
+                total_tokens=batch_usage["total_tokens"] // len(batch),
+                tool_calls=0,
+                seconds=round(time.monotonic() - started, 3),
+                degraded=None,
+                full_text=excerpts[i] is not None,
+                route=None,
+            )
+            if excerpts[i] is None:
+                _store_analysis(ctx.paper_store, papers[i], item["summary"], [])
+            _emit_analysis(emit, i, papers[i], item["summary"], [])
+    logger.info("papers need web lookup", count=len(needs_lookup))
+    return needs_lookup
+
+
+def analyze_paper_with_llm(
+    state: AgentState, runtime: Runtime[AgentContext]
+) -> AgentState:
+    """
+    ノード3: LLMで論文を分析する
+    必要なら検索する機能を追加
+    論文ごとのエージェントは最大 ANALYSIS_MAX_CONCURRENCY 本まで並列に実行する
+    論文ごとの結果はチェックポイントに残るので、途中で失敗しても再開時は残りの論文だけを分析する
+    論文ごとに MODEL_ROUTE_ANALYZE_PAPER の tier の順に試し、安い tier の結果が検査に通らなければ
+    強い tier (エージェントなど) で分析し直す
+    batched モードではまとめて要約し、Web検索が必要な論文だけ安い tier を飛ばして分析する
+    full_text モードではPDFの本文からクエリに関連する箇所を選び、アブストラクトと合わせて使う
+    予算 (トークン数・実行時間) を使い切った後の論文は分析を省略する
+    """
+    papers = state.get("core_papers")
+    if not papers:
+        return state
+    ctx = _context(runtime)
+    use_cache = not state.get("bypass_cache")
+    analysis_mode = state.get("analysis_mode") or ANALYSIS_MODE_AGENT
+    max_tool_calls = state.get("max_tool_calls_per_paper")
+    if max_tool_calls is None:
+        max_tool_calls = ANALYSIS_MAX_TOOL_CALLS_PER_PAPER
+    full_text_query = _full_text_query(state) if state.get("full_text") else None
+    tiers = ctx.router.tiers(NODE_ANALYZE_PAPER)
+    emit = _get_event_writer()
+    # この分析で行ったWeb検索のキャッシュヒット数を集計する (タスクのスレッドへ引き継がれる)
+    search_stats = SearchStats()
+    stats_token = current_search_stats.set(search_stats)
+
+    results: List[Optional[tuple]] = [None] * len(papers)
+    usages: List[Optional[PaperUsage]] = [None] * len(papers)
+    agent_indices = list(range(len(papers)))
+    slots = threading.Semaphore(max(1, min(ANALYSIS_MAX_CONCURRENCY, len(papers))))
+    try:
+        if analysis_mode == ANALYSIS_MODE_BATCHED:
+            agent_indices = _analyze_batched(
+                ctx, papers, use_cache, slots, results, usages, emit, full_text_query
+            )
+            # まとめての要約が安い tier の代わりになる
+            tiers = [tier for tier in tiers if tier != TIER_FAST] or [TIER_AGENT]
+        futures = [
+            (
+                i,
+                _analyze_paper_task(
+                    ctx,
+                    papers[i],
+                    i,
+                    len(papers),
+                    use_cache,
+                    emit,
+                    max_tool_calls,
+                    tiers,
+                    slots,
+                    full_text_query,
+                ),
+            )
+            for i in agent_indices
+        ]
+        # 論文の番号で結果を書き込むので、並び順はそのまま保たれる
+        for i, future in futures:
+            analysis, web_search_logs, usages[i] = future.result()
+            results[i] = (analysis, web_search_logs)
+    finally:
+        current_search_stats.reset(stats_token)
+
+    analysis_results: List[str] = [analysis for analysis, _ in results]
+    all_web_search_logs: List[str] = [log for _, logs in results for log in logs]
+    stats_summary = search_stats.summary()
+    if stats_summary:
+        all_web_search_logs.append(stats_summary)
+    degraded = [usage["degraded"] for usage in usages if usage["degraded"]]
+    routes = [usage["route"] for usage in usages if usage.get("route")]
 
     return {
         **state,
         "analysis": analysis_results,
         "web_search_logs": all_web_search_logs,
+        "analysis_mode": analysis_mode,
+        "agent_analyzed_ids": [papers[i]["arxiv_id"] for i in agent_indices],
+        "paper_usage": usages,
+        "routing": [*(state.get("routing") or []), *routes],
+        "budget_exhausted": degraded[0] if degraded else state.get("budget_exhausted"),
     }
 
 
+def _paper_sections(state: AgentState, heading: str) -> str:
+    """論文ごとの分析のセクション (heading は見出しの "#")"""
+    papers = state.get("core_papers") or []
+    analyses = state.get("analysis") or []
+    relevance_scores = state.get("relevance_scores")
+    published = state.get("candidate_published") or {}
+    sections = ""
+    for i, (paper, analysis) in enumerate(zip(papers, analyses)):
+        sections += f"{heading} {i+1}. {paper['title']}\n"
+        sections += f"**URL:** {paper['url']}\n\n"
+        if paper["arxiv_id"] in published:
+            sections += f"**投稿日:** {published[paper['arxiv_id']][:10]}\n\n"
+        if relevance_scores:
+            sections += f"**関連度:** {relevance_scores[i]:.2f}\n\n"
+        sections += f"{analysis}\n\n"
+        # sections += f"### 要約 (Abstract)\n{paper['summary']}\n"
+        sections += "---\n"
+    return sections
+
+
+def _budget_notice(state: AgentState) -> str:
+    budget_exhausted = state.get("budget_exhausted")
+    if not budget_exhausted:
+        return ""
+    return (
+        f"> ⚠️ 予算の上限 ({budget_exhausted}) に達したため、"
+        "一部の論文は分析を省略または途中で打ち切っています。\n\n"
+    )
+
+
+def _compile_update(state: AgentState) -> AgentState:
+    """
+    購読用の compile_report: 既存のレポートファイルに追記する新着論文のブロックを作る
+    新着論文がなければ report_markdown は空文字列
+    """
+    papers = state.get("core_papers")
+    if not papers or not state.get("analysis"):
+        _get_event_writer()({"type": "report", "report_markdown": ""})
+        return {**state, "report_markdown": ""}
+
+    report = f"## 📅 {datetime.now().strftime('%Y-%m-%d')} の新着論文 ({len(papers)}件"
+    candidate_count = state.get("candidate_count")
+    if candidate_count:
+        report += f" / 新着 {candidate_count}件から関連度順に選択"
+    report += ")\n\n"
+    web_logs = state.get("web_search_logs")
+    if web_logs:
+        report += "**実行されたWeb検索 (DuckDuckGo):** "
+        report += ", ".join(f"`{log}`" for log in web_logs) + "\n\n"
+    report += _budget_notice(state)
+    report += _paper_sections(state, "###")
+
+    report = report.strip()
+    _get_event_writer()({"type": "report", "report_markdown": report})
+    return {**state, "report_markdown": report}
+
+
 def compile_report(state: AgentState) -> AgentState:
-    """ノード3: レポート作成（検索クエリの記録を追加）"""
-    print("compiling report...")
+    """ノード4: レポート作成（検索クエリの記録を追加）"""
+    if state.get("incremental"):
+        return _compile_update(state)
 
     papers = state.get("core_papers")
     analyses = state.get("analysis")
@@ -201,34 +1811,137 @@ def compile_report(state: AgentState) -> AgentState:
             report += f"- `{log}`\n"
         report += "\n"
 
-    report += f"\n**ヒット件数:** {len(papers)}件\n\n"
+    report += f"\n**ヒット件数:** {len(papers)}件"
+    candidate_count = state.get("candidate_count")
+    if candidate_count:
+        report += f" (候補 {candidate_count}件から関連度順に選択)"
+    report += "\n\n"
+    report += _budget_notice(state)
     report += "---\n\n"
+    report += _paper_sections(state, "##")
 
-    for i, (paper, analysis) in enumerate(zip(papers, analyses)):
-        report += f"## {i+1}. {paper['title']}\n"
-        report += f"**URL:** {paper['url']}\n\n"
-        report += f"{analysis}\n\n"
-        # report += f"### 要約 (Abstract)\n{paper['summary']}\n"
-        report += "---\n"
+    report = report.strip()
+    _get_event_writer()({"type": "report", "report_markdown": report})
+    return {**state, "report_markdown": report}
 
-    return {**state, "report_markdown": report.strip()}
+
+# グラフのノードを実行順に並べたもの (進捗表示にも使う)
+PIPELINE_NODES = [
+    "generate_queries",
+    "find_core_papers",
+    "rank_papers",
+    "analyze_paper",
+    "compile_report",
+]
+
+
+_agent = None
+_agent_lock = threading.Lock()
 
 
 def get_agent():
-    builder = StateGraph(AgentState)
+    """コンパイル済みのグラフを返す (コンパイルはプロセスで1回だけ)"""
+    global _agent
+    with _agent_lock:
+        if _agent is None:
+            _agent = _build_agent()
+        return _agent
+
+
+def _run_budget(state: AgentState) -> RunBudget:
+    """state に記録された予算と、これまでに使った量から予算を作る"""
+    return RunBudget(
+        max_tokens=state.get("max_tokens"),
+        max_seconds=state.get("max_seconds"),
+        started_at=state.get("started_at") or time.time(),
+        tokens_used=state.get("tokens_used") or 0,
+    )
+
+
+def _track_usage(name: str, node):
+    """
+    ノードの実行時間とLLMの使用量を node_usage とメトリクスに記録するラッパー
+    ノード内のLLM呼び出しはリクエスト全体の予算にも数えられる
+    """
+    takes_runtime = "runtime" in inspect.signature(node).parameters
+
+    def run(state: AgentState, runtime: Runtime[AgentContext]) -> AgentState:
+        logger.info("node started", node=name)
+        started = time.monotonic()
+        budget = _run_budget(state)
+        counter = UsageCounter()
+        try:
+            with span(f"node.{name}", node=name), record_usage(counter, budget=budget):
+                result = node(state, runtime) if takes_runtime else node(state)
+        except Exception:
+            NODE_ERRORS.inc(node=name)
+            logger.exception("node failed", node=name)
+            raise
+        finally:
+            NODE_DURATION.observe(time.monotonic() - started, node=name)
+        usage = NodeUsage(
+            **counter.snapshot(), seconds=round(time.monotonic() - started, 3)
+        )
+        NODE_TOKENS.inc(usage["prompt_tokens"], node=name, kind="prompt")
+        NODE_TOKENS.inc(usage["completion_tokens"], node=name, kind="completion")
+        logger.info("node finished", node=name, **usage)
+        return {
+            **result,
+            "started_at": budget.started_at,
+            "tokens_used": budget.tokens_used,
+            "node_usage": {**(result.get("node_usage") or {}), name: usage},
+        }
+
+    return run
+
+
+def _build_agent():
+    builder = StateGraph(AgentState, context_schema=AgentContext)
+
+    nodes = {
+        "generate_queries": generate_queries,
+        "find_core_papers": find_core_papers,
+        "rank_papers": rank_papers,
+        "analyze_paper": analyze_paper_with_llm,
+        "compile_report": compile_report,
+    }
+    for name in PIPELINE_NODES:
+        builder.add_node(name, _track_usage(name, nodes[name]))
+
+    builder.add_edge(START, PIPELINE_NODES[0])
+    for current_node, next_node in zip(PIPELINE_NODES, PIPELINE_NODES[1:]):
+        builder.add_edge(current_node, next_node)
+    builder.add_edge(PIPELINE_NODES[-1], END)
+
+    return builder.compile(checkpointer=get_checkpointer())
+
+
+def run_config(run_id: str) -> Dict[str, Any]:
+    """run_id (APIではジョブID) をチェックポイントのスレッドIDにした実行設定"""
+    return {"configurable": {"thread_id": run_id}, "recursion_limit": 100}
+
+
+def load_checkpoint(agent, run_id: str) -> Optional[StateSnapshot]:
+    """
+    run_id の最新のチェックポイントを返す (チェックポイントが無効・存在しなければ None)
+    `snapshot.next` が空でなければ `agent.stream(None, run_config(run_id))` で続きから実行できる
+    """
+    if agent.checkpointer is None:
+        return None
+    snapshot = agent.get_state(run_config(run_id))
+    return snapshot if snapshot.values else None
+
 
-    builder.add_node("generate_queries", generate_queries)
-    builder.add_node("find_core_papers", find_core_papers)
-    builder.add_node("analyze_paper", analyze_paper_with_llm)
-    builder.add_node("compile_report", compile_report)
+def completed_nodes(state: Dict[str, Any]) -> List[str]:
+    """state までに完了したノード (再開した実行の進捗表示に使う)"""
+    node_usage = state.get("node_usage") or {}
+    return [name for name in PIPELINE_NODES if name in node_usage]
 
-    builder.add_edge(START, "generate_queries")
-    builder.add_edge("generate_queries", "find_core_papers")
-    builder.add_edge("find_core_papers", "analyze_paper")
-    builder.add_edge("analyze_paper", "compile_report")
-    builder.add_edge("compile_report", END)
 
-    return builder.compile()
+def clear_checkpoint(agent, run_id: str) -> None:
+    """完了した実行のチェックポイントを削除する"""
+    if agent.checkpointer is not None:
+        agent.checkpointer.delete_thread(run_id)
 
 
 if __name__ == "__main__":
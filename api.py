@@ -12,11 +12,139 @@ REST APIのエントリーポイント。
     http://localhost:8000/redoc (ReDoc)
 """
 
-from fastapi import FastAPI, HTTPException, status
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
 
-from agent import AgentState, get_agent
-from schemas import AnalysisRequest, AnalysisResponse, ErrorResponse, PaperResponse
+from config import load_env, validate_config
+
+# 各モジュールは設定をインポート時に読むため、.env はほかのモジュールより先に読み込む
+load_env()
+
+from batch import batch_item_id, item_key  # noqa: E402
+from compression import CompressionMiddleware  # noqa: E402
+from jobs import (  # noqa: E402
+    JOB_FAILED,
+    JOB_SUCCEEDED,
+    EventCallback,
+    Job,
+    JobEventLog,
+    JobManager,
+    JobNotResumableError,
+    JobQueueFullError,
+    ProgressCallback,
+    create_job_store,
+)
+from model_router import summarize_tiers  # noqa: E402
+from observability import REGISTRY, configure_logging, get_logger  # noqa: E402
+from paper_store import canonical_arxiv_id  # noqa: E402
+from resilience import BREAKER_CLOSED, breaker_states  # noqa: E402
+from results import Projection, ResultStore, content_hash, etag_matches, make_etag  # noqa: E402
+from schemas import (  # noqa: E402
+    AnalysisJobResponse,
+    AnalysisRequest,
+    AnalysisResponse,
+    BatchAnalysisRequest,
+    BatchItemResponse,
+    ErrorResponse,
+    PaperResponse,
+    StoredPaperResponse,
+    UsageResponse,
+)
+from state_backend import get_state_backend  # noqa: E402
+
+if TYPE_CHECKING:
+    # agent.py (LangGraph / LangChain) は読み込みに時間がかかるため、起動後にバックグラウンドで読み込む
+    from agent import AgentContext, AgentState
+
+logger = get_logger("api")
+
+# === ジョブ実行の設定 ===
+# 同時に実行する分析ジョブ数と、それとは別に待たせておけるジョブ数
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "2"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "8"))
+# 指定するとジョブをSQLiteに保存し、再起動後も参照・再開できる
+# (STATE_BACKEND_PATH を指定した場合はそちらに保存し、ワーカー間で共有する)
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "")
+# ジョブを担当するワーカーがこの秒数応答しなければ、止まったとみなして別のワーカーが引き取る
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# 429 を返すときに Retry-After で示す秒数
+JOB_RETRY_AFTER_SECONDS = 30
+# 失敗したジョブを自動で再実行する回数 (チェックポイントから続きを実行する)
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "1"))
+
+# 完了したジョブの結果 (GET /analyses/{id}) はキャッシュに保存してよいが、使う前に再検証させる。
+# 内容のハッシュで参照する結果 (GET /results/{hash}) は変わらないので、期限なく保存させる
+ANALYSIS_CACHE_CONTROL = "no-cache"
+RESULT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# SSEで新しいイベントを確認する間隔と、接続維持用コメントを送る間隔（秒）
+SSE_POLL_INTERVAL_SECONDS = 0.5
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def _load_pipeline() -> Tuple[Any, "AgentContext"]:
+    """agent.py を読み込み、コンパイル済みのグラフとクライアント群を用意する"""
+    started = time.monotonic()
+    try:
+        from agent import get_agent, get_agent_context
+
+        pipeline = get_agent(), get_agent_context()
+    except Exception as e:
+        logger.error("loading analysis pipeline failed", error=str(e))
+        raise
+    logger.info("analysis pipeline ready", seconds=round(time.monotonic() - started, 2))
+    return pipeline
+
+
+def _pipeline() -> Tuple[Any, "AgentContext"]:
+    """起動時に用意を始めたグラフとクライアント群を返す (準備中なら完了を待つ)"""
+    return app.state.pipeline.result()
+
+
+def _pipeline_ready() -> bool:
+    pipeline: Future = app.state.pipeline
+    return pipeline.done() and pipeline.exception() is None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時に設定を確認してジョブ実行基盤を用意し、終了時に片付ける"""
+    validate_config()
+    configure_logging()
+    # グラフのコンパイルとクライアント生成はリクエストごとではなく起動時に1回だけ行う。
+    # 重いライブラリの読み込みを伴うので、接続の受け付けを始めてからバックグラウンドで行い、
+    # ヘルスチェックは待たせない (分析ジョブは準備が終わるまで待ってから実行する)
+    warm_up = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-warm-up")
+    app.state.pipeline = warm_up.submit(_load_pipeline)
+    warm_up.shutdown(wait=False)
+    backend = get_state_backend(JOB_STORE_PATH)
+    app.state.result_store = ResultStore(backend)
+    app.state.job_manager = JobManager(
+        store=create_job_store(backend),
+        runner=_run_analysis_job,
+        max_workers=JOB_MAX_WORKERS,
+        max_queue=JOB_MAX_QUEUE,
+        max_retries=JOB_MAX_RETRIES,
+        lease_seconds=JOB_LEASE_SECONDS,
+        result_store=app.state.result_store,
+    )
+    resumed = app.state.job_manager.resume_unfinished()
+    if resumed:
+        logger.info("resumed unfinished analysis jobs", count=resumed)
+    yield
+    app.state.job_manager.shutdown()
+
 
 # === FastAPIアプリの初期化 ===
 app = FastAPI(
@@ -30,11 +158,21 @@ app = FastAPI(
     - LLMによる論文分析とレポート生成
 
     ## REST設計
-    - `POST /analyses` : 新しい分析を作成（リソースの作成）
+    - `POST /analyses` : 新しい分析ジョブを作成（202 Accepted）
+    - `POST /analyses:batch` : 多数のキーワードをまとめて分析し、結果をNDJSONで受け取る
+    - `GET /analyses/{id}` : 分析ジョブの状態・結果を取得（ETag / If-None-Match、`fields` で部分取得）
+    - `GET /results/{hash}` : 完了した分析結果を内容のハッシュで取得（変わらないのでキャッシュできる）
+    - `POST /analyses/{id}/resume` : 失敗したジョブを続きから再実行
+    - `GET /analyses/{id}/events` : 分析の途中経過をSSEで受け取る
+    - `GET /papers/{arxiv_id}` : 分析済みの論文を取得
     - `GET /` : ヘルスチェック
+    - `GET /metrics` : Prometheus形式のメトリクス
     """,
     version="1.0.0",
+    lifespan=lifespan,
 )
+# gzip / brotli でレスポンスを圧縮する (SSE・NDJSONのストリームは除く)
+app.add_middleware(CompressionMiddleware)
 
 
 # === エンドポイント定義 ===
@@ -47,83 +185,662 @@ def root():
 
     APIが正常に動作しているか確認するために使用します。
     RESTでは、ルートパスにAPIの状態を返すエンドポイントを置くのが一般的です。
+    外部API (OpenAI / arXiv / DuckDuckGo) のブレーカーが開いている間は `status` が `degraded` になります。
+    起動直後は分析パイプラインをバックグラウンドで用意しており、終わるまで `ready` が false
+    (`llm_cache` が null) になります。その間に受け付けた分析は準備が終わってから実行されます。
+    """
+    upstreams = breaker_states()
+    degraded = any(state["state"] != BREAKER_CLOSED for state in upstreams.values())
+    ready = _pipeline_ready()
+    return {
+        "status": "degraded" if degraded else "ok",
+        "message": "Paper Analysis API is running",
+        "ready": ready,
+        "llm_cache": _pipeline()[1].llm_cache.stats() if ready else None,
+        "jobs": app.state.job_manager.stats(),
+        "upstreams": upstreams,
+    }
+
+
+JOBS_ACTIVE = REGISTRY.gauge(
+    "paper_agent_jobs_active", "実行中 + 待機中の分析ジョブ数"
+)
+JOBS_CAPACITY = REGISTRY.gauge(
+    "paper_agent_jobs_capacity", "同時に受け付けられる分析ジョブ数"
+)
+LLM_CACHE_ENTRIES = REGISTRY.gauge(
+    "paper_agent_llm_cache_entries", "LLMキャッシュの保存件数"
+)
+
+
+def _collect_state_metrics() -> None:
+    """/metrics の出力前に、ジョブとキャッシュの現在の状態をゲージに入れる"""
+    job_manager = getattr(app.state, "job_manager", None)
+    if job_manager is not None:
+        jobs = job_manager.stats()
+        JOBS_ACTIVE.set(jobs["active"])
+        JOBS_CAPACITY.set(jobs["capacity"])
+    if getattr(app.state, "pipeline", None) is not None and _pipeline_ready():
+        LLM_CACHE_ENTRIES.set(_pipeline()[1].llm_cache.stats()["entries"])
+
+
+REGISTRY.add_collector(_collect_state_metrics)
+
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus形式のメトリクス
+
+    ノードごとの実行時間・トークン数、外部API (OpenAI / arXiv / DuckDuckGo) の
+    所要時間・失敗数・リトライ数、キャッシュのヒット数、ジョブの受付状況を返す。
     """
-    return {"status": "ok", "message": "Paper Analysis API is running"}
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def run_analysis(
+    request: AnalysisRequest,
+    on_progress: Optional[ProgressCallback] = None,
+    on_event: Optional[EventCallback] = None,
+    run_id: Optional[str] = None,
+) -> AnalysisResponse:
+    """
+    分析パイプラインを最後まで実行してレスポンスを組み立てる
+
+    チェックポイントは run_id (ジョブID、省略時は新しいID) をキーに保存する。
+    同じIDのチェックポイントが残っていれば (前回の失敗・プロセス停止)、
+    完了済みのノードと論文の分析は飛ばして続きから実行する。
+
+    on_progress が指定されていれば、ノードが切り替わるたびに
+    (実行中のノード, 完了したノード一覧) を通知する。
+    on_event が指定されていれば、ノード内の途中経過
+    （生成クエリ・見つかった論文・論文ごとの分析・ツール呼び出し・レポート）を通知する。
+    """
+    from agent import (
+        PIPELINE_NODES,
+        clear_checkpoint,
+        completed_nodes as checkpoint_completed_nodes,
+        load_checkpoint,
+        run_config,
+    )
+
+    # 起動時に用意したグラフとクライアントを使う
+    agent, context = _pipeline()
+
+    # 初期状態を作成
+    initial_state: AgentState = {
+        "keyword": request.keyword,
+        "queries": [],
+        "core_papers": None,
+        "analysis": None,
+        "web_search_logs": None,
+        "report_markdown": None,
+        "bypass_cache": request.bypass_cache,
+        "analysis_mode": request.analysis_mode,
+        "full_text": request.full_text,
+        "top_k": request.top_k,
+        "min_score": request.min_score,
+        "max_tokens": request.max_tokens,
+        "max_tool_calls_per_paper": request.max_tool_calls_per_paper,
+        "max_seconds": request.max_seconds,
+    }
+
+    started_at = time.time()
+    result = initial_state
+    inputs: Optional[AgentState] = initial_state
+    completed_nodes: List[str] = []
+    run_id = run_id or uuid.uuid4().hex
+    config = run_config(run_id)
+    checkpoint = load_checkpoint(agent, run_id)
+    if checkpoint is not None:
+        # 保存済みの状態から再開する (入力に None を渡すと続きから実行される)
+        logger.info("resuming analysis", run_id=run_id, next=list(checkpoint.next))
+        inputs = None
+        result = checkpoint.values
+        completed_nodes = checkpoint_completed_nodes(result)
+    else:
+        logger.info("starting analysis", keyword=request.keyword, run_id=run_id)
+
+    # エージェントを実行 (完了済みのチェックポイントなら何も実行されない)
+    if on_progress:
+        next_index = len(completed_nodes)
+        on_progress(
+            PIPELINE_NODES[next_index] if next_index < len(PIPELINE_NODES) else None,
+            completed_nodes,
+        )
+    for mode, chunk in agent.stream(
+        inputs,
+        config,
+        context=context,
+        stream_mode=["updates", "custom"],
+        durability="sync",
+    ):
+        if mode == "custom":
+            if on_event:
+                on_event(chunk)
+            continue
+        # 各ノードは更新後の状態全体を返す (ノード内のタスクの結果は進捗に含めない)
+        node_name, update = next(iter(chunk.items()))
+        if node_name not in PIPELINE_NODES:
+            continue
+        result = update
+        completed_nodes.append(node_name)
+        if on_progress:
+            next_index = len(completed_nodes)
+            next_node = (
+                PIPELINE_NODES[next_index]
+                if next_index < len(PIPELINE_NODES)
+                else None
+            )
+            on_progress(next_node, completed_nodes)
+
+    clear_checkpoint(agent, run_id)
+
+    # レスポンスを構築
+    papers = result.get("core_papers") or []
+    scores = result.get("relevance_scores") or [None] * len(papers)
+    return AnalysisResponse(
+        keyword=result["keyword"],
+        queries=result.get("queries", []),
+        papers_count=len(papers),
+        candidates_count=result.get("candidate_count") or len(papers),
+        papers=[
+            PaperResponse(
+                arxiv_id=p["arxiv_id"],
+                title=p["title"],
+                summary=p["summary"],
+                url=p["url"],
+                relevance_score=score,
+            )
+            for p, score in zip(papers, scores)
+        ],
+        report_markdown=result.get("report_markdown") or "",
+        web_search_logs=result.get("web_search_logs") or [],
+        analysis_mode=result.get("analysis_mode") or request.analysis_mode,
+        agent_analyzed_ids=result.get("agent_analyzed_ids") or [],
+        usage=UsageResponse(
+            total_tokens=result.get("tokens_used") or 0,
+            elapsed_seconds=round(time.time() - started_at, 3),
+            budget_exhausted=result.get("budget_exhausted"),
+            nodes=result.get("node_usage") or {},
+            papers=result.get("paper_usage") or [],
+            routing=result.get("routing") or [],
+            tiers=summarize_tiers(result.get("routing") or []),
+        ),
+    )
+
+
+def _run_analysis_job(
+    job_id: str,
+    request: dict,
+    on_progress: ProgressCallback,
+    on_event: EventCallback,
+) -> dict:
+    """ジョブワーカーから呼ばれる: dict で受け取り dict で返す (ジョブIDでチェックポイントを保存する)"""
+    return run_analysis(
+        AnalysisRequest(**request), on_progress, on_event, run_id=job_id
+    ).model_dump()
+
+
+def _to_job_response(job: Job, coalesced: bool = False) -> AnalysisJobResponse:
+    return AnalysisJobResponse(
+        id=job["id"],
+        coalesced=coalesced,
+        status=job["status"],
+        keyword=job["request"]["keyword"],
+        current_node=job["current_node"],
+        completed_nodes=job["completed_nodes"],
+        result=job["result"],
+        result_hash=job.get("result_hash"),
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    )
 
 
 @app.post(
     "/analyses",
-    response_model=AnalysisResponse,
-    status_code=status.HTTP_201_CREATED,
+    response_model=AnalysisJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
     tags=["Analyses"],
     responses={
-        201: {"description": "分析が正常に完了"},
+        202: {"description": "分析ジョブを受け付けた"},
         400: {"model": ErrorResponse, "description": "リクエストが不正"},
-        500: {"model": ErrorResponse, "description": "サーバーエラー"},
+        429: {"model": ErrorResponse, "description": "実行待ちのジョブが多すぎる"},
     },
 )
-def create_analysis(request: AnalysisRequest):
+def create_analysis(request: AnalysisRequest, response: Response):
     """
-    新しい論文分析を実行
+    新しい論文分析ジョブを作成
 
     ## RESTの観点
-    - **POST** を使用: 新しいリソース（分析結果）を「作成」するため
-    - **201 Created** を返す: リソースが正常に作成されたことを示す
-    - **リクエストボディ**: JSON形式でキーワードを送信
-    - **レスポンス**: 作成されたリソース（分析結果）を返す
+    - **POST** を使用: 新しいリソース（分析ジョブ）を「作成」するため
+    - **202 Accepted** を返す: 処理は受け付けたが、まだ完了していないことを示す
+    - **Location ヘッダー**: 状態を確認するためのURL（`GET /analyses/{id}`）
+    - **429 Too Many Requests**: 待ち行列が一杯のときは受け付けずに再試行を促す
+    - 同じキーワード（全角/半角・大文字/小文字・空白の違いは無視）の分析が実行中なら、
+      新しく実行せずにそのジョブを返す（`coalesced: true`）
 
-    ## 処理フロー
+    ## 処理フロー（ジョブとしてバックグラウンドで実行）
     1. キーワードを受け取る
     2. arXiv検索クエリを生成
-    3. 論文を検索
-    4. LLMで分析
-    5. レポートを生成して返す
+    3. 論文の候補を検索
+    4. キーワードとの関連度で上位 `top_k` 件に絞り込む
+    5. LLMで分析
+    6. レポートを生成し、ジョブの結果として保存
     """
     try:
-        # エージェントを取得
-        agent = get_agent()
-
-        # 初期状態を作成
-        initial_state: AgentState = {
-            "keyword": request.keyword,
-            "queries": [],
-            "core_papers": None,
-            "analysis": None,
-            "web_search_logs": None,
-            "report_markdown": None,
-        }
-
-        # エージェントを実行
-        print(f"\n{'=' * 50}")
-        print(f"Starting analysis for: {request.keyword}")
-        print(f"{'=' * 50}")
-
-        result = agent.invoke(initial_state)
-
-        # レスポンスを構築
-        papers = result.get("core_papers", [])
-        return AnalysisResponse(
-            keyword=result["keyword"],
-            queries=result.get("queries", []),
-            papers_count=len(papers),
-            papers=[
-                PaperResponse(title=p["title"], summary=p["summary"], url=p["url"])
-                for p in papers
-            ],
-            report_markdown=result.get("report_markdown", ""),
-            web_search_logs=result.get("web_search_logs", []),
+        job, coalesced = app.state.job_manager.submit(
+            request.model_dump(), dedupe_key=item_key(request.model_dump())
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(JOB_RETRY_AFTER_SECONDS)},
         )
+    response.headers["Location"] = f"/analyses/{job['id']}"
+    return _to_job_response(job, coalesced)
+
+
+async def _batch_stream(batch_id: str, items: List[AnalysisRequest], request: Request):
+    """
+    バッチの項目をジョブとして順に投入し、終わった順に結果を1行ずつ返す
+    1つのバッチが同時に実行するのは JOB_MAX_WORKERS 件までにして、
+    他のクライアントのジョブが待ち行列に入る余地を残す
+    ジョブストア (SQLite) の読み書きはイベントループを止めないようスレッドプールで行う
+    """
+    manager = app.state.job_manager
+    # 同じ条件の項目は1つのジョブにまとめ、結果をそれぞれの項目として返す
+    groups: Dict[str, List[int]] = {}
+    for index, item in enumerate(items):
+        groups.setdefault(item_key(item.model_dump()), []).append(index)
+    pending = deque(groups.items())
+    # ジョブID -> そのジョブの結果を返す項目
+    running: Dict[str, List[int]] = {}
+    while pending or running:
+        if await request.is_disconnected():
+            # 投入済みのジョブはそのまま実行を続ける (同じ batch_id で送り直せば結果を受け取れる)
+            logger.info("batch client disconnected", batch_id=batch_id, remaining=len(pending))
+            return
+        while pending and len(running) < JOB_MAX_WORKERS:
+            dedupe_key, indices = pending[0]
+            try:
+                job, _ = await run_in_threadpool(
+                    manager.submit,
+                    items[indices[0]].model_dump(),
+                    dedupe_key=dedupe_key,
+                    job_id=batch_item_id(batch_id, indices[0]),
+                )
+            except JobQueueFullError:
+                break
+            pending.popleft()
+            running.setdefault(job["id"], []).extend(indices)
+        for job_id in list(running):
+            job = await run_in_threadpool(manager.get, job_id)
+            if job["status"] not in (JOB_SUCCEEDED, JOB_FAILED):
+                continue
+            for index in running.pop(job_id):
+                line = BatchItemResponse(
+                    index=index,
+                    id=job_id,
+                    keyword=items[index].keyword,
+                    status=job["status"],
+                    result=job["result"],
+                    error=job["error"],
+                )
+                yield line.model_dump_json() + "\n"
+        if pending or running:
+            await asyncio.sleep(SSE_POLL_INTERVAL_SECONDS)
 
+
+@app.post(
+    "/analyses:batch",
+    tags=["Analyses"],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "項目ごとの結果 (BatchItemResponse を1行ずつ)",
+        },
+    },
+)
+def create_batch_analysis(batch: BatchAnalysisRequest, request: Request):
+    """
+    多数のキーワードをまとめて分析し、終わった順に結果を NDJSON で返す
+
+    ## RESTの観点
+    - **POST** を使用: 項目ごとに新しいリソース（分析ジョブ）を「作成」するため
+    - 各行は `BatchItemResponse`（`index` / `id` / `status` / `result` / `error`）
+    - 項目はジョブのワーカープールで並列に実行し、論文の検索結果・分析結果は
+      キーワード間で共有する（同じ論文を同時に分析する場合は先の分析を待って再利用する）
+    - ジョブIDは `batch_id` と項目の位置から決まる。接続が切れても投入済みのジョブは続き、
+      同じ `batch_id` で送り直すと完了済みの項目は結果だけを返し、失敗した項目は続きから実行する
+    - `X-Batch-Id` ヘッダーでバッチIDを返す
+    """
+    batch_id = batch.batch_id or uuid.uuid4().hex
+    return StreamingResponse(
+        _batch_stream(batch_id, batch.items, request),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id, "X-Accel-Buffering": "no"},
+    )
+
+
+_FIELDS_DESCRIPTION = (
+    "返す分析結果のフィールド（カンマ区切り、例: `report_markdown` / `keyword,papers`）。"
+    "省略時はすべて"
+)
+_ABSTRACTS_DESCRIPTION = "false にすると論文のアブストラクト（`papers[].summary`）を除く"
+
+
+def _projection(fields: Optional[str], include_abstracts: bool) -> Projection:
+    try:
+        return Projection.parse(fields, include_abstracts, list(AnalysisResponse.model_fields))
     except ValueError as e:
-        # 論文が見つからない等のビジネスロジックエラー
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        # 予期せぬエラー
-        print(f"Error during analysis: {e}")
+
+
+def _job_etag(job: Job, projection: Projection) -> str:
+    """
+    ジョブの表現の ETag (本文を組み立てずに計算する)
+    完了したジョブは結果の内容のハッシュ、それ以外は状態が変わると変わる値から作る
+    """
+    base = job.get("result_hash") or content_hash(
+        [job["status"], job["current_node"], job["completed_nodes"], job["error"], job["updated_at"]]
+    )
+    return make_etag(base, projection)
+
+
+def _not_modified(etag: str, cache_control: str) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": cache_control},
+    )
+
+
+@app.get(
+    "/analyses/{job_id}",
+    response_model=AnalysisJobResponse,
+    tags=["Analyses"],
+    responses={
+        304: {"description": "If-None-Match の ETag から変わっていない"},
+        400: {"model": ErrorResponse, "description": "fields の指定が不正"},
+        404: {"model": ErrorResponse, "description": "ジョブが存在しない"},
+    },
+)
+def get_analysis(
+    job_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description=_FIELDS_DESCRIPTION),
+    include_abstracts: bool = Query(True, description=_ABSTRACTS_DESCRIPTION),
+):
+    """
+    分析ジョブの状態と結果を取得
+
+    ## RESTの観点
+    - **GET** を使用: 既存リソース（分析ジョブ）を「取得」するため
+    - クライアントは `status` が `succeeded` / `failed` になるまでポーリングする
+    - 実行中は `current_node` で処理中のLangGraphノードがわかる
+    - **ETag / If-None-Match**: 前回の `ETag` を `If-None-Match` で送ると、
+      変わっていなければ本文なしの **304 Not Modified** を返す
+      （完了したジョブの ETag は結果の内容のハッシュ `result_hash` から作る）
+    - **部分取得**: `fields` で `result` のフィールドを絞り、`include_abstracts=false` で
+      論文のアブストラクトを除ける（表示に使わない部分を転送しない）
+    """
+    projection = _projection(fields, include_abstracts)
+    job = app.state.job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"ジョブ {job_id} は存在しません",
+        )
+    etag = _job_etag(job, projection)
+    headers = {"ETag": etag, "Cache-Control": ANALYSIS_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return _not_modified(etag, ANALYSIS_CACHE_CONTROL)
+    if projection.is_full or job["result"] is None:
+        return JSONResponse(_to_job_response(job).model_dump(mode="json"), headers=headers)
+    body = _to_job_response({**job, "result": None}).model_dump(mode="json")
+    body["result"] = projection.apply(job["result"])
+    return JSONResponse(body, headers=headers)
+
+
+@app.get(
+    "/results/{result_hash}",
+    response_model=AnalysisResponse,
+    tags=["Analyses"],
+    responses={
+        304: {"description": "If-None-Match の ETag と同じ内容"},
+        400: {"model": ErrorResponse, "description": "fields の指定が不正"},
+        404: {"model": ErrorResponse, "description": "結果が存在しない（保存期間切れを含む）"},
+    },
+)
+def get_result(
+    result_hash: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description=_FIELDS_DESCRIPTION),
+    include_abstracts: bool = Query(True, description=_ABSTRACTS_DESCRIPTION),
+):
+    """
+    完了した分析結果を内容のハッシュで取得
+
+    ## RESTの観点
+    - **GET** を使用: 既存リソース（分析結果）を「取得」するため
+    - **パスパラメータ**: 結果の内容のハッシュ（ジョブの `result_hash`）。
+      同じURLの内容は変わらないため、`Cache-Control: immutable` で中継キャッシュにも保存させる
+    - `fields` / `include_abstracts` による部分取得は `GET /analyses/{id}` と同じ
+    """
+    projection = _projection(fields, include_abstracts)
+    etag = make_etag(result_hash, projection)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return _not_modified(etag, RESULT_CACHE_CONTROL)
+    result = app.state.result_store.get(result_hash)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"結果 {result_hash} は存在しません",
+        )
+    return JSONResponse(
+        projection.apply(result),
+        headers={"ETag": etag, "Cache-Control": RESULT_CACHE_CONTROL},
+    )
+
+
+@app.post(
+    "/analyses/{job_id}/resume",
+    response_model=AnalysisJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Analyses"],
+    responses={
+        202: {"description": "ジョブを再実行の待ち行列に入れた"},
+        404: {"model": ErrorResponse, "description": "ジョブが存在しない"},
+        409: {"model": ErrorResponse, "description": "ジョブが失敗していない"},
+        429: {"model": ErrorResponse, "description": "実行待ちのジョブが多すぎる"},
+    },
+)
+def resume_analysis(job_id: str, response: Response):
+    """
+    失敗した分析ジョブを同じジョブIDで再実行
+
+    ## RESTの観点
+    - **POST** を使用: ジョブに対する「操作」であり、冪等ではないため
+    - **202 Accepted** を返す: 状態は `GET /analyses/{id}` で確認する
+    - **409 Conflict**: 実行中・完了済みのジョブは再開できない
+
+    チェックポイントが残っていれば、完了済みのノードと論文の分析は飛ばして続きから実行する
+    """
+    try:
+        job = app.state.job_manager.resume(job_id)
+    except JobNotResumableError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(JOB_RETRY_AFTER_SECONDS)},
+        )
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"ジョブ {job_id} は存在しません",
+        )
+    response.headers["Location"] = f"/analyses/{job_id}"
+    return _to_job_response(job)
+
+
+def _format_sse(event_id: int, event: dict) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+async def _poll_job_stream(job: Job, start: int, request: Request):
+    """
+    他のワーカーが実行中のジョブは、共有のジョブストアを見てノードの進捗と終了だけを送る
+    (論文ごとの途中経過は実行しているワーカーにしかない)
+    ジョブストアの読み込みはイベントループを止めないようスレッドプールで行う
+    """
+    index = start
+    idle = 0.0
+    last_progress = None
+    manager = app.state.job_manager
+    while not await request.is_disconnected():
+        job = await run_in_threadpool(manager.get, job["id"])
+        if job["status"] in (JOB_SUCCEEDED, JOB_FAILED):
+            yield _format_sse(
+                index,
+                {
+                    "type": "done",
+                    "status": job["status"],
+                    "result": job["result"],
+                    "error": job["error"],
+                },
+            )
+            return
+        progress = (job["current_node"], job["completed_nodes"])
+        if progress != last_progress:
+            last_progress = progress
+            yield _format_sse(
+                index,
+                {
+                    "type": "progress",
+                    "current_node": job["current_node"],
+                    "completed_nodes": job["completed_nodes"],
+                },
+            )
+            index += 1
+            idle = 0.0
+            continue
+        await asyncio.sleep(SSE_POLL_INTERVAL_SECONDS)
+        idle += SSE_POLL_INTERVAL_SECONDS
+        if idle >= SSE_KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            idle = 0.0
+
+
+async def _sse_stream(
+    job: Job, log: Optional[JobEventLog], start: int, request: Request
+):
+    if log is None and job["status"] not in (JOB_SUCCEEDED, JOB_FAILED):
+        async for chunk in _poll_job_stream(job, start, request):
+            yield chunk
+        return
+    if log is None:
+        # イベント列が残っていないジョブ（再起動前など）は現在の状態だけ返す
+        yield _format_sse(
+            0,
+            {
+                "type": "done",
+                "status": job["status"],
+                "result": job["result"],
+                "error": job["error"],
+            },
+        )
+        return
+
+    index = start
+    idle = 0.0
+    while not await request.is_disconnected():
+        events, closed = log.read(index)
+        for event in events:
+            yield _format_sse(index, event)
+            index += 1
+        if events:
+            idle = 0.0
+            continue
+        if closed:
+            return
+        await asyncio.sleep(SSE_POLL_INTERVAL_SECONDS)
+        idle += SSE_POLL_INTERVAL_SECONDS
+        if idle >= SSE_KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            idle = 0.0
+
+
+@app.get(
+    "/analyses/{job_id}/events",
+    tags=["Analyses"],
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/event-stream": {}}, "description": "イベントストリーム"},
+        404: {"model": ErrorResponse, "description": "ジョブが存在しない"},
+    },
+)
+def stream_analysis_events(job_id: str, request: Request):
+    """
+    分析ジョブの途中経過を Server-Sent Events で配信
+
+    ## RESTの観点
+    - **GET** を使用: 既存リソース（分析ジョブ）の状態変化を「取得」し続けるため
+    - `data` はJSONで、`type` によって内容が変わる:
+      `progress` / `queries` / `paper` / `tool_call` / `analysis` / `report` / `done`
+    - 接続時点までのイベントも先頭から再送する。
+      `Last-Event-ID` ヘッダーを付けると、その続きから受け取れる
+    - `done` イベントを送ったらストリームを閉じる
+    """
+    job = app.state.job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"ジョブ {job_id} は存在しません",
+        )
+    try:
+        start = int(request.headers.get("last-event-id", "-1")) + 1
+    except ValueError:
+        start = 0
+    return StreamingResponse(
+        _sse_stream(job, app.state.job_manager.events(job_id), start, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get(
+    "/papers/{arxiv_id:path}",
+    response_model=StoredPaperResponse,
+    tags=["Papers"],
+    responses={
+        404: {"model": ErrorResponse, "description": "未分析の論文"},
+    },
+)
+def get_paper(arxiv_id: str):
+    """
+    分析済みの論文を取得
+
+    ## RESTの観点
+    - **GET** を使用: 既存リソース（論文の分析結果）を「取得」するため
+    - **パスパラメータ**: arXiv ID でリソースを一意に特定する
+      （`2301.00001v2` のようなバージョン付きIDも受け付ける）
+    - **404 Not Found**: まだ分析されていない論文
+    """
+    paper = _pipeline()[1].paper_store.get(canonical_arxiv_id(arxiv_id))
+    if paper is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"分析中にエラーが発生しました: {str(e)}",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"論文 {arxiv_id} の分析結果はありません",
         )
+    return StoredPaperResponse(**paper)
 
 
 # === 開発用：直接実行時の起動 ===
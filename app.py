@@ -4,18 +4,46 @@ app.py - Streamlit フロントエンド
 REST APIを呼び出すシンプルなGUIです。
 APIとフロントエンドが分離していることで、REST設計の恩恵を確認できます。
 
+- APIへのHTTP接続はプロセス内の全セッションで共有するプールから使い回す
+- ヘルスチェックの結果は HEALTH_CHECK_TTL_SECONDS の間キャッシュし、再描画のたびには問い合わせない
+- 分析はジョブを作成したら描画を終え、完了するまで POLL_INTERVAL_SECONDS ごとに
+  ページの一部 (st.fragment) だけを再実行して状態を取得する (長い接続を保持しない)
+- 完了した結果はセッションの履歴に残し、再描画・タブの切り替え・履歴の選択ではAPIを呼ばない
+
 起動方法:
     1. まずAPIサーバーを起動: uv run uvicorn api:app --reload
     2. 別ターミナルでStreamlit起動: uv run streamlit run app.py
 """
 
 import os
+import time
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 
 # === 設定 ===
 # Cloud Run では環境変数 API_BASE_URL でAPIのURLを指定する
 API_BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:8000")
+# APIへのリクエストのタイムアウト（接続, 読み込み）（秒）
+REQUEST_TIMEOUT = (3.05, 10)
+# ヘルスチェックの結果をキャッシュする秒数と、1回のヘルスチェックのタイムアウト（秒）
+HEALTH_CHECK_TTL_SECONDS = float(os.environ.get("HEALTH_CHECK_TTL_SECONDS", "30"))
+HEALTH_CHECK_TIMEOUT_SECONDS = 2
+# 実行中のジョブの状態を取得する間隔（秒）
+POLL_INTERVAL_SECONDS = float(os.environ.get("POLL_INTERVAL_SECONDS", "2"))
+# プールに残すAPIへの接続数（フロントエンドのプロセスごと）
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+# セッションの履歴に残す結果の数
+HISTORY_MAX_ENTRIES = 10
+
+# ノード名と表示用ラベルの対応
+NODE_LABELS = {
+    "generate_queries": "検索クエリを生成中",
+    "find_core_papers": "論文を検索中",
+    "rank_papers": "関連度で絞り込み中",
+    "analyze_paper": "論文を分析中",
+    "compile_report": "レポートを作成中",
+}
 
 # === ページ設定 ===
 st.set_page_config(page_title="Paper Analysis", page_icon="📚", layout="wide")
@@ -30,22 +58,187 @@ arXivの論文を検索・分析してレポートを生成します。
 st.divider()
 
 
-# === API状態確認 ===
+# === API呼び出し ===
+@st.cache_resource
+def get_http_session():
+    """
+    プロセス内の全セッションで共有するHTTPセッション
+    接続をプールして使い回し、操作のたびに新しい接続を張らない
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=HEALTH_CHECK_TTL_SECONDS, show_spinner=False)
 def check_api_health():
-    """APIのヘルスチェック (GET /)"""
+    """
+    APIのヘルスチェック (GET /)。応答のJSON、接続できなければ None を返す
+    結果は HEALTH_CHECK_TTL_SECONDS の間、全セッションで共有する
+    """
+    try:
+        response = get_http_session().get(
+            f"{API_BASE_URL}/", timeout=HEALTH_CHECK_TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def fetch_job(job_url):
+    """
+    GET /analyses/{id} でジョブを取得する
+    前回取得したときの ETag を If-None-Match で送り、変わっていなければ (304)
+    セッションに保存しておいた状態を使う (本文を受け取らず、JSONの解析もしない)
+    """
+    cached = st.session_state.job_cache.get(job_url)
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
+    response = get_http_session().get(job_url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached:
+        return cached["job"]
+    response.raise_for_status()
+    job = response.json()
+    if response.headers.get("ETag"):
+        st.session_state.job_cache = {
+            job_url: {"etag": response.headers["ETag"], "job": job}
+        }
+    return job
+
+
+def submit_analysis(keyword, top_k, full_text):
+    """
+    POST /analyses でジョブを作成し、完了を待たずに戻る (状態は poll_pending_job で取得する)
+    作成できなかった場合はエラーを表示する
+    """
     try:
-        response = requests.get(f"{API_BASE_URL}/", timeout=5)
-        return response.status_code == 200
+        response = get_http_session().post(
+            f"{API_BASE_URL}/analyses",
+            json={"keyword": keyword, "top_k": int(top_k), "full_text": full_text},
+            timeout=REQUEST_TIMEOUT,
+        )
     except requests.exceptions.ConnectionError:
-        return False
+        st.error("APIサーバーに接続できません。サーバーが起動しているか確認してください。")
+        return
+    except requests.exceptions.Timeout:
+        st.error("APIの応答がタイムアウトしました。しばらくしてから再実行してください。")
+        return
+
+    if response.status_code == 202:
+        job = response.json()
+        st.session_state.pending_job = {
+            "id": job["id"],
+            "keyword": keyword,
+            "url": f"{API_BASE_URL}{response.headers['Location']}",
+        }
+        st.session_state.job_error = None
+    elif response.status_code == 429:
+        st.warning("混み合っています。しばらくしてから再実行してください。")
+    elif response.status_code == 400:
+        st.error(f"リクエストエラー: {response.json().get('detail', '不明なエラー')}")
+    else:
+        st.error(f"エラー (HTTP {response.status_code}): {response.text}")
+
+
+def add_to_history(pending, result):
+    """完了した結果をセッションの履歴の先頭に加え、表示する結果にする"""
+    history = [entry for entry in st.session_state.history if entry["id"] != pending["id"]]
+    history.insert(
+        0,
+        {
+            "id": pending["id"],
+            "keyword": pending["keyword"],
+            "finished_at": time.strftime("%H:%M:%S"),
+            "result": result,
+        },
+    )
+    st.session_state.history = history[:HISTORY_MAX_ENTRIES]
+    st.session_state.selected_job = pending["id"]
+
+
+@st.fragment(run_every=POLL_INTERVAL_SECONDS)
+def poll_pending_job():
+    """
+    実行中のジョブの状態を POLL_INTERVAL_SECONDS ごとに取得して進み具合を表示する
+    (このフラグメントだけが再実行される)。完了したらページ全体を描画し直す
+    """
+    pending = st.session_state.pending_job
+    try:
+        job = fetch_job(pending["url"])
+    except requests.exceptions.RequestException as e:
+        st.warning(f"分析の状態を取得できませんでした（再試行します）: {e}")
+        return
+
+    if job["status"] in ("queued", "running"):
+        node = job.get("current_node")
+        completed = len(job.get("completed_nodes") or [])
+        st.progress(
+            min(completed / len(NODE_LABELS), 1.0),
+            text=f"「{pending['keyword']}」: "
+            + (NODE_LABELS.get(node, "実行待ち...") if node else "実行待ち..."),
+        )
+        st.caption("分析には数分かかる場合があります。このページを操作していても分析は続きます。")
+        return
+
+    st.session_state.pending_job = None
+    st.session_state.job_cache = {}
+    if job["status"] == "succeeded":
+        add_to_history(pending, job["result"])
+    else:
+        st.session_state.job_error = job.get("error") or "不明なエラー"
+    st.rerun()
 
 
+def show_result(data):
+    """完了した分析の結果を表示する"""
+    # 成功メッセージ
+    st.success(f"分析完了! {data['papers_count']}件の論文を分析しました")
+
+    # 生成されたクエリ
+    st.markdown("**生成された検索クエリ:**")
+    for q in data.get("queries", []):
+        st.code(q)
+
+    # Web検索ログ
+    if data.get("web_search_logs"):
+        with st.expander("実行されたWeb検索"):
+            for log in data["web_search_logs"]:
+                st.write(f"- {log}")
+
+    # タブで結果を表示
+    tab1, tab2, tab3 = st.tabs(["レポート", "論文一覧", "Raw JSON"])
+
+    with tab1:
+        st.markdown(data.get("report_markdown", "レポートなし"))
+
+    with tab2:
+        for i, paper in enumerate(data.get("papers", []), 1):
+            with st.expander(f"{i}. {paper['title'][:60]}..."):
+                st.markdown(f"**URL:** {paper['url']}")
+                if paper.get("relevance_score") is not None:
+                    st.markdown(f"**関連度:** {paper['relevance_score']:.2f}")
+                st.markdown("**概要:**")
+                st.write(paper["summary"][:500] + "...")
+
+    with tab3:
+        st.json(data)
+
+
+# 完了した結果の履歴・表示中の結果・実行中のジョブと、状態の取得に使う ETag
+if "history" not in st.session_state:
+    st.session_state.history = []
+    st.session_state.selected_job = None
+    st.session_state.pending_job = None
+    st.session_state.job_error = None
+    st.session_state.job_cache = {}
+
 # サイドバーにAPI状態を表示
 with st.sidebar:
     st.header("API Status")
-    if check_api_health():
-        st.success("API: 接続OK")
-    else:
+    health = check_api_health()
+    if health is None:
         st.error("API: 未接続")
         st.markdown("""
         APIサーバーを起動してください:
@@ -53,12 +246,24 @@ with st.sidebar:
         uv run uvicorn api:app --reload
         ```
         """)
+    elif not health.get("ready", True):
+        st.info("API: 起動準備中（分析は準備が終わってから実行されます）")
+    elif health.get("status") == "degraded":
+        st.warning("API: 一部の外部サービスが不調です")
+    else:
+        st.success("API: 接続OK")
+    st.caption(f"状態は {HEALTH_CHECK_TTL_SECONDS:.0f} 秒ごとに確認します")
+    if st.button("再確認", use_container_width=True):
+        check_api_health.clear()
+        st.rerun()
 
     st.divider()
     st.markdown("""
     ### エンドポイント
     - `GET /` - ヘルスチェック
-    - `POST /analyses` - 分析実行
+    - `POST /analyses` - 分析ジョブ作成
+    - `GET /analyses/{id}` - ジョブ状態・結果取得
+    - `GET /analyses/{id}/events` - 途中経過 (SSE)
 
     ### ドキュメント
     - [Swagger UI](http://localhost:8000/docs)
@@ -78,75 +283,53 @@ with col1:
         help="日本語でも英語でもOK。英語に自動変換されます。",
     )
 
-    # 分析実行ボタン
+    top_k = st.number_input(
+        "分析する論文数",
+        min_value=1,
+        max_value=20,
+        value=10,
+        help="候補の中からキーワードとの関連度が高い順に分析します。",
+    )
+
+    full_text = st.checkbox(
+        "本文も読む",
+        help="PDFの本文からキーワードに関連する箇所を選び、実装の詳細まで分析します（時間がかかります）。",
+    )
+
+    # 分析実行ボタン (実行中のジョブがある間は押せない)
     analyze_button = st.button(
-        "分析を実行", type="primary", disabled=not keyword, use_container_width=True
+        "分析を実行",
+        type="primary",
+        disabled=not keyword or st.session_state.pending_job is not None,
+        use_container_width=True,
     )
 
 with col2:
     st.subheader("結果")
 
     if analyze_button and keyword:
-        # API呼び出し
-        with st.spinner("分析中... (数分かかる場合があります)"):
-            try:
-                # POST /analyses にリクエスト
-                response = requests.post(
-                    f"{API_BASE_URL}/analyses",
-                    json={"keyword": keyword},
-                    timeout=300,  # 5分タイムアウト
-                )
-
-                if response.status_code == 201:
-                    data = response.json()
-
-                    # 成功メッセージ
-                    st.success(
-                        f"分析完了! {data['papers_count']}件の論文を分析しました"
-                    )
-
-                    # 生成されたクエリ
-                    st.markdown("**生成された検索クエリ:**")
-                    for q in data.get("queries", []):
-                        st.code(q)
-
-                    # Web検索ログ
-                    if data.get("web_search_logs"):
-                        with st.expander("実行されたWeb検索"):
-                            for log in data["web_search_logs"]:
-                                st.write(f"- {log}")
-
-                    # タブで結果を表示
-                    tab1, tab2, tab3 = st.tabs(["レポート", "論文一覧", "Raw JSON"])
-
-                    with tab1:
-                        st.markdown(data.get("report_markdown", "レポートなし"))
-
-                    with tab2:
-                        for i, paper in enumerate(data.get("papers", []), 1):
-                            with st.expander(f"{i}. {paper['title'][:60]}..."):
-                                st.markdown(f"**URL:** {paper['url']}")
-                                st.markdown("**概要:**")
-                                st.write(paper["summary"][:500] + "...")
-
-                    with tab3:
-                        st.json(data)
-
-                elif response.status_code == 400:
-                    st.error(
-                        f"リクエストエラー: {response.json().get('detail', '不明なエラー')}"
-                    )
-                else:
-                    st.error(f"エラー (HTTP {response.status_code}): {response.text}")
-
-            except requests.exceptions.ConnectionError:
-                st.error(
-                    "APIサーバーに接続できません。サーバーが起動しているか確認してください。"
-                )
-            except requests.exceptions.Timeout:
-                st.error("タイムアウトしました。分析に時間がかかりすぎています。")
-            except Exception as e:
-                st.error(f"予期せぬエラー: {e}")
-
-    elif not keyword:
+        submit_analysis(keyword, top_k, full_text)
+
+    if st.session_state.pending_job is not None:
+        poll_pending_job()
+    elif st.session_state.job_error:
+        st.error(f"分析エラー: {st.session_state.job_error}")
+
+    # 完了した結果はセッションに残っているものを表示する (APIは呼ばない)
+    history = st.session_state.history
+    if history:
+        entries = {entry["id"]: entry for entry in history}
+        if st.session_state.selected_job not in entries:
+            st.session_state.selected_job = history[0]["id"]
+        if len(history) > 1:
+            st.selectbox(
+                "表示する結果",
+                options=list(entries),
+                format_func=lambda job_id: (
+                    f"{entries[job_id]['keyword']}（{entries[job_id]['finished_at']}）"
+                ),
+                key="selected_job",
+            )
+        show_result(entries[st.session_state.selected_job]["result"])
+    elif st.session_state.pending_job is None and not keyword:
         st.info("キーワードを入力して「分析を実行」をクリックしてください")
@@ -0,0 +1,107 @@
+"""
+batch.py - 多数のキーワードをまとめて分析するバッチの共通処理
+
+入力は JSONL (1行に1件)。各行に、バッチIDと行番号から決まる実行IDを割り当てます。
+途中で止まったバッチを同じバッチIDで実行し直すと、完了済みの行は飛ばし、
+途中まで進んでいた行はチェックポイントの続きから実行できます。
+"""
+
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, List
+
+from search_cache import normalize_query
+
+# CLIのバッチで同時に分析するキーワード数
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+
+BATCH_SUCCEEDED = "succeeded"
+BATCH_FAILED = "failed"
+
+
+def load_batch_file(path: str) -> List[Dict[str, Any]]:
+    """
+    バッチの入力を読み込む
+    各行は分析リクエストのJSONオブジェクト ({"keyword": ..., "top_k": ...}) か、
+    キーワードだけのJSON文字列。空行と # で始まる行は無視する
+    """
+    items: List[Dict[str, Any]] = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: JSONとして読めません ({e})")
+            if isinstance(item, str):
+                item = {"keyword": item}
+            if not isinstance(item, dict) or not item.get("keyword"):
+                raise ValueError(f"{path}:{line_number}: keyword がありません")
+            items.append(item)
+    return items
+
+
+def batch_item_id(batch_id: str, index: int) -> str:
+    """バッチ内の1件の実行ID (同じバッチIDと行番号なら何度実行しても同じ)"""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"paper-agent-batch:{batch_id}:{index}").hex
+
+
+def item_key(item: Dict[str, Any]) -> str:
+    """
+    同じ分析とみなすためのキー (CLIのバッチと、APIのジョブの相乗りで共通)
+    キーワードの表記ゆれ (全角/半角・大文字/小文字・空白) を無視し、その他の条件は区別する
+    bypass_cache も区別する (キャッシュを使う実行に、再分析を求めるリクエストを相乗りさせない)
+    """
+    options = {k: v for k, v in item.items() if k != "keyword"}
+    return json.dumps(
+        {"keyword": normalize_query(item["keyword"]), **options},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+
+
+class BatchLog:
+    """
+    バッチの結果を書き出す JSONL (完了した順に1行1件)
+
+    結果は1件ごとに追記してフラッシュするので、途中で止まっても完了済みの行は残る。
+    実行し直すときは completed() で成功済みの行番号を読み直して飛ばす
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def completed(self) -> Dict[int, Dict[str, Any]]:
+        """成功済みの行番号 -> 結果 (ファイルがなければ空)"""
+        if not os.path.exists(self.path):
+            return {}
+        records: Dict[int, Dict[str, Any]] = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で止まった最後の行は読み飛ばす
+                    continue
+                if record.get("status") == BATCH_SUCCEEDED:
+                    records[record["index"]] = record
+        return records
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a+b") as f:
+                # 書き込み途中で止まった行があれば、その続きに書かないよう改行する
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write((line + "\n").encode("utf-8"))
+                f.flush()
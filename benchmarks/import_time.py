@@ -0,0 +1,206 @@
+"""
+import_time.py - 起動時間 (インポート時間とヘルスチェックまでの時間) の計測と予算の確認
+
+`python -X importtime` でエントリーポイントのモジュールを新しいプロセスで読み込み、
+累積のインポート時間と時間のかかったモジュールを出力する。`--health` では uvicorn でAPIを起動し、
+プロセスの起動から `GET /` が応答するまでの時間を計測する (スケールトゥゼロのコールドスタート)。
+リクエストには `Accept-Encoding` を付け、圧縮を含むミドルウェアを実際に組み立てて通す。
+ロックした依存関係で確かめる場合は `uv run --frozen` で実行する。
+
+- 計測値 (複数回の中央値) が予算を超えた場合、または起動時に読み込まないはずの重いモジュール
+  (LangGraph / LangChain など。分析パイプラインの準備はバックグラウンドで行う) が
+  読み込まれた場合は終了コード 1 で終わる。CIで起動時間の後退を検出するのに使う
+- ヘルスチェックがエラー (5xx など) を返した場合は待たずに終了コード 1 で終わる
+- 外部APIには接続しない (APIキーは計測用のダミーを使う)
+
+実行方法:
+    uv run --frozen python -m benchmarks.import_time [--repeat 5] [--health] [--json-output result.json]
+"""
+
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+import typer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# エントリーポイントごとのインポート時間の予算 (ms)
+IMPORT_BUDGETS_MS = {
+    "api": 800.0,  # uvicorn api:app (ヘルスチェックを返すまでに読み込むもの)
+    "main": 500.0,  # main.py --help
+    "agent": 2000.0,  # 分析パイプライン (APIではバックグラウンドで読み込む)
+}
+# プロセスの起動から GET / が応答するまでの予算 (ms)
+HEALTH_BUDGET_MS = 1000.0
+
+# 起動時に読み込まないモジュール (読み込まれたら予算に関係なく失敗にする)
+DEFERRED_MODULES = {
+    "api": ["agent", "langgraph", "langchain_core", "langchain_openai", "langchain_community", "arxiv", "pypdf"],
+    "main": ["agent", "langgraph", "langchain_core", "langchain_openai", "langchain_community", "arxiv", "pypdf"],
+    "agent": ["langchain_openai", "langchain_community", "pypdf"],
+}
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def _environment() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark-dummy")
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    新しいプロセスで module を読み込み、(累積のインポート時間 ms, [(モジュール名, 累積 ms)]) を返す
+    モジュールの一覧はトップレベルのパッケージごとにまとめ、累積時間の大きい順に並べる
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR,
+        env=_environment(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0.0
+    children: Dict[str, float] = {}
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        cumulative_ms = int(match.group(2)) / 1000
+        name = match.group(4)
+        if name == module and not match.group(3):
+            total = cumulative_ms
+        else:
+            top = name.split(".")[0]
+            children[top] = max(children.get(top, 0.0), cumulative_ms)
+    return total, sorted(children.items(), key=lambda item: -item[1])
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_health(timeout: float) -> float:
+    """
+    uvicorn でAPIを起動し、GET / が200を返すまでの時間 (ms) を返す
+    起動前の接続エラーは待ち続け、APIがエラーを返した場合は RuntimeError にする
+    """
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+        env=_environment(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/", headers={"Accept-Encoding": "br, gzip"}
+        )
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(request, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except urllib.error.HTTPError as e:
+                raise RuntimeError(f"ヘルスチェックがエラーを返しました: HTTP {e.code}") from e
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"{timeout:.0f} 秒以内にヘルスチェックが応答しませんでした")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(
+    modules: List[str] = typer.Option(
+        list(IMPORT_BUDGETS_MS), "--module", help="計測するモジュール (複数指定可)"
+    ),
+    repeat: int = typer.Option(5, help="モジュールごとの計測回数 (中央値を使う)"),
+    top: int = typer.Option(8, help="表示する時間のかかったモジュールの数"),
+    health: bool = typer.Option(False, "--health", help="ヘルスチェックが応答するまでの時間も計測する"),
+    health_timeout: float = typer.Option(30.0, help="ヘルスチェックを待つ上限 (秒)"),
+    budget_scale: float = typer.Option(1.0, help="予算に掛ける倍率 (遅いCI環境用)"),
+    json_output: Optional[str] = typer.Option(None, help="結果をJSONで保存するパス"),
+):
+    report: Dict[str, Any] = {"modules": {}, "health": None, "failures": []}
+    failures: List[str] = report["failures"]
+
+    for module in modules:
+        samples = []
+        children: List[Tuple[str, float]] = []
+        for _ in range(repeat):
+            total, children = measure_import(module)
+            samples.append(total)
+        median = statistics.median(samples)
+        budget = IMPORT_BUDGETS_MS.get(module)
+        deferred = [
+            name for name in DEFERRED_MODULES.get(module, []) if name in dict(children)
+        ]
+        report["modules"][module] = {
+            "median_ms": round(median, 1),
+            "min_ms": round(min(samples), 1),
+            "budget_ms": budget * budget_scale if budget else None,
+            "loaded_deferred_modules": deferred,
+            "slowest": [{"module": name, "ms": round(ms, 1)} for name, ms in children[:top]],
+        }
+
+        budget_text = f" / budget {budget * budget_scale:.0f} ms" if budget else ""
+        typer.echo(f"== import {module}: median {median:.1f} ms (min {min(samples):.1f}){budget_text}")
+        for name, ms in children[:top]:
+            typer.echo(f"   {name:32}{ms:10.1f} ms")
+        if budget and median > budget * budget_scale:
+            failures.append(f"import {module}: {median:.1f} ms > {budget * budget_scale:.0f} ms")
+        for name in deferred:
+            failures.append(f"import {module}: 起動時に読み込まないはずの {name} が読み込まれました")
+
+    if health:
+        try:
+            samples = [measure_health(health_timeout) for _ in range(repeat)]
+        except (RuntimeError, TimeoutError) as e:
+            samples = []
+            failures.append(f"first GET /: {e}")
+    if health and samples:
+        median = statistics.median(samples)
+        budget = HEALTH_BUDGET_MS * budget_scale
+        report["health"] = {
+            "median_ms": round(median, 1),
+            "min_ms": round(min(samples), 1),
+            "budget_ms": budget,
+        }
+        typer.echo(
+            f"== first GET /: median {median:.1f} ms (min {min(samples):.1f}) / budget {budget:.0f} ms"
+        )
+        if median > budget:
+            failures.append(f"first GET /: {median:.1f} ms > {budget:.0f} ms")
+
+    if json_output:
+        with open(json_output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        typer.echo(f"\n結果を保存しました: {json_output}")
+
+    if failures:
+        typer.echo("\n予算を超えました:")
+        for failure in failures:
+            typer.echo(f" - {failure}")
+        raise typer.Exit(1)
+    typer.echo("\nすべて予算内です")
+
+
+if __name__ == "__main__":
+    typer.run(main)
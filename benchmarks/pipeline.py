@@ -0,0 +1,435 @@
+"""
+pipeline.py - パイプライン全体のオフラインベンチマーク
+
+OpenAI・arXiv・DuckDuckGo を記録済みの応答を返す代役 (benchmarks/replay.py) に置き換え、
+`get_agent()` のグラフと `POST /analyses` のジョブを指定した並列数で実行して、
+レイテンシ (p50/p95/p99)・スループット・外部呼び出し数・ノードごとのピークメモリを出力する。
+ネットワークには接続しないため、性能変更の前後比較に繰り返し使える。
+
+- 計測対象ごとに空のキャッシュ・論文ストア・インデックスから始める。デフォルトは
+  キャッシュを使わない (bypass_cache) 状態で毎回すべての処理を行い、`--warm` では
+  同じ対象の先行する実行で溜まったキャッシュ・論文ストア・インデックスを使う
+- 同じキーワードのジョブが相乗りしないよう、キーワードには実行番号を付ける
+- ピークメモリは tracemalloc を使う別パス (直列実行) で計測する (`--memory-runs 0` で省略)
+
+実行方法:
+    uv run python -m benchmarks.pipeline [--runs 20] [--concurrency 4] [--target both]
+        [--openai-latency-ms 300] [--openai-error-rate 0.02] [--json-output result.json]
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import typer
+
+from benchmarks.replay import (
+    FIXTURES_PATH,
+    FaultConfig,
+    ReplayArxiv,
+    ReplayOpenAI,
+    ReplaySearch,
+    load_fixtures,
+)
+
+TARGET_GRAPH = "graph"
+TARGET_API = "api"
+
+# キーワードに付ける実行番号 (代役は取り除いてから記録済みの応答を探す)
+RUN_SUFFIX_FORMAT = "{keyword} (run {index})"
+
+
+def _prepare_environment(workdir: str, concurrency: int, runs: int, log_level: str) -> None:
+    """agent.py / api.py は設定をインポート時に読むため、インポートより前に環境変数を設定する"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark-dummy")
+    os.environ["CHECKPOINT_PATH"] = os.path.join(workdir, "checkpoints.sqlite3")
+    # create_agent_context() が作るプロセス共有のストアも作業ディレクトリに置く
+    # (計測にはターゲットごとに build_context() で作り直したものを使う)
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm_cache.sqlite3")
+    os.environ["PAPER_STORE_PATH"] = os.path.join(workdir, "papers.sqlite3")
+    os.environ["PAPER_INDEX_DIR"] = os.path.join(workdir, "paper_index")
+    os.environ["FULLTEXT_CACHE_DIR"] = os.path.join(workdir, "fulltext")
+    os.environ["JOB_STORE_PATH"] = ""
+    os.environ["JOB_MAX_WORKERS"] = str(concurrency)
+    os.environ["JOB_MAX_QUEUE"] = str(max(runs, concurrency))
+    os.environ["LOG_LEVEL"] = log_level
+
+
+def build_context(
+    agent,
+    openai: ReplayOpenAI,
+    arxiv: ReplayArxiv,
+    search: ReplaySearch,
+    arxiv_delay_seconds: float,
+    workdir: str,
+):
+    """
+    create_agent_context() で本番と同じ構成を作り、外部への通信だけを代役に向ける
+    キャッシュ・論文ストア・インデックスは計測対象ごとに workdir に新しく作る
+    """
+    import dataclasses
+
+    from fulltext import FullTextStore
+    from llm_cache import LLMCache
+    from paper_index import PaperIndex
+    from paper_store import PaperStore
+    from ratelimit import TokenBucket
+    from state_backend import SQLiteBackend
+
+    arxiv_client = agent.RateLimitedArxivClient(
+        TokenBucket(interval=arxiv_delay_seconds, capacity=agent.ARXIV_BURST)
+    )
+    arxiv.install(arxiv_client._session)
+    context = agent.create_agent_context(
+        openai_transport=openai.transport(), search=search, arxiv_client=arxiv_client
+    )
+    return dataclasses.replace(
+        context,
+        # トークン数の確認に tiktoken の辞書をダウンロードしないようにする
+        embeddings=context.embeddings.model_copy(update={"check_embedding_ctx_length": False}),
+        llm_cache=LLMCache(
+            SQLiteBackend(os.path.join(workdir, "llm_cache.sqlite3")),
+            ttl_seconds=agent.LLM_CACHE_TTL_SECONDS,
+            max_entries=agent.LLM_CACHE_MAX_ENTRIES,
+        ),
+        paper_store=PaperStore(os.path.join(workdir, "papers.sqlite3")),
+        paper_index=(
+            PaperIndex(
+                os.path.join(workdir, "paper_index"),
+                dim=agent.EMBEDDING_DIMENSIONS,
+                model=agent.EMBEDDING_MODEL,
+            )
+            if agent.PAPER_INDEX_DIR
+            else None
+        ),
+        fulltext=FullTextStore(os.path.join(workdir, "fulltext")),
+    )
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) if samples else float("nan")
+
+
+class RunRecorder:
+    """1つの計測対象の実行結果 (スレッドセーフ)"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.node_seconds: Dict[str, List[float]] = {}
+        self.failures: List[str] = []
+        self._lock = threading.Lock()
+
+    def success(self, seconds: float, node_usage: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            for node, usage in node_usage.items():
+                self.node_seconds.setdefault(node, []).append(usage["seconds"])
+
+    def failure(self, error: str) -> None:
+        with self._lock:
+            self.failures.append(error)
+
+
+def _initial_state(keyword: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "keyword": keyword,
+        "queries": [],
+        "core_papers": None,
+        "analysis": None,
+        "web_search_logs": None,
+        "report_markdown": None,
+        **options,
+    }
+
+
+def run_graph(agent, context, keywords: List[str], options: Dict[str, Any], concurrency: int) -> RunRecorder:
+    """コンパイル済みのグラフを直接実行する"""
+    graph = agent.get_agent()
+    recorder = RunRecorder()
+
+    def run(keyword: str) -> None:
+        run_id = uuid.uuid4().hex
+        started = time.perf_counter()
+        try:
+            result = graph.invoke(
+                _initial_state(keyword, options), agent.run_config(run_id), context=context
+            )
+            agent.clear_checkpoint(graph, run_id)
+        except Exception as e:
+            recorder.failure(f"{type(e).__name__}: {e}")
+            return
+        recorder.success(time.perf_counter() - started, result.get("node_usage") or {})
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, keywords))
+    return recorder
+
+
+def run_api(
+    keywords: List[str], options: Dict[str, Any], concurrency: int, poll_interval: float
+) -> RunRecorder:
+    """POST /analyses でジョブを作り、GET /analyses/{id} で完了まで待つ (アプリはプロセス内で動かす)"""
+    from fastapi.testclient import TestClient
+
+    import api
+
+    recorder = RunRecorder()
+    with TestClient(api.app) as client:
+
+        def run(keyword: str) -> None:
+            started = time.perf_counter()
+            response = client.post("/analyses", json={"keyword": keyword, **options})
+            while response.status_code == 429:
+                time.sleep(poll_interval)
+                response = client.post("/analyses", json={"keyword": keyword, **options})
+            if response.status_code != 202:
+                recorder.failure(f"HTTP {response.status_code}: {response.text}")
+                return
+            location = response.headers["Location"]
+            while True:
+                job = client.get(location).json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                time.sleep(poll_interval)
+            if job["status"] == "failed":
+                recorder.failure(job.get("error") or "failed")
+                return
+            recorder.success(time.perf_counter() - started, job["result"]["usage"]["nodes"])
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run, keywords))
+    return recorder
+
+
+def measure_node_memory(agent, context, keywords: List[str], options: Dict[str, Any]) -> Dict[str, float]:
+    """
+    ノードごとのピークメモリ (ノード開始時からの増分, バイト) を直列実行で計測する
+    ノードは順番に1つずつ実行されるので、更新を受け取るたびにピークをリセットして区切る
+    """
+    graph = agent.get_agent()
+    peaks: Dict[str, float] = {}
+    tracemalloc.start()
+    try:
+        for keyword in keywords:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            try:
+                for update in graph.stream(
+                    _initial_state(keyword, options),
+                    agent.run_config(uuid.uuid4().hex),
+                    context=context,
+                    stream_mode="updates",
+                ):
+                    current, peak = tracemalloc.get_traced_memory()
+                    # ノード内のタスク (論文ごとの分析) の完了はノードの途中なので区切らない
+                    nodes = [node for node in update if node in agent.PIPELINE_NODES]
+                    if not nodes:
+                        continue
+                    for node in nodes:
+                        peaks[node] = max(peaks.get(node, 0.0), peak - baseline)
+                    tracemalloc.reset_peak()
+                    baseline = current
+            except Exception as e:
+                typer.echo(f"メモリ計測の実行に失敗しました: {type(e).__name__}: {e}", err=True)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def _summarize(recorder: RunRecorder, wall_seconds: float, runs: int) -> Dict[str, Any]:
+    latencies = recorder.latencies
+    return {
+        "runs": runs,
+        "succeeded": len(latencies),
+        "failed": len(recorder.failures),
+        "errors": sorted(set(recorder.failures))[:5],
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_per_second": round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=float("nan")),
+        },
+        "nodes": {
+            node: {
+                "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95),
+                "p99": percentile(samples, 99),
+            }
+            for node, samples in recorder.node_seconds.items()
+        },
+    }
+
+
+def _diff_calls(before: Dict[str, Dict[str, Dict[str, int]]], after) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """代役ごとの呼び出し数の差分 (このターゲットで発生した分)"""
+    diff: Dict[str, Dict[str, Dict[str, int]]] = {}
+    for service, operations in after.items():
+        for operation, counts in operations.items():
+            prev = before.get(service, {}).get(operation, {"calls": 0, "errors": 0})
+            diff.setdefault(service, {})[operation] = {
+                key: counts[key] - prev[key] for key in ("calls", "errors")
+            }
+    return diff
+
+
+def _print_report(name: str, summary: Dict[str, Any], node_order: List[str], memory: Dict[str, float]) -> None:
+    latency = summary["latency_seconds"]
+    typer.echo(f"\n== {name} ==")
+    typer.echo(
+        f"runs: {summary['succeeded']}/{summary['runs']} succeeded"
+        f"  wall: {summary['wall_seconds']:.2f} s"
+        f"  throughput: {summary['throughput_per_second']:.2f} runs/s"
+    )
+    typer.echo(
+        f"latency (s)  p50 {latency['p50']:.3f}  p95 {latency['p95']:.3f}"
+        f"  p99 {latency['p99']:.3f}  max {latency['max']:.3f}"
+    )
+    for error in summary["errors"]:
+        typer.echo(f"  error: {error[:200]}")
+
+    typer.echo(f"{'node':18}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}{'peak KiB':>12}")
+    for node in node_order:
+        stats = summary["nodes"].get(node)
+        peak = memory.get(node)
+        peak_text = f"{peak / 1024:12.1f}" if peak is not None else f"{'-':>12}"
+        if stats is None:
+            typer.echo(f"{node:18}{'-':>10}{'-':>10}{'-':>10}{peak_text}")
+            continue
+        typer.echo(
+            f"{node:18}{stats['p50']:10.3f}{stats['p95']:10.3f}{stats['p99']:10.3f}{peak_text}"
+        )
+
+    typer.echo(f"{'external call':28}{'calls':>8}{'errors':>8}{'per run':>10}")
+    runs = max(summary["runs"], 1)
+    for service, operations in summary["external_calls"].items():
+        for operation, counts in operations.items():
+            typer.echo(
+                f"{service + '.' + operation:28}{counts['calls']:8d}{counts['errors']:8d}"
+                f"{counts['calls'] / runs:10.2f}"
+            )
+
+
+def main(
+    runs: int = typer.Option(20, help="計測対象ごとの実行回数"),
+    concurrency: int = typer.Option(4, help="同時に実行する分析の数"),
+    target: str = typer.Option("both", help="計測対象: graph / api / both"),
+    analysis_mode: str = typer.Option("agent", help="分析モード: agent / batched"),
+    top_k: int = typer.Option(5, help="1回の分析で分析する論文数"),
+    warm: bool = typer.Option(False, "--warm", help="キャッシュ・論文ストア・インデックスを使う"),
+    openai_latency_ms: float = typer.Option(200.0, help="OpenAIの代役の平均遅延 (ms)"),
+    openai_jitter_ms: float = typer.Option(100.0, help="OpenAIの代役の遅延のゆらぎ (ms)"),
+    openai_error_rate: float = typer.Option(0.0, help="OpenAIの代役がエラーを返す確率"),
+    arxiv_latency_ms: float = typer.Option(300.0, help="arXivの代役の平均遅延 (ms)"),
+    arxiv_jitter_ms: float = typer.Option(100.0, help="arXivの代役の遅延のゆらぎ (ms)"),
+    arxiv_error_rate: float = typer.Option(0.0, help="arXivの代役がエラーを返す確率"),
+    arxiv_delay_seconds: float = typer.Option(0.0, help="arXivへのリクエスト間隔 (本番は ARXIV_DELAY_SECONDS)"),
+    search_latency_ms: float = typer.Option(150.0, help="DuckDuckGoの代役の平均遅延 (ms)"),
+    search_jitter_ms: float = typer.Option(50.0, help="DuckDuckGoの代役の遅延のゆらぎ (ms)"),
+    search_error_rate: float = typer.Option(0.0, help="DuckDuckGoの代役がエラーを返す確率"),
+    tool_call_rate: float = typer.Option(0.5, help="Web検索を行う論文の割合"),
+    memory_runs: int = typer.Option(2, help="ピークメモリを計測する実行回数 (0で省略)"),
+    poll_interval_ms: float = typer.Option(20.0, help="APIのジョブ状態を確認する間隔 (ms)"),
+    fixtures: str = typer.Option(FIXTURES_PATH, help="記録済みの応答"),
+    seed: int = typer.Option(0, help="遅延・エラー注入の乱数シード"),
+    log_level: str = typer.Option("ERROR", help="パイプラインのログレベル"),
+    json_output: Optional[str] = typer.Option(None, help="結果をJSONで保存するパス"),
+):
+    if target not in (TARGET_GRAPH, TARGET_API, "both"):
+        raise typer.BadParameter("target は graph / api / both のいずれかです")
+    targets = [TARGET_GRAPH, TARGET_API] if target == "both" else [target]
+
+    workdir = tempfile.mkdtemp(prefix="paper-agent-bench-")
+    _prepare_environment(workdir, concurrency, runs, log_level)
+
+    import agent  # noqa: E402 (環境変数を設定してからインポートする)
+    from observability import configure_logging
+
+    configure_logging(level=log_level)
+    data = load_fixtures(fixtures)
+    openai = ReplayOpenAI(
+        data,
+        FaultConfig(openai_latency_ms, openai_jitter_ms, openai_error_rate),
+        tool_call_rate=tool_call_rate,
+        seed=seed,
+    )
+    arxiv = ReplayArxiv(
+        data, FaultConfig(arxiv_latency_ms, arxiv_jitter_ms, arxiv_error_rate), seed=seed + 1
+    )
+    search = ReplaySearch(
+        data, FaultConfig(search_latency_ms, search_jitter_ms, search_error_rate), seed=seed + 2
+    )
+
+    def fresh_context(name: str):
+        context = build_context(
+            agent, openai, arxiv, search, arxiv_delay_seconds, os.path.join(workdir, name)
+        )
+        # get_agent_context() (APIのlifespan) でも同じものを使うようにする
+        agent._agent_context = context
+        return context
+
+    options = {"bypass_cache": not warm, "analysis_mode": analysis_mode, "top_k": top_k}
+    services = (openai, arxiv, search)
+    report: Dict[str, Any] = {
+        "config": {
+            "runs": runs,
+            "concurrency": concurrency,
+            "warm": warm,
+            "analysis_mode": analysis_mode,
+            "top_k": top_k,
+            "faults": {service.name: vars(service.faults) for service in services},
+            "tool_call_rate": tool_call_rate,
+            "seed": seed,
+        },
+        "targets": {},
+    }
+
+    memory: Dict[str, float] = {}
+    if memory_runs > 0:
+        memory_keywords = [
+            RUN_SUFFIX_FORMAT.format(keyword=data["keywords"][i % len(data["keywords"])], index=f"m{i}")
+            for i in range(memory_runs)
+        ]
+        memory = measure_node_memory(agent, fresh_context("memory"), memory_keywords, options)
+        report["node_peak_memory_bytes"] = memory
+
+    for name in targets:
+        keywords = [
+            RUN_SUFFIX_FORMAT.format(keyword=data["keywords"][i % len(data["keywords"])], index=f"{name}{i}")
+            for i in range(runs)
+        ]
+        context = fresh_context(name)
+        before = {service.name: service.stats() for service in services}
+        started = time.perf_counter()
+        if name == TARGET_GRAPH:
+            recorder = run_graph(agent, context, keywords, options, concurrency)
+        else:
+            recorder = run_api(keywords, options, concurrency, poll_interval_ms / 1000)
+        summary = _summarize(recorder, time.perf_counter() - started, runs)
+        summary["external_calls"] = _diff_calls(
+            before, {service.name: service.stats() for service in services}
+        )
+        report["targets"][name] = summary
+        _print_report(
+            "get_agent()" if name == TARGET_GRAPH else "POST /analyses",
+            summary,
+            agent.PIPELINE_NODES,
+            memory,
+        )
+
+    if json_output:
+        with open(json_output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        typer.echo(f"\n結果を保存しました: {json_output}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
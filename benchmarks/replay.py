@@ -0,0 +1,335 @@
+"""
+replay.py - ベンチマーク用の外部サービスの代役
+
+OpenAI・arXiv・DuckDuckGo への通信を、`fixtures/pipeline.json` に記録した応答を返す
+ローカルの代役に置き換えます。ネットワークには一切接続しません。
+
+- OpenAI: `httpx.MockTransport` で Chat Completions / Embeddings API の応答を返す
+  (OpenAI SDK のリトライ・`ChatOpenAI` のコールバック・計測はそのまま動く)
+- arXiv: `requests` のトランスポートアダプタで Atom フィードを返す
+  (`arxiv.Client` のページ取得・リトライ・共有レート制限はそのまま動く)
+- DuckDuckGo: `DuckDuckGoSearchRun` と同じく `invoke(query)` で検索結果の文字列を返す
+
+サービスごとに応答の遅延 (平均とゆらぎ) とエラー率を指定でき、
+呼び出し回数・注入したエラー数を操作ごとに数えます。
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+import httpx
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter
+
+from ranking import tokenize
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "pipeline.json")
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@dataclass
+class FaultConfig:
+    """代役の応答に注入する遅延とエラー"""
+
+    latency_ms: float = 0.0  # 1回の呼び出しの平均遅延
+    jitter_ms: float = 0.0  # 遅延のゆらぎ (平均 ± jitter_ms の一様分布)
+    error_rate: float = 0.0  # エラーを返す確率 (0〜1)
+
+
+class ReplayService:
+    """遅延とエラーを注入し、呼び出し回数を数える代役の共通部分"""
+
+    def __init__(self, name: str, faults: FaultConfig, seed: int = 0):
+        self.name = name
+        self.faults = faults
+        self._random = random.Random(seed)
+        self._calls: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _begin_call(self, operation: str) -> bool:
+        """遅延を入れて呼び出しを数える。エラーを返すべきなら True"""
+        with self._lock:
+            self._calls[operation] = self._calls.get(operation, 0) + 1
+            jitter = self._random.uniform(-1, 1) * self.faults.jitter_ms
+            fail = self._random.random() < self.faults.error_rate
+            if fail:
+                self._errors[operation] = self._errors.get(operation, 0) + 1
+        delay = max(self.faults.latency_ms + jitter, 0.0) / 1000
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """操作ごとの {"calls", "errors"}"""
+        with self._lock:
+            return {
+                operation: {"calls": calls, "errors": self._errors.get(operation, 0)}
+                for operation, calls in sorted(self._calls.items())
+            }
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+def hashed_embedding(text: str, dim: int) -> np.ndarray:
+    """
+    単語を次元に割り当てて数える埋め込み (L2正規化済み)
+    語の重なりが多いテキストほどコサイン類似度が高くなる
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        h = _stable_hash(token)
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[_stable_hash(text) % dim] = 1.0
+        return vector
+    return vector / norm
+
+
+def _count_tokens(text: str) -> int:
+    """usage に載せるおおよそのトークン数"""
+    return max(len(text) // 4, 1)
+
+
+class ReplayOpenAI(ReplayService):
+    """OpenAI API (Chat Completions / Embeddings) の代役"""
+
+    def __init__(
+        self,
+        fixtures: Dict[str, Any],
+        faults: FaultConfig,
+        tool_call_rate: float = 0.5,
+        seed: int = 0,
+    ):
+        super().__init__("openai", faults, seed)
+        self.fixtures = fixtures
+        self.tool_call_rate = tool_call_rate
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content or b"{}")
+        if request.url.path.endswith("/embeddings"):
+            operation, respond = "embeddings", self._embeddings
+        elif request.url.path.endswith("/chat/completions"):
+            operation, respond = "chat", self._chat
+        else:
+            return httpx.Response(404, json={"error": {"message": "not found"}})
+        if self._begin_call(operation):
+            return httpx.Response(
+                500,
+                json={"error": {"message": "injected error", "type": "server_error"}},
+            )
+        return httpx.Response(200, json=respond(body))
+
+    def _embeddings(self, body: dict) -> dict:
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = body.get("dimensions") or 1536
+        data = []
+        for i, text in enumerate(inputs):
+            vector = hashed_embedding(str(text), dim)
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vector.astype("<f4").tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(_count_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _chat(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        prompt = "".join(
+            str(m.get("content") or "") for m in messages if m.get("role") == "user"
+        )
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        if body.get("response_format"):
+            message["content"] = self._batch_analysis(prompt)
+        elif "NEEDS_LOOKUP" in prompt:
+            # ツールなしの安い tier での分析: Web検索が必要な論文は次の tier に回してもらう
+            title = self._match(r"Title:\s*(.+)", prompt)
+            message["content"] = (
+                "NEEDS_LOOKUP"
+                if self._wants_lookup(title)
+                else self.fixtures["batch_summary"].format(title=title)
+            )
+        elif body.get("tools"):
+            title = self._match(r"Title:\s*(.+)", prompt)
+            searched = any(m.get("role") == "tool" for m in messages)
+            if not searched and self._wants_lookup(title):
+                finish_reason = "tool_calls"
+                message["tool_calls"] = [
+                    {
+                        "id": f"call_{_stable_hash(title) % 10**8}",
+                        "type": "function",
+                        "function": {
+                            "name": "web_search",
+                            "arguments": json.dumps({"query": f"{title} GitHub implementation"}),
+                        },
+                    }
+                ]
+            else:
+                message["content"] = self.fixtures["analysis"].format(title=title)
+        else:
+            # ベンチマークがキーワードに付けた実行番号は取り除いて探す
+            keyword = re.sub(
+                r"\s*\(run [^)]*\)$", "", self._match(r'User Input:\s*"(.*)"', prompt)
+            )
+            queries = self.fixtures["queries"].get(keyword) or [
+                keyword,
+                f"{keyword} survey",
+                f"{keyword} efficient methods",
+            ]
+            message["content"] = "\n".join(queries)
+
+        completion = json.dumps(message, ensure_ascii=False)
+        prompt_tokens = _count_tokens(json.dumps(messages, ensure_ascii=False))
+        completion_tokens = _count_tokens(completion)
+        return {
+            "id": f"chatcmpl-replay-{_stable_hash(completion) % 10**12}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _batch_analysis(self, prompt: str) -> str:
+        items = [
+            {
+                "index": int(index),
+                "summary": self.fixtures["batch_summary"].format(title=title.strip()),
+                "needs_lookup": self._wants_lookup(title.strip()),
+            }
+            for index, title in re.findall(r"\[(\d+)\] Title:\s*(.+)", prompt)
+        ]
+        return json.dumps({"items": items}, ensure_ascii=False)
+
+    def _wants_lookup(self, title: str) -> bool:
+        """論文ごとに決まる (実行のたびに変わらない) Web検索の要否"""
+        return (_stable_hash(title) % 1000) / 1000 < self.tool_call_rate
+
+    @staticmethod
+    def _match(pattern: str, text: str) -> str:
+        match = re.search(pattern, text)
+        return match.group(1).strip() if match else ""
+
+
+class ReplayArxiv(ReplayService, BaseAdapter):
+    """arXiv API の代役 (クエリと語が重なる論文を重なりの多い順に返す)"""
+
+    def __init__(self, fixtures: Dict[str, Any], faults: FaultConfig, seed: int = 0):
+        ReplayService.__init__(self, "arxiv", faults, seed)
+        BaseAdapter.__init__(self)
+        self.papers = fixtures["papers"]
+        self._paper_tokens = [
+            set(tokenize(f"{paper['title']} {paper['summary']}")) for paper in self.papers
+        ]
+
+    def install(self, session: requests.Session) -> None:
+        """arxiv.Client のセッションの通信をこの代役に向ける"""
+        session.mount("https://", self)
+        session.mount("http://", self)
+
+    def send(self, request, **kwargs) -> requests.Response:
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        if self._begin_call("query"):
+            response.status_code = 503
+            response._content = b"injected error"
+            return response
+        params = parse_qs(urlparse(request.url).query)
+        query = params.get("search_query", [""])[0]
+        start = int(params.get("start", ["0"])[0])
+        page_size = int(params.get("max_results", ["100"])[0])
+        matches = self._search(query)
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/atom+xml"
+        response._content = self._feed(matches[start : start + page_size], len(matches), start)
+        return response
+
+    def close(self) -> None:
+        pass
+
+    def _search(self, query: str) -> List[dict]:
+        terms = set(tokenize(query))
+        scored = [
+            (len(terms & tokens), i)
+            for i, tokens in enumerate(self._paper_tokens)
+            if terms & tokens
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.papers[i] for _, i in scored]
+
+    @staticmethod
+    def _feed(papers: List[dict], total: int, start: int) -> bytes:
+        entries = "".join(
+            f"""
+  <entry>
+    <id>http://arxiv.org/abs/{paper['arxiv_id']}v1</id>
+    <updated>2024-01-01T00:00:00Z</updated>
+    <published>2024-01-01T00:00:00Z</published>
+    <title>{escape(paper['title'])}</title>
+    <summary>{escape(paper['summary'])}</summary>
+    <author><name>Replay Author</name></author>
+    <link href="http://arxiv.org/abs/{paper['arxiv_id']}v1" rel="alternate" type="text/html"/>
+    <link title="pdf" href="http://arxiv.org/pdf/{paper['arxiv_id']}v1" rel="related" type="application/pdf"/>
+    <arxiv:primary_category term="cs.CL" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.CL" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>"""
+            for paper in papers
+        )
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <title>arXiv Query (replay)</title>
+  <id>http://arxiv.org/api/replay</id>
+  <updated>2024-01-01T00:00:00Z</updated>
+  <opensearch:totalResults>{total}</opensearch:totalResults>
+  <opensearch:startIndex>{start}</opensearch:startIndex>
+  <opensearch:itemsPerPage>{len(papers)}</opensearch:itemsPerPage>{entries}
+</feed>
+""".encode("utf-8")
+
+
+class ReplaySearch(ReplayService):
+    """DuckDuckGoSearchRun の代役"""
+
+    def __init__(self, fixtures: Dict[str, Any], faults: FaultConfig, seed: int = 0):
+        super().__init__("duckduckgo", faults, seed)
+        self.results = fixtures["web_search"]
+
+    def invoke(self, query: str, config: Optional[dict] = None, **kwargs) -> str:
+        if self._begin_call("search"):
+            raise RuntimeError("injected error")
+        return self.results[_stable_hash(query) % len(self.results)]
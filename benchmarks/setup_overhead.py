@@ -0,0 +1,75 @@
+"""
+setup_overhead.py - リクエストごとの準備コストの計測
+
+以前の実装ではリクエストのたびに StateGraph のコンパイルと
+ChatOpenAI / ReActエージェント / DuckDuckGoSearchRun / arxiv.Client の生成を行っていた。
+その準備処理と、起動時に1回だけ作ったものを使い回す現在の実装を比較する。
+外部APIへの通信は行わない。
+
+実行方法:
+    uv run python -m benchmarks.setup_overhead [--iterations 50]
+"""
+
+import os
+import statistics
+import time
+
+import typer
+
+# ChatOpenAI の生成にはAPIキーが必要なため、計測用のダミーを入れておく
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark-dummy")
+
+import arxiv  # noqa: E402
+from langchain_community.tools import DuckDuckGoSearchRun  # noqa: E402
+from langchain_openai import ChatOpenAI  # noqa: E402
+from langgraph.prebuilt import create_react_agent  # noqa: E402
+
+import agent  # noqa: E402
+
+
+def per_request_setup():
+    """以前の実装: 1リクエストごとに行っていた準備処理"""
+    agent._build_agent()
+    ChatOpenAI(model=agent.LLM_MODEL, temperature=0)
+    tools = agent.get_agent_context().tools
+    llm = ChatOpenAI(model=agent.LLM_MODEL, temperature=0).bind_tools(tools)
+    create_react_agent(llm, tools)
+    DuckDuckGoSearchRun()  # web_search の呼び出しごと
+    arxiv.Client()
+
+
+def shared_setup():
+    """現在の実装: 起動時に作ったグラフとクライアントを取得するだけ"""
+    agent.get_agent()
+    agent.get_agent_context()
+
+
+def measure(fn, iterations: int):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main(iterations: int = typer.Option(50, help="計測回数")):
+    # 起動時の準備 (現在の実装で1回だけ払うコスト)
+    start = time.perf_counter()
+    shared_setup()
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    before = measure(per_request_setup, iterations)
+    after = measure(shared_setup, iterations)
+
+    print(f"起動時の準備 (1回のみ): {startup_ms:.2f} ms")
+    print(f"{'':22}{'mean':>10}{'p50':>10}{'max':>10}")
+    for label, samples in (("before (per request)", before), ("after (shared)", after)):
+        print(
+            f"{label:22}{statistics.mean(samples):10.3f}"
+            f"{statistics.median(samples):10.3f}{max(samples):10.3f}  ms"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
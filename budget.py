@@ -0,0 +1,204 @@
+"""
+budget.py - 1回の分析で使う予算 (トークン数・ツール呼び出し数・実行時間) の管理
+
+チャットモデルの呼び出しごとの usage_metadata を、ContextVar で指定した集計先
+(ノード単位・論文単位など) とリクエスト全体の予算へ足し込みます。
+ContextVar はツールやワーカースレッドにも引き継がれるため、
+ReActエージェントの内部で行われる呼び出しもそのまま数えられます。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+# 予算を使い切った理由
+BUDGET_TOKENS = "tokens"
+BUDGET_TIME = "time"
+BUDGET_TOOL_CALLS = "tool_calls"
+
+
+class UsageCounter:
+    """LLM呼び出し回数とトークン数の集計 (スレッドセーフ)"""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt_tokens: int, completion_tokens: int, total_tokens: int) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.total_tokens += total_tokens
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "llm_calls": self.llm_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens,
+            }
+
+
+class RunBudget:
+    """
+    リクエスト全体のトークン数と実行時間の予算 (None は無制限)
+    ノードをまたいで使った量は state に保存し、ノードごとに作り直す
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int],
+        max_seconds: Optional[float],
+        started_at: float,
+        tokens_used: int = 0,
+    ):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.started_at = started_at
+        self._tokens_used = tokens_used
+        self._lock = threading.Lock()
+
+    @property
+    def tokens_used(self) -> int:
+        with self._lock:
+            return self._tokens_used
+
+    def add_tokens(self, tokens: int) -> None:
+        with self._lock:
+            self._tokens_used += tokens
+
+    def exhausted(self) -> Optional[str]:
+        """予算を使い切っていればその理由を、残っていれば None を返す"""
+        if self.max_tokens is not None and self.tokens_used >= self.max_tokens:
+            return BUDGET_TOKENS
+        if (
+            self.max_seconds is not None
+            and time.time() - self.started_at >= self.max_seconds
+        ):
+            return BUDGET_TIME
+        return None
+
+
+class ToolCallBudget:
+    """1本の論文の分析で使えるツール呼び出し数 (None は無制限)"""
+
+    def __init__(self, max_calls: Optional[int]):
+        self.max_calls = max_calls
+        self.calls = 0
+        self.refused_reason: Optional[str] = None  # 呼び出しを断った理由 (最後のもの)
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        """呼び出してよければ回数を数えて True、上限に達していれば False"""
+        with self._lock:
+            if self.max_calls is not None and self.calls >= self.max_calls:
+                return False
+            self.calls += 1
+            return True
+
+    def refuse(self, reason: str) -> None:
+        with self._lock:
+            self.refused_reason = reason
+
+
+class UsageRecorder(BaseCallbackHandler):
+    """チャットモデルの呼び出しが終わるたびに、使ったトークン数を集計先と予算へ足し込む"""
+
+    def __init__(
+        self, counters: Sequence[UsageCounter], budget: Optional[RunBudget] = None
+    ):
+        self.counters = tuple(counters)
+        self.budget = budget
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        prompt_tokens = completion_tokens = total_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                    total_tokens += usage.get("total_tokens", 0)
+        for counter in self.counters:
+            counter.add(prompt_tokens, completion_tokens, total_tokens)
+        if self.budget is not None:
+            self.budget.add_tokens(total_tokens)
+
+
+# 実行中の集計先 (LangChainの呼び出しに自動でコールバックとして追加される)
+current_usage_recorder: ContextVar[Optional[UsageRecorder]] = ContextVar(
+    "current_usage_recorder", default=None
+)
+register_configure_hook(current_usage_recorder, inheritable=True)
+
+# 実行中の論文分析のツール呼び出し予算
+current_tool_budget: ContextVar[Optional[ToolCallBudget]] = ContextVar(
+    "current_tool_budget", default=None
+)
+
+
+@contextmanager
+def record_usage(
+    *counters: UsageCounter, budget: Optional[RunBudget] = None
+) -> Iterator[None]:
+    """
+    このブロック内のLLM呼び出しを counters に集計する
+    外側の record_usage の集計先と予算にも引き続き足し込まれる
+    """
+    parent = current_usage_recorder.get()
+    if parent is not None:
+        counters = parent.counters + counters
+        budget = budget or parent.budget
+    token = current_usage_recorder.set(UsageRecorder(counters, budget))
+    try:
+        yield
+    finally:
+        current_usage_recorder.reset(token)
+
+
+def current_run_budget() -> Optional[RunBudget]:
+    """実行中のリクエストの予算 (record_usage の外では None)"""
+    recorder = current_usage_recorder.get()
+    return recorder.budget if recorder is not None else None
+
+
+@contextmanager
+def limit_tool_calls(budget: ToolCallBudget) -> Iterator[ToolCallBudget]:
+    """このブロック内のツール呼び出しを budget の回数までに制限する"""
+    token = current_tool_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        current_tool_budget.reset(token)
+
+
+def tool_call_refusal() -> Optional[str]:
+    """
+    ツールを実行してよいか判定する
+    予算切れのときはLLMに返す文言 (これまでの情報で回答させる) を返す
+    """
+    run_budget = current_run_budget()
+    reason = run_budget.exhausted() if run_budget is not None else None
+    tool_budget = current_tool_budget.get()
+    if reason is None and tool_budget is not None and not tool_budget.try_acquire():
+        reason = BUDGET_TOOL_CALLS
+    if reason is None:
+        return None
+    if tool_budget is not None:
+        tool_budget.refuse(reason)
+    return (
+        f"予算の上限 ({reason}) に達したため、これ以上ツールは使えません。"
+        "ここまでに得た情報だけで最終的な回答を出力してください。"
+    )
@@ -0,0 +1,97 @@
+"""
+compression.py - レスポンスの圧縮 (gzip / brotli)
+
+`Accept-Encoding` に br があり `brotli` がインストールされていれば brotli、
+gzip があれば gzip で圧縮します。
+1回で送られるレスポンスだけを圧縮し、SSE と NDJSON のストリームは1件ずつ届けたいので圧縮しません。
+(Starlette の GZipMiddleware は、ロックしている版では除外する Content-Type を指定できないため使わない)
+"""
+
+import gzip
+import os
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli は任意 (なければ gzip だけ使う)
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない (バイト)
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "500"))
+# brotli の圧縮レベル (0〜11)。レスポンスごとに圧縮するので速さを優先する
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# gzip の圧縮レベル (1〜9)
+GZIP_COMPRESSLEVEL = 6
+
+STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+def _accepts(headers: Headers, encoding: str) -> bool:
+    for item in headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() == encoding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+class CompressionMiddleware:
+    """brotli (使える場合) または gzip でレスポンスを圧縮するミドルウェア"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if brotli is not None and _accepts(headers, "br"):
+            await self._compress(scope, receive, send, "br")
+        elif _accepts(headers, "gzip"):
+            await self._compress(scope, receive, send, "gzip")
+        else:
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    def _encode(body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=GZIP_COMPRESSLEVEL)
+
+    async def _compress(
+        self, scope: Scope, receive: Receive, send: Send, encoding: str
+    ) -> None:
+        """1回で送られるレスポンスだけを encoding で圧縮する (ストリームはそのまま送る)"""
+        start: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            if (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and content_type not in STREAMING_CONTENT_TYPES
+            ):
+                body = self._encode(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            await send(start)
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
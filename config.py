@@ -0,0 +1,28 @@
+"""
+config.py - 設定 (.env) の読み込みと検証
+
+各モジュールは設定 (環境変数) をインポート時に読むため、エントリーポイント (api.py / main.py) は
+他のモジュールより先に `load_env()` で .env を読み込みます。
+必須の設定の検証はインポート時ではなく、起動時 (APIのlifespan / CLIのコマンド開始時) に
+`validate_config()` で行います。
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+
+def load_env() -> None:
+    """.env を環境変数に読み込む (すでに設定されている環境変数は上書きしない)"""
+    load_dotenv()
+
+
+def validate_config() -> None:
+    """必須の設定がそろっているか確認する (足りなければ ValueError)"""
+    if os.getenv("OPENAI_API_KEY") is None:
+        raise ValueError("OPENAI_API_KEYが.envファイルに設定されていません")
+    # モデルの振り分けの tier の並びを確かめる (設定をインポート時に読むため、.env の読み込み後にインポートする)
+    from model_router import MODEL_ROUTES, parse_route
+
+    for node, spec in MODEL_ROUTES.items():
+        parse_route(node, spec)
@@ -0,0 +1,240 @@
+"""
+fulltext.py - 論文PDFの本文の取得と、プロンプトに入れる関連箇所の選択
+
+full_text モードでは、アブストラクトだけでは分からない実装の詳細を分析に使うため、
+arXivのPDFをダウンロードして本文を抽出します。
+PDFは上限サイズまでストリーミングで一時ファイルに書き、ページごとに抽出したテキストを
+arXiv IDごとにディスクへキャッシュします (次回からはダウンロードしない)。
+プロンプトには本文全体ではなく、検索クエリにBM25で近いチャンクだけを上限数まで入れます。
+"""
+
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+from http_clients import TimeoutSession
+from observability import get_logger, instrument_call, record_cache
+from ranking import bm25_idf, bm25_score, tokenize
+from resilience import (
+    SERVICE_TIMEOUTS,
+    RetryableStatusError,
+    UpstreamTimeoutError,
+)
+from resilience import call as call_upstream
+
+logger = get_logger("fulltext")
+
+# 抽出した本文のキャッシュの保存先 (arXiv IDごとに1ファイル)
+FULLTEXT_CACHE_DIR = os.getenv("FULLTEXT_CACHE_DIR", ".cache/fulltext")
+# ダウンロードするPDFの上限サイズ (超えたら中断してアブストラクトだけで分析する)
+FULLTEXT_MAX_PDF_BYTES = int(os.getenv("FULLTEXT_MAX_PDF_BYTES", str(20 * 1024 * 1024)))
+# 本文を抽出する先頭からのページ数 (付録・参考文献の多い後半は読まない)
+FULLTEXT_MAX_PAGES = int(os.getenv("FULLTEXT_MAX_PAGES", "30"))
+# プロセス全体で同時に行うPDFのダウンロード数・テキスト抽出数
+FULLTEXT_MAX_DOWNLOADS = int(os.getenv("FULLTEXT_MAX_DOWNLOADS", "3"))
+FULLTEXT_MAX_EXTRACTIONS = int(os.getenv("FULLTEXT_MAX_EXTRACTIONS", "2"))
+# 本文を分けるチャンクの文字数と、1本の論文でプロンプトに入れるチャンク数
+FULLTEXT_CHUNK_CHARS = int(os.getenv("FULLTEXT_CHUNK_CHARS", "1500"))
+FULLTEXT_MAX_CHUNKS = int(os.getenv("FULLTEXT_MAX_CHUNKS", "4"))
+
+_DOWNLOAD_BLOCK_BYTES = 64 * 1024
+
+
+class PdfTooLargeError(Exception):
+    """PDFが FULLTEXT_MAX_PDF_BYTES を超えている"""
+
+
+def pdf_url(url: str) -> str:
+    """論文のURL (abs / pdf) をPDFのURLにそろえる"""
+    return url.replace("/abs/", "/pdf/").replace("http://", "https://", 1)
+
+
+def iter_chunks(path: str, chunk_chars: int) -> Iterator[str]:
+    """
+    本文のテキストファイルを、なるべく行の区切りでおよそ chunk_chars 文字ずつに分けて返す
+    ファイルは1行ずつ読むので、本文全体をメモリに載せない
+    """
+    pending = ""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            pending += line
+            while len(pending) >= chunk_chars:
+                cut = pending.rfind("\n", 0, chunk_chars)
+                if cut <= 0:
+                    cut = chunk_chars
+                chunk = pending[:cut].strip()
+                pending = pending[cut:]
+                if chunk:
+                    yield chunk
+    if pending.strip():
+        yield pending.strip()
+
+
+def select_chunks(path: str, query: str, max_chunks: int, chunk_chars: int) -> List[str]:
+    """
+    本文から query にBM25で近いチャンクを最大 max_chunks 個選び、本文の順に返す
+    1回目の読み込みでクエリの語の文書頻度を数え、2回目でスコアを付けて上位だけを残す。
+    クエリの語を含まないチャンクは選ばない (どこにも現れなければ先頭のチャンク = 導入部を返す)
+    """
+    query_terms = set(tokenize(query))
+    document_frequency: Counter = Counter()
+    n = 0
+    total_length = 0
+    for chunk in iter_chunks(path, chunk_chars):
+        tokens = tokenize(chunk)
+        n += 1
+        total_length += len(tokens)
+        document_frequency.update(query_terms.intersection(tokens))
+    if n == 0:
+        return []
+    idf = {term: bm25_idf(n, df) for term, df in document_frequency.items()}
+    avg_length = total_length / n or 1.0
+
+    # (スコア, -位置, チャンク) の最小ヒープ。同じスコアなら前にあるチャンクを残す
+    top: List[tuple] = []
+    for position, chunk in enumerate(iter_chunks(path, chunk_chars)):
+        score = bm25_score(query_terms, tokenize(chunk), idf, avg_length)
+        if score <= 0 and idf:
+            continue
+        item = (score, -position, chunk)
+        if len(top) < max_chunks:
+            heapq.heappush(top, item)
+        else:
+            heapq.heappushpop(top, item)
+    return [chunk for _, _, chunk in sorted(top, key=lambda item: -item[1])]
+
+
+class FullTextStore:
+    """
+    arXiv IDをキーにした論文本文のディスクキャッシュ (スレッドセーフ)
+    キャッシュになければPDFをダウンロードして抽出する。同じ論文を同時に要求された場合は
+    1回だけダウンロードし、他の呼び出しはその完了を待つ
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        session: Optional[requests.Session] = None,
+        max_pdf_bytes: int = FULLTEXT_MAX_PDF_BYTES,
+        max_pages: int = FULLTEXT_MAX_PAGES,
+        max_downloads: int = FULLTEXT_MAX_DOWNLOADS,
+        max_extractions: int = FULLTEXT_MAX_EXTRACTIONS,
+    ):
+        self.directory = directory
+        self.session = session or TimeoutSession(SERVICE_TIMEOUTS["arxiv_pdf"])
+        self.max_pdf_bytes = max_pdf_bytes
+        self.max_pages = max_pages
+        self._downloads = threading.Semaphore(max(1, max_downloads))
+        self._extractions = threading.Semaphore(max(1, max_extractions))
+        # arXiv ID -> [取得中のロック, 待っている呼び出しの数]
+        self._claims: Dict[str, list] = {}
+        self._claims_lock = threading.Lock()
+
+    def text_path(self, arxiv_id: str) -> str:
+        # 旧形式のID (cs/0101001) の "/" はファイル名に使えないので置き換える
+        return os.path.join(self.directory, arxiv_id.replace("/", "_") + ".txt")
+
+    def excerpt(
+        self,
+        arxiv_id: str,
+        url: str,
+        query: str,
+        max_chunks: int = FULLTEXT_MAX_CHUNKS,
+        chunk_chars: int = FULLTEXT_CHUNK_CHARS,
+    ) -> str:
+        """本文のうち query に関連するチャンクを区切り線でつないで返す"""
+        chunks = select_chunks(self.fetch(arxiv_id, url), query, max_chunks, chunk_chars)
+        return "\n\n[...]\n\n".join(chunks)
+
+    def fetch(self, arxiv_id: str, url: str) -> str:
+        """本文のテキストファイルのパスを返す (キャッシュになければPDFから抽出する)"""
+        path = self.text_path(arxiv_id)
+        with self._claims_lock:
+            claim = self._claims.setdefault(arxiv_id, [threading.Lock(), 0])
+            claim[1] += 1
+        try:
+            with claim[0]:
+                cached = os.path.exists(path)
+                record_cache("fulltext", cached)
+                if not cached:
+                    self._download_and_extract(pdf_url(url), path)
+        finally:
+            with self._claims_lock:
+                claim[1] -= 1
+                if claim[1] == 0:
+                    del self._claims[arxiv_id]
+        return path
+
+    def _download_and_extract(self, url: str, path: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.directory) as workdir:
+            pdf_path = os.path.join(workdir, "paper.pdf")
+            started = time.monotonic()
+            with self._downloads:
+                # 上限超え・4xx はリトライしない (タイムアウト・接続エラー・429/5xx のみ)
+                size = call_upstream("arxiv_pdf", lambda: self._download(url, pdf_path))
+            with self._extractions:
+                pages = self._extract(pdf_path, path)
+        logger.info(
+            "extracted full text",
+            url=url,
+            bytes=size,
+            pages=pages,
+            seconds=round(time.monotonic() - started, 2),
+        )
+
+    def _download(self, url: str, pdf_path: str) -> int:
+        """PDFをブロックごとに一時ファイルへ書く (上限サイズ・全体の制限時間を超えたら中断)"""
+        deadline = time.monotonic() + SERVICE_TIMEOUTS["arxiv_pdf"]
+        size = 0
+        with instrument_call("arxiv_pdf", "download"):
+            with self.session.get(url, stream=True) as response:
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise RetryableStatusError(response.status_code)
+                response.raise_for_status()
+                length = response.headers.get("content-length")
+                if length is not None and int(length) > self.max_pdf_bytes:
+                    raise PdfTooLargeError(f"PDFが大きすぎます ({int(length)} bytes)")
+                with open(pdf_path, "wb") as f:
+                    for block in response.iter_content(_DOWNLOAD_BLOCK_BYTES):
+                        size += len(block)
+                        if size > self.max_pdf_bytes:
+                            raise PdfTooLargeError(
+                                f"PDFが上限 ({self.max_pdf_bytes} bytes) を超えました"
+                            )
+                        if time.monotonic() > deadline:
+                            raise UpstreamTimeoutError("PDFのダウンロードが制限時間を超えました")
+                        f.write(block)
+        return size
+
+    def _extract(self, pdf_path: str, path: str) -> int:
+        """
+        先頭から max_pages ページまでの本文をページごとにテキストファイルへ書き出す
+        PDFはファイルのまま読み、ページの内容は1ページずつ展開する
+        """
+        # pypdf は読み込みに時間がかかるため、本文モードで初めて抽出するときにインポートする
+        import pypdf
+
+        partial = path + ".part"
+        pages = 0
+        try:
+            with open(pdf_path, "rb") as pdf, open(partial, "w", encoding="utf-8") as out:
+                reader = pypdf.PdfReader(pdf)
+                for page in itertools.islice(reader.pages, self.max_pages):
+                    out.write((page.extract_text() or "").strip() + "\n\n")
+                    pages += 1
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        # 書き終えてから置き換えるので、途中で止まっても壊れたキャッシュは残らない
+        os.replace(partial, path)
+        return pages
+
@@ -0,0 +1,90 @@
+"""
+http_clients.py - 耐障害性レイヤーを通す HTTP クライアント
+
+resilience.py のタイムアウト・リトライ・サーキットブレーカーを、requests (arXiv・PDF) と
+httpx (OpenAI SDK) のクライアントに組み込むアダプターです。
+requests / httpx は読み込みに時間がかかるため、ヘルスチェックに使う resilience.py とは分けています。
+"""
+
+from typing import Optional
+
+import httpx
+import requests
+
+from observability import RATE_LIMIT_WAIT
+from ratelimit import TokenBucket
+from resilience import SERVICE_TIMEOUTS, RetryableStatusError, call
+
+
+class TimeoutSession(requests.Session):
+    """タイムアウトを指定しないリクエストにデフォルトのタイムアウトを付ける requests.Session"""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """
+    httpx のリクエストをこの層を通して送るトランスポート (OpenAI SDK 用)
+    SDK 自身のリトライ (max_retries) は 0 にして使う。
+    リトライしても 429/5xx が続いた場合は、最後の応答をそのまま SDK に返してエラーにさせる
+    bucket を渡すと、リトライを含む各リクエストの前にトークンを取る
+    """
+
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        service: str,
+        transport: Optional[httpx.BaseTransport] = None,
+        bucket: Optional[TokenBucket] = None,
+    ):
+        self.service = service
+        self.transport = transport or httpx.HTTPTransport()
+        self.bucket = bucket
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        def send() -> httpx.Response:
+            if self.bucket is not None:
+                RATE_LIMIT_WAIT.observe(self.bucket.acquire(), service=self.service)
+            response = self.transport.handle_request(request)
+            if response.status_code in self.RETRYABLE_STATUS:
+                response.read()
+                response.close()
+                raise RetryableStatusError(
+                    response.status_code, _retry_after_seconds(response), response
+                )
+            return response
+
+        try:
+            return call(self.service, send)
+        except RetryableStatusError as e:
+            return e.response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+def resilient_http_client(
+    service: str,
+    transport: Optional[httpx.BaseTransport] = None,
+    bucket: Optional[TokenBucket] = None,
+) -> httpx.Client:
+    """ResilientTransport を使う httpx.Client (タイムアウトはサービスの設定値)"""
+    return httpx.Client(
+        transport=ResilientTransport(service, transport, bucket),
+        timeout=SERVICE_TIMEOUTS[service],
+        follow_redirects=True,
+    )
@@ -0,0 +1,587 @@
+"""
+jobs.py - 分析ジョブの管理
+
+時間のかかる分析をリクエストのスレッドから切り離して実行するための
+ジョブストアとワーカープールを定義します。ジョブの保存先は StateBackend に合わせて選びます。
+
+- `InMemoryJobStore`: プロセス内に保持する（デフォルト）
+- `SQLiteJobStore`: SQLiteに保存し、再起動後もジョブを参照・再開できる。
+  共有ボリューム上のファイルなら、複数のワーカーが同じジョブを参照し、
+  止まったワーカーのジョブを別のワーカーが引き取る
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
+
+from observability import REGISTRY, get_logger
+from results import ResultStore, content_hash
+from state_backend import SQLiteBackend, StateBackend
+
+logger = get_logger("jobs")
+
+JOBS_SUBMITTED = REGISTRY.counter(
+    "paper_agent_jobs_submitted_total",
+    "受け付けた分析ジョブの数 (coalesced=true は実行中のジョブに相乗りしたもの)",
+    ["coalesced"],
+)
+
+# ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+_UNFINISHED = (JOB_QUEUED, JOB_RUNNING)
+
+
+class Job(TypedDict):
+    id: str
+    status: str
+    request: Dict[str, Any]  # AnalysisRequest の内容
+    current_node: Optional[str]  # 実行中のLangGraphノード
+    completed_nodes: List[str]
+    result: Optional[Dict[str, Any]]  # AnalysisResponse の内容
+    result_hash: Optional[str]  # result の内容のハッシュ (ResultStore のキー・ETag に使う)
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+
+
+class JobQueueFullError(Exception):
+    """待ち行列が上限に達していて、ジョブを受け付けられない"""
+
+
+class JobNotResumableError(Exception):
+    """失敗していないジョブは再開できない"""
+
+
+class JobStore(ABC):
+    """
+    ジョブストアのインターフェース
+    未完了のジョブには担当ワーカー (owner) と、担当が生きていることを示す時刻 (heartbeat) を持たせ、
+    時刻が古くなったジョブは別のワーカーが claim_stale() で引き取る
+    """
+
+    @abstractmethod
+    def create(
+        self, job: Job, dedupe_key: Optional[str] = None, owner: Optional[str] = None
+    ) -> Optional[Job]:
+        """
+        ジョブを保存する
+        dedupe_key が同じ未完了のジョブがすでにあれば、保存せずにそのジョブを返す (なければ None)
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def find_unfinished(self, dedupe_key: str) -> Optional[Job]:
+        """dedupe_key が同じ queued / running のジョブを返す"""
+
+    @abstractmethod
+    def update(self, job_id: str, owner: Optional[str] = None, **fields: Any) -> None:
+        """ジョブを更新する。owner を指定するとそのワーカーの担当にする"""
+
+    @abstractmethod
+    def heartbeat(self, owner: str) -> None:
+        """owner が担当する未完了のジョブの時刻を更新する"""
+
+    @abstractmethod
+    def claim_stale(self, owner: str, lease_seconds: float) -> List[Job]:
+        """
+        時刻が lease_seconds より古い (担当ワーカーが止まった) queued / running のジョブを
+        owner の担当にして作成順に返す
+        """
+
+
+class InMemoryJobStore(JobStore):
+    """プロセス内の辞書にジョブを保持する (再起動で消える)"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        # ジョブID -> [dedupe_key, 担当ワーカー, 時刻]
+        self._leases: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def create(
+        self, job: Job, dedupe_key: Optional[str] = None, owner: Optional[str] = None
+    ) -> Optional[Job]:
+        with self._lock:
+            existing = self._find_unfinished(dedupe_key) if dedupe_key else None
+            if existing is not None:
+                return Job(**existing)
+            self._jobs[job["id"]] = Job(**job)
+            self._leases[job["id"]] = [dedupe_key, owner, time.time()]
+        return None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return Job(**job) if job is not None else None
+
+    def _find_unfinished(self, dedupe_key: str) -> Optional[Job]:
+        for job_id, (key, _, _) in self._leases.items():
+            if key == dedupe_key and self._jobs[job_id]["status"] in _UNFINISHED:
+                return self._jobs[job_id]
+        return None
+
+    def find_unfinished(self, dedupe_key: str) -> Optional[Job]:
+        with self._lock:
+            job = self._find_unfinished(dedupe_key)
+            return Job(**job) if job is not None else None
+
+    def update(self, job_id: str, owner: Optional[str] = None, **fields: Any) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields, updated_at=time.time())
+            if owner is not None:
+                self._leases[job_id][1:] = [owner, time.time()]
+
+    def heartbeat(self, owner: str) -> None:
+        now = time.time()
+        with self._lock:
+            for job_id, lease in self._leases.items():
+                if lease[1] == owner and self._jobs[job_id]["status"] in _UNFINISHED:
+                    lease[2] = now
+
+    def claim_stale(self, owner: str, lease_seconds: float) -> List[Job]:
+        now = time.time()
+        with self._lock:
+            jobs = []
+            for job_id, lease in self._leases.items():
+                job = self._jobs[job_id]
+                if job["status"] in _UNFINISHED and now - lease[2] > lease_seconds:
+                    lease[1:] = [owner, now]
+                    jobs.append(Job(**job))
+        return sorted(jobs, key=lambda job: job["created_at"])
+
+
+class SQLiteJobStore(JobStore):
+    """SQLiteにジョブを保存する (再起動後も残り、同じファイルを開いたワーカー間で共有される)"""
+
+    def __init__(self, backend: SQLiteBackend):
+        self.backend = backend
+        with backend.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            # 担当ワーカーの列がない古いファイルには列を足す (既存のジョブは担当なし = 引き取り対象)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (
+                ("dedupe_key", "TEXT"),
+                ("owner", "TEXT"),
+                ("heartbeat_at", "REAL"),
+            ):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_dedupe_key ON jobs (dedupe_key)"
+            )
+
+    @staticmethod
+    def _find_unfinished(conn, dedupe_key: str) -> Optional[Job]:
+        row = conn.execute(
+            "SELECT data FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) "
+            "ORDER BY created_at LIMIT 1",
+            (dedupe_key, *_UNFINISHED),
+        ).fetchone()
+        return Job(**json.loads(row[0])) if row is not None else None
+
+    def create(
+        self, job: Job, dedupe_key: Optional[str] = None, owner: Optional[str] = None
+    ) -> Optional[Job]:
+        with self.backend.transaction() as conn:
+            if dedupe_key is not None:
+                existing = self._find_unfinished(conn, dedupe_key)
+                if existing is not None:
+                    return existing
+            conn.execute(
+                "INSERT INTO jobs (id, status, data, created_at, dedupe_key, owner, "
+                "heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job["id"],
+                    job["status"],
+                    json.dumps(job, ensure_ascii=False),
+                    job["created_at"],
+                    dedupe_key,
+                    owner,
+                    time.time(),
+                ),
+            )
+        return None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.backend.transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return Job(**json.loads(row[0])) if row is not None else None
+
+    def find_unfinished(self, dedupe_key: str) -> Optional[Job]:
+        with self.backend.transaction() as conn:
+            return self._find_unfinished(conn, dedupe_key)
+
+    def update(self, job_id: str, owner: Optional[str] = None, **fields: Any) -> None:
+        with self.backend.transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            job = json.loads(row[0])
+            job.update(fields, updated_at=time.time())
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ? WHERE id = ?",
+                (job["status"], json.dumps(job, ensure_ascii=False), job_id),
+            )
+            if owner is not None:
+                conn.execute(
+                    "UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE id = ?",
+                    (owner, time.time(), job_id),
+                )
+
+    def heartbeat(self, owner: str) -> None:
+        with self.backend.transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time(), owner, *_UNFINISHED),
+            )
+
+    def claim_stale(self, owner: str, lease_seconds: float) -> List[Job]:
+        now = time.time()
+        with self.backend.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM jobs WHERE status IN (?, ?) "
+                "AND (heartbeat_at IS NULL OR heartbeat_at < ?) ORDER BY created_at",
+                (*_UNFINISHED, now - lease_seconds),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE id = ?",
+                [(owner, now, row[0]) for row in rows],
+            )
+        return [Job(**json.loads(row[1])) for row in rows]
+
+
+def create_job_store(backend: StateBackend) -> JobStore:
+    """共有できるバックエンド (SQLite) ならSQLite、それ以外はインメモリのストアを返す"""
+    if isinstance(backend, SQLiteBackend):
+        return SQLiteJobStore(backend)
+    return InMemoryJobStore()
+
+
+class JobEventLog:
+    """
+    1ジョブ分の進捗イベント列 (SSE配信用)
+
+    プロセス内にのみ保持し、途中から接続したクライアントにも先頭から再送できるよう
+    ジョブが終わるまで全イベントを残しておく。
+    """
+
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def append(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self._events.append(event)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+
+    def read(self, start: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """start 番目以降のイベントと、ジョブが終了済みかどうかを返す"""
+        with self._lock:
+            return self._events[start:], self._closed
+
+
+# runner(job_id, request, on_progress, on_event) -> result
+# on_progress(current_node, completed_nodes) でノードの進捗を、
+# on_event(event) でノード内の途中経過を通知する。
+# 同じ job_id で再実行された場合は、前回の続きから実行してよい
+ProgressCallback = Callable[[Optional[str], List[str]], None]
+EventCallback = Callable[[Dict[str, Any]], None]
+JobRunner = Callable[
+    [str, Dict[str, Any], ProgressCallback, EventCallback], Dict[str, Any]
+]
+
+# 終了済みジョブのイベント列を保持しておく件数
+EVENT_LOG_RETENTION = 100
+
+
+def _worker_id() -> str:
+    """このプロセスを表すワーカーID (ホスト名とプロセスIDに乱数を足したもの)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobManager:
+    """
+    ジョブを受け付けてワーカープールで実行する
+
+    実行中 + 待機中のジョブが `max_workers + max_queue` 件に達している間は
+    新しいジョブを受け付けず `JobQueueFullError` を送出する。
+    同じ `dedupe_key` のジョブが実行中 (待機中を含む) なら、新しく作らずにそのジョブを返す
+    (single-flight。ストアを共有していれば他のワーカーのジョブも対象)。
+    失敗したジョブは `max_retries` 回まで同じジョブIDで再実行する。
+    受け付けたジョブの時刻を `lease_seconds / 3` ごとに更新し、
+    時刻が `lease_seconds` より古い他のワーカーのジョブは止まったとみなして引き取る。
+    実行数・待ち行列の上限はワーカーごと。
+    完了したジョブの結果は内容のハッシュ (`result_hash`) と一緒に保存し、
+    `result_store` を指定すればハッシュをキーにそちらにも保存する
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        runner: JobRunner,
+        max_workers: int,
+        max_queue: int,
+        max_retries: int = 0,
+        lease_seconds: float = 60,
+        result_store: Optional[ResultStore] = None,
+    ):
+        self.store = store
+        self.runner = runner
+        self.result_store = result_store
+        self.capacity = max_workers + max_queue
+        self.max_retries = max_retries
+        self.lease_seconds = lease_seconds
+        self.worker_id = _worker_id()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="analysis-job"
+        )
+        self._active = 0
+        self._lock = threading.Lock()
+        self._event_logs: Dict[str, JobEventLog] = {}
+        # 終了済みジョブのID (終了した順。再開したジョブは実行中の間は含めない)
+        self._finished_job_ids: "OrderedDict[str, None]" = OrderedDict()
+        self.submitted_count = 0
+        self.coalesced_count = 0
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=self._keep_alive, name="analysis-job-lease", daemon=True
+        ).start()
+
+    def submit(
+        self,
+        request: Dict[str, Any],
+        dedupe_key: Optional[str] = None,
+        job_id: Optional[str] = None,
+    ) -> Tuple[Job, bool]:
+        """
+        ジョブを登録して実行待ちに入れる
+        (ジョブ, 既存のジョブを返したかどうか) を返す。
+        job_id を指定した場合、そのIDのジョブが失敗していれば続きから再実行し、
+        それ以外 (待機中・実行中・成功) ならそのまま返す
+        """
+        with self._lock:
+            existing = self.store.get(job_id) if job_id is not None else None
+            if existing is not None and existing["status"] != JOB_FAILED:
+                return existing, True
+            if dedupe_key is not None:
+                job = self.store.find_unfinished(dedupe_key)
+                if job is not None:
+                    self.coalesced_count += 1
+                    JOBS_SUBMITTED.inc(coalesced="true")
+                    return job, True
+            if self._active >= self.capacity:
+                raise JobQueueFullError(
+                    f"実行待ちのジョブが上限 ({self.capacity}件) に達しています"
+                )
+            now = time.time()
+            job = Job(
+                id=job_id or uuid.uuid4().hex,
+                status=JOB_QUEUED,
+                request=request,
+                current_node=None,
+                completed_nodes=[],
+                result=None,
+                result_hash=None,
+                error=None,
+                created_at=now,
+                updated_at=now,
+            )
+            if existing is not None:
+                self.store.update(
+                    job["id"],
+                    owner=self.worker_id,
+                    status=JOB_QUEUED,
+                    current_node=None,
+                    error=None,
+                )
+                job = self.store.get(job["id"])
+            else:
+                # 他のワーカーが同時に同じジョブを作っていれば、そちらに相乗りする
+                other = self.store.create(job, dedupe_key, self.worker_id)
+                if other is not None:
+                    self.coalesced_count += 1
+                    JOBS_SUBMITTED.inc(coalesced="true")
+                    return other, True
+            self._active += 1
+            self.submitted_count += 1
+            JOBS_SUBMITTED.inc(coalesced="false")
+        self._start(job["id"], request)
+        return job, False
+
+    def stats(self) -> Dict[str, int]:
+        """受付状況の集計 (実行中+待機中の件数、上限、新規受付数、相乗り数)"""
+        with self._lock:
+            return {
+                "active": self._active,
+                "capacity": self.capacity,
+                "submitted": self.submitted_count,
+                "coalesced": self.coalesced_count,
+            }
+
+    def resume_unfinished(self) -> int:
+        """
+        担当ワーカーが止まった (前回のプロセスを含む) 未完了のジョブを引き取って再投入する
+        起動時に呼び、その後も定期的に呼ばれる。上限は考慮せず、すべて投入する。投入した件数を返す
+        """
+        jobs = self.store.claim_stale(self.worker_id, self.lease_seconds)
+        for job in jobs:
+            with self._lock:
+                self._active += 1
+            self.store.update(
+                job["id"], status=JOB_QUEUED, current_node=None, completed_nodes=[]
+            )
+            self._start(job["id"], job["request"])
+        return len(jobs)
+
+    def resume(self, job_id: str) -> Optional[Job]:
+        """
+        失敗したジョブを同じジョブIDで再投入する (存在しなければ None)
+        失敗していなければ JobNotResumableError、上限に達していれば JobQueueFullError
+        """
+        with self._lock:
+            job = self.store.get(job_id)
+            if job is None:
+                return None
+            if job["status"] != JOB_FAILED:
+                raise JobNotResumableError(
+                    f"ジョブ {job_id} は {job['status']} のため再開できません"
+                )
+            if self._active >= self.capacity:
+                raise JobQueueFullError(
+                    f"実行待ちのジョブが上限 ({self.capacity}件) に達しています"
+                )
+            self._active += 1
+            self.store.update(
+                job_id,
+                owner=self.worker_id,
+                status=JOB_QUEUED,
+                current_node=None,
+                error=None,
+            )
+        self._start(job_id, job["request"])
+        return self.store.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def events(self, job_id: str) -> Optional[JobEventLog]:
+        """ジョブのイベント列を返す (再起動前のジョブや古いジョブは None)"""
+        with self._lock:
+            return self._event_logs.get(job_id)
+
+    def _start(self, job_id: str, request: Dict[str, Any]) -> None:
+        with self._lock:
+            self._event_logs[job_id] = JobEventLog()
+            # 再開したジョブは、実行中にイベント列を捨てられないよう終了済みから外す
+            self._finished_job_ids.pop(job_id, None)
+        self._executor.submit(self._run, job_id, request)
+
+    def _finish_events(self, job_id: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            log = self._event_logs[job_id]
+            # 終了済みジョブのイベント列は古いものから捨てる
+            self._finished_job_ids[job_id] = None
+            self._finished_job_ids.move_to_end(job_id)
+            while len(self._finished_job_ids) > EVENT_LOG_RETENTION:
+                finished_id, _ = self._finished_job_ids.popitem(last=False)
+                self._event_logs.pop(finished_id, None)
+        log.append(event)
+        log.close()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _keep_alive(self) -> None:
+        """担当するジョブの時刻を更新し、止まったワーカーのジョブを引き取る"""
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self.store.heartbeat(self.worker_id)
+                resumed = self.resume_unfinished()
+                if resumed:
+                    logger.info("took over jobs from a stopped worker", count=resumed)
+            except Exception as e:
+                logger.warning("updating job lease failed", error=str(e))
+
+    def _run(self, job_id: str, request: Dict[str, Any]) -> None:
+        log = self.events(job_id)
+
+        def on_progress(current_node: Optional[str], completed_nodes: List[str]):
+            self.store.update(
+                job_id, current_node=current_node, completed_nodes=list(completed_nodes)
+            )
+            log.append(
+                {
+                    "type": "progress",
+                    "current_node": current_node,
+                    "completed_nodes": list(completed_nodes),
+                }
+            )
+
+        try:
+            self.store.update(job_id, status=JOB_RUNNING)
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = self.runner(job_id, request, on_progress, log.append)
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    # 同じジョブIDで実行し直し、完了済みの処理は飛ばして続きから実行させる
+                    logger.warning(
+                        "retrying job", job_id=job_id, attempt=attempt + 1, error=str(e)
+                    )
+            result_hash = (
+                self.result_store.put(result)
+                if self.result_store is not None
+                else content_hash(result)
+            )
+            self.store.update(
+                job_id,
+                status=JOB_SUCCEEDED,
+                current_node=None,
+                result=result,
+                result_hash=result_hash,
+            )
+            self._finish_events(
+                job_id, {"type": "done", "status": JOB_SUCCEEDED, "result": result}
+            )
+        except Exception as e:
+            logger.error("job failed", job_id=job_id, error=str(e))
+            self.store.update(
+                job_id, status=JOB_FAILED, current_node=None, error=str(e)
+            )
+            self._finish_events(
+                job_id, {"type": "done", "status": JOB_FAILED, "error": str(e)}
+            )
+        finally:
+            with self._lock:
+                self._active -= 1
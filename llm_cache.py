@@ -0,0 +1,81 @@
+"""
+llm_cache.py - LLM呼び出し結果の永続キャッシュ
+
+temperature=0 の呼び出しは同じ入力に対してほぼ同じ出力を返すため、
+モデル名・プロンプト・ツール構成のハッシュをキーにして保存し再利用します。
+TTLを過ぎたエントリは無効となり、件数が上限を超えると最終参照が古い順 (LRU) に削除されます。
+保存先は StateBackend (ワーカー間で共有する場合は共有の SQLiteBackend) です。
+"""
+
+import hashlib
+import json
+import threading
+from typing import Any, Optional, Sequence
+
+from state_backend import StateBackend
+
+
+class LLMCache:
+    """TTL + LRU付きのキャッシュ (スレッドセーフ)"""
+
+    def __init__(
+        self,
+        backend: StateBackend,
+        ttl_seconds: float,
+        max_entries: int,
+        namespace: str = "llm_cache",
+    ):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # ヒット数・ミス数はこのプロセスでの参照分
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        namespace: str, model: str, prompt: str, tools: Sequence[Any] = ()
+    ) -> str:
+        """呼び出し内容 (用途・モデル・プロンプト・ツール構成) からキーを作る"""
+        tool_config = [
+            {"name": t.name, "description": t.description, "args": t.args}
+            for t in tools
+        ]
+        payload = json.dumps(
+            {
+                "namespace": namespace,
+                "model": model,
+                "prompt": prompt,
+                "tools": tool_config,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """キャッシュを参照する。見つからない・期限切れの場合は None"""
+        value = self.backend.cache_get(self.namespace, key, self.ttl_seconds)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        """値を保存し、上限を超えた分を古い順に削除する"""
+        self.backend.cache_set(
+            self.namespace,
+            key,
+            json.dumps(value, ensure_ascii=False),
+            self.max_entries,
+        )
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数・保存件数を返す"""
+        entries = self.backend.cache_count(self.namespace)
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,62 @@
+"""
+llm_metrics.py - LangChain のチャットモデル呼び出しのメトリクス
+
+LangChain のすべての呼び出しにコールバックを追加し、OpenAIの呼び出しごとの所要時間と失敗数を
+observability.py のメトリクスに記録します。LangChain は読み込みに時間がかかるため、
+APIの起動 (ヘルスチェック) に必要な observability.py とは分け、LangChain を使う agent.py が読み込みます。
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+from observability import EXTERNAL_DURATION, EXTERNAL_ERRORS
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """チャットモデル (OpenAI) の呼び出しごとの所要時間と失敗数を記録する"""
+
+    def __init__(self):
+        self._started: Dict[UUID, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, serialized: Optional[dict], kwargs: dict) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or "unknown"
+        with self._lock:
+            self._started[run_id] = (time.perf_counter(), model)
+
+    def _finish(self, run_id: UUID) -> Optional[str]:
+        with self._lock:
+            started, model = self._started.pop(run_id, (None, None))
+        if started is not None:
+            EXTERNAL_DURATION.observe(
+                time.perf_counter() - started, service="openai", operation=model
+            )
+        return model
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._start(run_id, serialized, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._start(run_id, serialized, kwargs)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs) -> None:
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        model = self._finish(run_id)
+        EXTERNAL_ERRORS.inc(service="openai", operation=model or "unknown")
+
+
+# すべてのLangChain呼び出しにコールバックとして追加される (デフォルト値のまま使う)
+_llm_metrics_handler: ContextVar[Optional[LLMMetricsHandler]] = ContextVar(
+    "llm_metrics_handler", default=LLMMetricsHandler()
+)
+register_configure_hook(_llm_metrics_handler, inheritable=True)
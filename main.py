@@ -1,32 +1,259 @@
 import os
+import time
+import uuid
 import typer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from agent import get_agent
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from config import load_env, validate_config
+
+# 各モジュールは設定をインポート時に読むため、.env はほかのモジュールより先に読み込む
+load_env()
+
+from batch import (  # noqa: E402
+    BATCH_FAILED,
+    BATCH_MAX_WORKERS,
+    BATCH_SUCCEEDED,
+    BatchLog,
+    batch_item_id,
+    item_key,
+    load_batch_file,
+)
+from model_router import summarize_tiers  # noqa: E402
+from schemas import (  # noqa: E402
+    ANALYSIS_MODE_AGENT,
+    ANALYSIS_MODE_BATCHED,
+    ARXIV_CANDIDATE_PAPERS,
+    AnalysisRequest,
+)
 
 app = typer.Typer()
 
 
+def start_command() -> None:
+    """
+    コマンドの開始時に設定を確認し、ログを設定する
+    agent.py (LangGraph / LangChain) などの重いモジュールは、`--help` や引数の誤りで
+    終わる場合に読み込まないよう、各コマンドで必要になってからインポートする
+    """
+    validate_config()
+    from observability import configure_logging
+
+    configure_logging()
+
+
+def stream_pipeline(
+    agent, context, inputs: Optional[Dict[str, Any]], run_id: str
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    パイプラインを実行し、ノードが完了するたびに (ノード名, 更新後の状態) を返す
+    inputs が None なら run_id のチェックポイントの続きから実行する。
+    最後まで進んだらチェックポイントを削除する
+    """
+    from agent import PIPELINE_NODES, clear_checkpoint, run_config
+
+    for s in agent.stream(inputs, run_config(run_id), context=context, durability="sync"):
+        node_name = list(s.keys())[0]
+        # ノード内のタスク (論文ごとの分析) の完了は含めない
+        if node_name not in PIPELINE_NODES:
+            continue
+        yield node_name, s[node_name]
+    clear_checkpoint(agent, run_id)
+
+
+def _report_dir() -> str:
+    obsidian_path = os.getenv("OBSIDIAN_PATH")
+    if not obsidian_path:
+        raise ValueError("OBSIDIAN_PATH environment variable is not set")
+    output_dir = os.path.expanduser(obsidian_path)
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+def _safe_keyword(keyword: str) -> str:
+    return keyword.replace(" ", "_").replace("/", "-")
+
+
+def save_report(keyword: str, report: str) -> str:
+    """レポートを OBSIDIAN_PATH に保存し、保存先のパスを返す"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    file_path = os.path.join(_report_dir(), f"{_safe_keyword(keyword)}_{timestamp}.md")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(report)
+    return file_path
+
+
+def append_report(
+    keyword: str, queries: List[str], update: str, file_path: Optional[str]
+) -> str:
+    """
+    購読のレポートファイルに新着論文のブロックを追記し、ファイルのパスを返す
+    ファイルがなければ (初回・削除された場合) 見出しと検索クエリを書いてから追記する
+    """
+    file_path = file_path or os.path.join(_report_dir(), f"{_safe_keyword(keyword)}.md")
+    if not os.path.exists(file_path):
+        header = f"# 論文分析レポート: {keyword}\n\n## 🔍 検索クエリ\n"
+        header += "".join(f"- `{q}`\n" for q in queries)
+        header += "\n新着論文を日付ごとに追記しています。\n\n---\n"
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(header)
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write(f"\n{update}\n")
+    return file_path
+
+
+def analyzed_published(state: Dict[str, Any]) -> Dict[str, str]:
+    """
+    新着論文のうち実際に分析した論文の arXiv ID -> 投稿日時
+    rank_papers で外れた論文と予算切れで分析を省略した論文は含めない (次回もう一度候補にする)
+    """
+    published = state.get("candidate_published") or {}
+    usages = state.get("paper_usage") or []
+    skipped = {usage["arxiv_id"] for usage in usages if usage["source"] == "skipped"}
+    return {
+        paper["arxiv_id"]: published[paper["arxiv_id"]]
+        for paper in state.get("core_papers") or []
+        if paper["arxiv_id"] in published and paper["arxiv_id"] not in skipped
+    }
+
+
+def finish_subscription(state: Dict[str, Any]) -> None:
+    """
+    購読の実行結果を反映する: 新着論文をレポートファイルに追記してから、
+    分析した論文と watermark を記録する (追記に失敗した場合は次回もう一度新着として扱う)
+    """
+    from subscriptions import SUBSCRIPTIONS_PATH, SubscriptionStore
+
+    store = SubscriptionStore(SUBSCRIPTIONS_PATH)
+    keyword = state["keyword"]
+    queries = state.get("queries") or []
+    subscription = store.get(keyword)
+    report_path = subscription["report_path"] if subscription else None
+    update = state.get("report_markdown")
+    if update:
+        report_path = append_report(keyword, queries, update, report_path)
+        print(f"📝 新着論文 {len(state['core_papers'])} 件をレポートに追記しました: {report_path}")
+        print("=" * 30 + "\n")
+        print(update)
+    else:
+        print("📭 分析する新着論文はありませんでした")
+    store.record(keyword, queries, analyzed_published(state), report_path)
+
+
 @app.command()
-def run(keyword: str):
+def run(
+    keyword: Optional[str] = typer.Argument(None, help="検索キーワード（--resume のときは不要）"),
+    bypass_cache: bool = typer.Option(
+        False, "--bypass-cache", help="LLMキャッシュを使わずに再分析する"
+    ),
+    analysis_mode: str = typer.Option(
+        ANALYSIS_MODE_AGENT,
+        "--analysis-mode",
+        help="agent: 論文ごとにエージェントで分析 / batched: まとめて要約し必要な論文だけエージェントで分析",
+    ),
+    full_text: bool = typer.Option(
+        False, "--full-text", help="PDFの本文から関連する箇所を選び、アブストラクトと合わせて分析する"
+    ),
+    top_k: Optional[int] = typer.Option(
+        None,
+        "--top-k",
+        min=1,
+        max=ARXIV_CANDIDATE_PAPERS,
+        help="関連度の高い順に分析する論文数（デフォルト: 10）",
+    ),
+    min_score: Optional[float] = typer.Option(
+        None, "--min-score", min=0, max=1, help="分析する論文の関連度スコア（0〜1）の下限"
+    ),
+    max_tokens: Optional[int] = typer.Option(
+        None, "--max-tokens", min=1, help="全体で使うLLMトークン数の上限"
+    ),
+    max_tool_calls: Optional[int] = typer.Option(
+        None, "--max-tool-calls", min=0, help="1本の論文の分析で使えるWeb検索の回数"
+    ),
+    max_seconds: Optional[float] = typer.Option(
+        None, "--max-seconds", min=0, help="全体の実行時間の上限（秒）"
+    ),
+    resume: Optional[str] = typer.Option(
+        None, "--resume", help="失敗した実行を実行IDで指定し、完了済みの処理を飛ばして続きから実行する"
+    ),
+    subscribe: bool = typer.Option(
+        False,
+        "--subscribe",
+        help="購読モード: 前回の実行より後に投稿された論文だけを分析し、同じレポートファイルに追記する",
+    ),
+):
     """
     論文分析エージェントをキーワードで実行します。
-    例: uv run python main.py "軽量なLLM"
+    例: uv run python main.py run "軽量なLLM"
+    再開: uv run python main.py run --resume <実行ID>
+    毎日の新着: uv run python main.py run "軽量なLLM" --subscribe
     """
-    print(f"🚀 エージェントを実行します (キーワード: '{keyword}')")
+    if analysis_mode not in (ANALYSIS_MODE_AGENT, ANALYSIS_MODE_BATCHED):
+        raise typer.BadParameter(
+            f"{ANALYSIS_MODE_AGENT} または {ANALYSIS_MODE_BATCHED} を指定してください",
+            param_hint="--analysis-mode",
+        )
+    if keyword is None and resume is None:
+        raise typer.BadParameter("キーワードか --resume を指定してください")
+    start_command()
+    from agent import get_agent, get_agent_context, load_checkpoint
 
     agent = get_agent()
-    inputs = {"keyword": keyword}
+    context = get_agent_context()
+    run_id = resume or uuid.uuid4().hex
+    inputs = {
+        "keyword": keyword,
+        "bypass_cache": bypass_cache,
+        "analysis_mode": analysis_mode,
+        "full_text": full_text,
+        "top_k": top_k,
+        "min_score": min_score,
+        "max_tokens": max_tokens,
+        "max_tool_calls_per_paper": max_tool_calls,
+        "max_seconds": max_seconds,
+    }
+
+    if subscribe and resume is None:
+        from subscriptions import SUBSCRIPTIONS_PATH, SubscriptionStore
+
+        store = SubscriptionStore(SUBSCRIPTIONS_PATH)
+        subscription = store.get(keyword)
+        since = store.since(subscription)
+        inputs.update(
+            incremental=True,
+            since=since,
+            exclude_ids=store.seen_ids(keyword, since),
+            # 初回に生成したクエリを使い回す (初回は generate_queries で生成する)
+            queries=subscription["queries"] if subscription else [],
+        )
+        if since is None:
+            print("📬 購読を開始します (各クエリの新しい論文から分析します)")
+        else:
+            print(f"📬 {since[:10]} 以降に投稿された新着論文を探します")
 
     final_state = None
+    if resume is not None:
+        checkpoint = load_checkpoint(agent, resume)
+        if checkpoint is None:
+            raise typer.BadParameter(
+                f"実行ID {resume} のチェックポイントが見つかりません", param_hint="--resume"
+            )
+        # 入力に None を渡すと保存済みの状態の続きから実行される
+        inputs = None
+        keyword = checkpoint.values["keyword"]
+        final_state = checkpoint.values
+        print(f"🔁 実行 {run_id} を再開します (キーワード: '{keyword}', 次: {list(checkpoint.next)})")
+    else:
+        print(f"🚀 エージェントを実行します (キーワード: '{keyword}', 実行ID: {run_id})")
 
     try:
-        for s in agent.stream(inputs, {"recursion_limit": 100}):
-            node_name = list(s.keys())[0]
+        for node_name, state in stream_pipeline(agent, context, inputs, run_id):
             print(f"\n[✅ ノード完了: {node_name}]")
             if node_name == "generate_queries":
-                print(f"👉 Generated Queries: {s[node_name].get('queries')}")
+                print(f"👉 Generated Queries: {state.get('queries')}")
 
-            final_state = s
+            final_state = state
 
         print("\n\n" + "=" * 30)
         print("      📝 分析レポート      ")
@@ -34,24 +261,13 @@ def run(keyword: str):
 
         if final_state:
             # 最後のノード（compile_report）の結果を取得
-            last_node_output = list(final_state.values())[0]
-            report = last_node_output.get("report_markdown")
-
-            if report:
-                obsidian_path = os.getenv("OBSIDIAN_PATH")
-                if not obsidian_path:
-                    raise ValueError(
-                        "OBSIDIAN_PATH environment variable is not set"
-                    )
-                output_dir = os.path.expanduser(obsidian_path)
-                os.makedirs(output_dir, exist_ok=True)
-                safe_keyword = keyword.replace(" ", "_").replace("/", "-")
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"{safe_keyword}_{timestamp}.md"
-                file_path = os.path.join(output_dir, filename)
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(report)
+            report = final_state.get("report_markdown")
+            print_usage(final_state)
 
+            if final_state.get("incremental"):
+                finish_subscription(final_state)
+            elif report:
+                file_path = save_report(keyword, report)
                 print(f"📝 レポートを保存しました: {file_path}")
                 print("=" * 30 + "\n")
                 print(report)
@@ -60,6 +276,176 @@ def run(keyword: str):
 
     except Exception as e:
         print(f"\n[❌ エラー発生] 処理中にエラーが発生しました: {e}")
+        if load_checkpoint(agent, run_id) is not None:
+            print(f"🔁 続きから再実行するには: uv run python main.py run --resume {run_id}")
+
+
+def print_usage(state: dict) -> None:
+    """ノードごとの使用量と予算切れの有無を表示する"""
+    print(f"🧮 使用トークン: {state.get('tokens_used') or 0}")
+    for node_name, usage in (state.get("node_usage") or {}).items():
+        print(
+            f"   - {node_name}: {usage['total_tokens']} tokens / "
+            f"{usage['llm_calls']} calls / {usage['seconds']:.1f}s"
+        )
+    routing = state.get("routing") or []
+    for tier, usage in summarize_tiers(routing).items():
+        print(
+            f"   - tier {tier}: {usage['calls']} calls / {usage['passed']} passed / "
+            f"avg {usage['avg_seconds']:.1f}s"
+        )
+    escalated = sum(1 for route in routing if route["escalated"])
+    if escalated:
+        print(f"🔼 {escalated} 件を安いモデルの結果から強い tier に切り替えました")
+    if state.get("budget_exhausted"):
+        print(f"⚠️ 予算の上限 ({state['budget_exhausted']}) に達したため一部の分析を省略しました")
+
+
+def run_batch_item(agent, context, request: AnalysisRequest, run_id: str) -> Dict[str, Any]:
+    """
+    バッチの1件を最後まで実行し、最終状態を返す
+    同じ実行IDのチェックポイントが残っていれば (前回の失敗・中断) 続きから実行する
+    """
+    from agent import load_checkpoint
+
+    checkpoint = load_checkpoint(agent, run_id)
+    inputs = None if checkpoint is not None else request.model_dump()
+    state = checkpoint.values if checkpoint is not None else inputs
+    for _, state in stream_pipeline(agent, context, inputs, run_id):
+        pass
+    return state
+
+
+def _batch_record(
+    index: int, run_id: str, request: AnalysisRequest, state: Dict[str, Any], seconds: float
+) -> Dict[str, Any]:
+    """結果のJSONLに書く1行 (成功時)"""
+    papers = state.get("core_papers") or []
+    scores = state.get("relevance_scores") or [None] * len(papers)
+    return {
+        "index": index,
+        "id": run_id,
+        "keyword": request.keyword,
+        "status": BATCH_SUCCEEDED,
+        "queries": state.get("queries") or [],
+        "papers": [
+            {
+                "arxiv_id": p["arxiv_id"],
+                "title": p["title"],
+                "url": p["url"],
+                "relevance_score": score,
+            }
+            for p, score in zip(papers, scores)
+        ],
+        "report_markdown": state.get("report_markdown") or "",
+        "report_path": None,
+        "tokens_used": state.get("tokens_used") or 0,
+        "budget_exhausted": state.get("budget_exhausted"),
+        "elapsed_seconds": round(seconds, 3),
+        "error": None,
+    }
+
+
+@app.command()
+def batch(
+    file: str = typer.Argument(..., help="1行に1件の分析リクエスト (JSONL)"),
+    output: Optional[str] = typer.Option(
+        None, "--output", "-o", help="結果のJSONLの保存先（デフォルト: <入力>.results.jsonl）"
+    ),
+    workers: int = typer.Option(
+        BATCH_MAX_WORKERS, "--workers", min=1, help="同時に分析するキーワード数"
+    ),
+    batch_id: Optional[str] = typer.Option(
+        None, "--batch-id", help="再実行時に前回の続きとみなすID（デフォルト: 結果のJSONLのパス）"
+    ),
+):
+    """
+    多数のキーワードをまとめて分析します。
+    入力の各行は {"keyword": "...", "top_k": 5, ...} またはキーワードだけの文字列です。
+    結果は完了した順に JSONL へ追記し、OBSIDIAN_PATH があればレポートもその都度保存します。
+    同じコマンドを実行し直すと、完了済みの行は飛ばし、途中の行は続きから実行します。
+    例: uv run python main.py batch topics.jsonl --workers 8
+    """
+    try:
+        items = load_batch_file(file)
+        requests = [AnalysisRequest(**item) for item in items]
+    except (OSError, ValueError, ValidationError) as e:
+        raise typer.BadParameter(str(e), param_hint="FILE")
+    resume_command = f"uv run python main.py batch {file}"
+    if output:
+        resume_command += f" --output {output}"
+    if batch_id:
+        resume_command += f" --batch-id {batch_id}"
+    output = output or f"{os.path.splitext(file)[0]}.results.jsonl"
+    batch_id = batch_id or os.path.abspath(output)
+    start_command()
+
+    log = BatchLog(output)
+    done = log.completed()
+    # 同じ条件のキーワードは1回だけ分析し、結果をすべての行に書く
+    groups: Dict[str, List[int]] = {}
+    for index, request in enumerate(requests):
+        if index not in done:
+            groups.setdefault(item_key(request.model_dump()), []).append(index)
+    print(
+        f"🚀 {len(requests)} 件のバッチを実行します "
+        f"(完了済み: {len(done)} 件, 並列数: {workers}, 結果: {output})"
+    )
+    if not groups:
+        return
+
+    from agent import get_agent, get_agent_context
+
+    agent = get_agent()
+    context = get_agent_context()
+    save_reports = bool(os.getenv("OBSIDIAN_PATH"))
+
+    def run_group(indices: List[int]) -> Tuple[Dict[str, Any], List[int]]:
+        index = indices[0]
+        run_id = batch_item_id(batch_id, index)
+        started = time.monotonic()
+        try:
+            state = run_batch_item(agent, context, requests[index], run_id)
+            record = _batch_record(index, run_id, requests[index], state, time.monotonic() - started)
+            if save_reports and record["report_markdown"]:
+                record["report_path"] = save_report(requests[index].keyword, record["report_markdown"])
+        except Exception as e:
+            record = {
+                "index": index,
+                "id": run_id,
+                "keyword": requests[index].keyword,
+                "status": BATCH_FAILED,
+                "elapsed_seconds": round(time.monotonic() - started, 3),
+                "error": str(e),
+            }
+        for other in indices:
+            log.write({**record, "index": other, "keyword": requests[other].keyword})
+        return record, indices
+
+    finished = len(done)
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    futures = [executor.submit(run_group, indices) for indices in groups.values()]
+    try:
+        for future in as_completed(futures):
+            record, indices = future.result()
+            finished += len(indices)
+            if record["status"] == BATCH_SUCCEEDED:
+                where = record["report_path"] or output
+                print(f"✅ [{finished}/{len(requests)}] {record['keyword']} → {where}")
+            else:
+                failed += len(indices)
+                print(f"❌ [{finished}/{len(requests)}] {record['keyword']}: {record['error']}")
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        print("\n⏸ 中断しました。実行中の分析が終わるまで待ちます（同じコマンドで続きから再開できます）")
+        raise typer.Exit(130)
+    executor.shutdown()
+
+    print(f"\n📦 バッチ完了: 成功 {len(requests) - failed} 件 / 失敗 {failed} 件 ({output})")
+    if failed:
+        print(f"🔁 失敗した行を続きから再実行するには: {resume_command}")
+        raise typer.Exit(1)
 
 
 if __name__ == "__main__":
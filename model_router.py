@@ -0,0 +1,266 @@
+"""
+model_router.py - ノードごとのモデルの振り分け (安い tier で先に試し、検査に落ちたら強い tier へ)
+
+generate_queries と analyze_paper は、ノードごとに設定した tier の並びを先頭から試します。
+各 tier の出力は安価なヒューリスティック (長さ・日本語か・論文の主要な用語に触れているか など)
+で検査し、通らなかった場合だけ次の tier に進みます。最後の tier の出力は検査に通らなくても使います。
+
+tier:
+- fast: LLM_FAST_MODEL をツールなしで1回呼び出す
+- strong: LLM_STRONG_MODEL をツールなしで1回呼び出す
+- agent: web_search ツール付きのReActエージェント (analyze_paper のみ。並びの最後に置く)
+
+振り分けの結果 (試した tier・検査に落ちた理由・tier ごとの所要時間) は RouteDecision として
+レスポンスの使用量に含めます。
+"""
+
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple, TypedDict, TypeVar
+
+T = TypeVar("T")
+
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+TIER_AGENT = "agent"
+
+NODE_GENERATE_QUERIES = "generate_queries"
+NODE_ANALYZE_PAPER = "analyze_paper"
+
+# ノードごとに使える tier
+NODE_TIERS = {
+    NODE_GENERATE_QUERIES: (TIER_FAST, TIER_STRONG),
+    NODE_ANALYZE_PAPER: (TIER_FAST, TIER_STRONG, TIER_AGENT),
+}
+
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "gpt-4o")
+# ノードごとの tier の並び (カンマ区切り。先頭から試す)
+MODEL_ROUTES = {
+    NODE_GENERATE_QUERIES: os.getenv("MODEL_ROUTE_GENERATE_QUERIES", "fast,strong"),
+    NODE_ANALYZE_PAPER: os.getenv("MODEL_ROUTE_ANALYZE_PAPER", "fast,agent"),
+}
+
+# 論文の分析の検査: 文字数の範囲と、日本語の文字 (かな・漢字) の割合の下限
+ROUTER_MIN_ANALYSIS_CHARS = int(os.getenv("ROUTER_MIN_ANALYSIS_CHARS", "80"))
+ROUTER_MAX_ANALYSIS_CHARS = int(os.getenv("ROUTER_MAX_ANALYSIS_CHARS", "1200"))
+ROUTER_MIN_JAPANESE_RATIO = float(os.getenv("ROUTER_MIN_JAPANESE_RATIO", "0.3"))
+# 検索クエリの検査: 必要なクエリ数と1クエリの最大文字数
+ROUTER_EXPECTED_QUERIES = 3
+ROUTER_MAX_QUERY_CHARS = 120
+
+# 安い tier が「Web検索が必要」と答えるときの文言 (プロンプトで指定する)
+NEEDS_LOOKUP = "NEEDS_LOOKUP"
+
+# 検査に落ちた理由
+REASON_NEEDS_LOOKUP = "needs_lookup"
+REASON_TOO_SHORT = "too_short"
+REASON_TOO_LONG = "too_long"
+REASON_NOT_JAPANESE = "not_japanese"
+REASON_MISSING_KEY_TERMS = "missing_key_terms"
+REASON_UNCERTAIN = "uncertain"
+REASON_TOO_FEW_QUERIES = "too_few_queries"
+REASON_NOT_ENGLISH = "not_english"
+REASON_NUMBERED = "numbered"
+REASON_ERROR = "error"
+
+_JAPANESE_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]")
+# 内容が分からなかったことを示す言い回し (Web検索で補うべき)
+_UNCERTAIN_PHRASES = ("不明", "わかりません", "分かりません", "記載されていません", "記載がありません")
+_LIST_MARKER = re.compile(r"^\s*(\d+[.)]|[-*•])\s*")
+_TITLE_WORD = re.compile(r"[A-Za-z][A-Za-z0-9]*(?:[-.][A-Za-z0-9]+)*")
+_STOPWORDS = {
+    "about", "after", "against", "among", "based", "between", "beyond", "from",
+    "into", "learning", "model", "models", "over", "study", "their", "through",
+    "towards", "toward", "under", "using", "via", "what", "when", "where", "which",
+    "while", "with", "without",
+}
+
+
+class RouteAttempt(TypedDict):
+    tier: str
+    model: str
+    seconds: float
+    passed: bool  # 出力が検査に通ったか
+    reason: Optional[str]  # 検査に落ちた理由 (呼び出しに失敗した場合は error)
+
+
+class RouteDecision(TypedDict):
+    node: str
+    arxiv_id: Optional[str]  # analyze_paper の場合の論文
+    tier: str  # 結果を採用した (最後に試した) tier
+    escalated: bool  # 先頭の tier の結果を使わなかったか
+    attempts: List[RouteAttempt]
+
+
+class TierUsage(TypedDict):
+    calls: int
+    passed: int
+    seconds: float
+    avg_seconds: float
+
+
+def parse_route(node: str, spec: str) -> List[str]:
+    """カンマ区切りの tier の並びを読む (ノードで使えない tier・agent が最後でない場合は ValueError)"""
+    tiers = [tier.strip() for tier in spec.split(",") if tier.strip()]
+    allowed = NODE_TIERS[node]
+    unknown = [tier for tier in tiers if tier not in allowed]
+    if not tiers or unknown:
+        raise ValueError(
+            f"{node} の tier の指定が正しくありません: {spec!r} "
+            f"(指定できる tier: {', '.join(allowed)})"
+        )
+    if TIER_AGENT in tiers[:-1]:
+        raise ValueError(f"{node} の tier の指定が正しくありません: agent は最後に指定してください")
+    return tiers
+
+
+def new_decision(node: str, arxiv_id: Optional[str] = None) -> RouteDecision:
+    return RouteDecision(node=node, arxiv_id=arxiv_id, tier="", escalated=False, attempts=[])
+
+
+def record_attempt(
+    decision: RouteDecision, tier: str, model: str, started: float, reason: Optional[str]
+) -> None:
+    """started (time.monotonic()) から今までの1回の試行を記録する"""
+    decision["attempts"].append(
+        RouteAttempt(
+            tier=tier,
+            model=model,
+            seconds=round(time.monotonic() - started, 3),
+            passed=reason is None,
+            reason=reason,
+        )
+    )
+    decision["tier"] = tier
+    decision["escalated"] = len(decision["attempts"]) > 1
+
+
+class ModelRouter:
+    """ノードごとの tier の並びと、tier ごとのモデル"""
+
+    def __init__(self, routes: Dict[str, List[str]], models: Dict[str, str]):
+        self.routes = routes
+        self.models = models
+
+    @classmethod
+    def from_env(cls, agent_model: str) -> "ModelRouter":
+        """環境変数の設定から作る (agent_model はReActエージェントのモデル)"""
+        return cls(
+            {node: parse_route(node, spec) for node, spec in MODEL_ROUTES.items()},
+            {TIER_FAST: LLM_FAST_MODEL, TIER_STRONG: LLM_STRONG_MODEL, TIER_AGENT: agent_model},
+        )
+
+    def tiers(self, node: str) -> List[str]:
+        return self.routes[node]
+
+    def model(self, tier: str) -> str:
+        return self.models[tier]
+
+    def node_models(self, node: str) -> List[str]:
+        """ノードの結果を作りうるモデル (保存済みの結果を使い回してよいかの判定に使う)"""
+        return [self.model(tier) for tier in self.tiers(node)]
+
+    def run(
+        self,
+        node: str,
+        call: Callable[[str, str], T],
+        check: Callable[[T], Optional[str]],
+    ) -> Tuple[T, RouteDecision]:
+        """
+        call(tier, model) を tier の順に呼び、検査 check に通った最初の結果を返す
+        最後の tier の結果は検査に通らなくても返す。最後以外の tier の呼び出しに失敗した場合は次の tier に進む
+        """
+        decision = new_decision(node)
+        tiers = self.tiers(node)
+        for n, tier in enumerate(tiers):
+            final = n == len(tiers) - 1
+            started = time.monotonic()
+            try:
+                output = call(tier, self.model(tier))
+            except Exception:
+                record_attempt(decision, tier, self.model(tier), started, REASON_ERROR)
+                if final:
+                    raise
+                continue
+            reason = check(output)
+            record_attempt(decision, tier, self.model(tier), started, reason)
+            if reason is None or final:
+                return output, decision
+        raise AssertionError("unreachable")
+
+
+def japanese_ratio(text: str) -> float:
+    """空白以外の文字のうち、かな・漢字の割合"""
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return 0.0
+    return sum(1 for c in chars if _JAPANESE_CHAR.match(c)) / len(chars)
+
+
+def key_terms(title: str) -> List[str]:
+    """
+    タイトルの主要な用語 (略語・固有名と、一般的でない5文字以上の単語)
+    日本語の要約でも訳されずに残りやすいものを選ぶ
+    """
+    terms = []
+    for word in _TITLE_WORD.findall(title):
+        is_acronym = sum(1 for c in word if c.isupper()) >= 2 or any(c.isdigit() for c in word)
+        if is_acronym or (len(word) >= 5 and word.lower() not in _STOPWORDS):
+            terms.append(word)
+    return terms
+
+
+def check_analysis(text: str, title: str) -> Optional[str]:
+    """論文の分析の検査。通らなければその理由を返す"""
+    text = (text or "").strip()
+    if NEEDS_LOOKUP in text:
+        return REASON_NEEDS_LOOKUP
+    if len(text) < ROUTER_MIN_ANALYSIS_CHARS:
+        return REASON_TOO_SHORT
+    if len(text) > ROUTER_MAX_ANALYSIS_CHARS:
+        return REASON_TOO_LONG
+    if japanese_ratio(text) < ROUTER_MIN_JAPANESE_RATIO:
+        return REASON_NOT_JAPANESE
+    if any(phrase in text for phrase in _UNCERTAIN_PHRASES):
+        return REASON_UNCERTAIN
+    terms = key_terms(title)
+    lowered = text.lower()
+    if terms and not any(term.lower() in lowered for term in terms):
+        return REASON_MISSING_KEY_TERMS
+    return None
+
+
+def check_queries(text: str) -> Optional[str]:
+    """生成された検索クエリ (改行区切り) の検査。通らなければその理由を返す"""
+    queries = [q.strip() for q in (text or "").split("\n") if q.strip()]
+    if len(queries) < ROUTER_EXPECTED_QUERIES:
+        return REASON_TOO_FEW_QUERIES
+    if any(_LIST_MARKER.match(q) for q in queries):
+        return REASON_NUMBERED
+    if any(japanese_ratio(q) > 0 for q in queries):
+        return REASON_NOT_ENGLISH
+    if any(len(q) > ROUTER_MAX_QUERY_CHARS for q in queries):
+        return REASON_TOO_LONG
+    return None
+
+
+def summarize_tiers(decisions: List[RouteDecision]) -> Dict[str, TierUsage]:
+    """tier ごとの試行回数・検査に通った回数・所要時間 (合計と平均)"""
+    totals: Dict[str, Dict[str, float]] = {}
+    for decision in decisions:
+        for attempt in decision["attempts"]:
+            total = totals.setdefault(attempt["tier"], {"calls": 0, "passed": 0, "seconds": 0.0})
+            total["calls"] += 1
+            total["passed"] += attempt["passed"]
+            total["seconds"] += attempt["seconds"]
+    return {
+        tier: TierUsage(
+            calls=int(total["calls"]),
+            passed=int(total["passed"]),
+            seconds=round(total["seconds"], 3),
+            avg_seconds=round(total["seconds"] / total["calls"], 3),
+        )
+        for tier, total in totals.items()
+    }
@@ -0,0 +1,309 @@
+"""
+observability.py - メトリクス・トレース・構造化ログ
+
+- メトリクス: プロセス内で集計し、Prometheusのテキスト形式で出力する (`GET /metrics`)
+- トレース: `opentelemetry-api` がインストールされていればスパンを作る (なければ何もしない)
+- LangChain (OpenAI) の呼び出しのメトリクスは llm_metrics.py (LangChainを読み込むため分けている)
+- ログ: `get_logger()` のロガーはキーワード引数をフィールドとして出力する。
+  `LOG_LEVEL` / `LOG_FORMAT` (text / json) で切り替え、論文・ツール単位の細かいログは DEBUG にしている
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:  # トレースは任意 (opentelemetry-api がなければスパンを作らない)
+    _otel_trace = None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# レイテンシのヒストグラムの区切り (秒)。LLM・arXivは数秒〜数十秒かかる
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(),
+        ]
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    """任意の値を設定できるゲージ"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """値の分布 (累積バケット・合計・件数)"""
+
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(names, key + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            lines.append(
+                f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {count}"
+            )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録先。render() でPrometheusのテキスト形式にする"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, description: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, description, labelnames))
+
+    def gauge(self, name: str, description: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, description, labelnames))
+
+    def histogram(
+        self, name: str, description: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, description, labelnames, buckets=buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """render() の直前に呼ぶ関数 (ゲージに現在の値を入れる) を登録する"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collector in collectors:
+            collector()
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+NODE_DURATION = REGISTRY.histogram(
+    "paper_agent_node_duration_seconds", "LangGraphノードの実行時間", ["node"]
+)
+NODE_ERRORS = REGISTRY.counter(
+    "paper_agent_node_errors_total", "例外で終了したLangGraphノードの数", ["node"]
+)
+NODE_TOKENS = REGISTRY.counter(
+    "paper_agent_node_tokens_total", "ノードごとのLLMトークン数", ["node", "kind"]
+)
+EXTERNAL_DURATION = REGISTRY.histogram(
+    "paper_agent_external_call_duration_seconds",
+    "外部API呼び出しの所要時間",
+    ["service", "operation"],
+)
+EXTERNAL_ERRORS = REGISTRY.counter(
+    "paper_agent_external_call_errors_total",
+    "失敗した外部API呼び出しの数",
+    ["service", "operation"],
+)
+EXTERNAL_RETRIES = REGISTRY.counter(
+    "paper_agent_external_call_retries_total", "外部API呼び出しのリトライ数", ["service"]
+)
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "paper_agent_rate_limit_wait_seconds", "レート制限で待機した時間", ["service"]
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "paper_agent_cache_requests_total", "キャッシュの参照数", ["cache", "result"]
+)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """OpenTelemetryのスパンを作る (opentelemetry-api がなければ何もしない)"""
+    if _otel_trace is None:
+        yield
+        return
+    tracer = _otel_trace.get_tracer("paper_agent")
+    with tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+
+@contextmanager
+def instrument_call(service: str, operation: str) -> Iterator[None]:
+    """外部API呼び出しの所要時間・失敗数を記録し、スパンで囲む"""
+    started = time.perf_counter()
+    try:
+        with span(f"{service}.{operation}", service=service, operation=operation):
+            yield
+    except Exception:
+        EXTERNAL_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        EXTERNAL_DURATION.observe(
+            time.perf_counter() - started, service=service, operation=operation
+        )
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# === ログ ===
+
+_RESERVED_LOG_KEYS = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """`logger.info("msg", key=value)` のキーワード引数をフィールドとして渡すロガー"""
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _RESERVED_LOG_KEYS}
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        return msg, kwargs
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(f"paper_agent.{name}"), {})
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = (
+            f"{self.formatTime(record)} {record.levelname:<7} "
+            f"{record.name}: {record.getMessage()}"
+        )
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **(getattr(record, "fields", None) or {}),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_logging_configured = False
+_logging_lock = threading.Lock()
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """`paper_agent.*` のロガーの出力先と形式を設定する (2回目以降は何もしない)"""
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        _logging_configured = True
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(
+        _JSONFormatter() if (fmt or LOG_FORMAT) == "json" else _TextFormatter()
+    )
+    logger = logging.getLogger("paper_agent")
+    logger.addHandler(handler)
+    logger.setLevel((level or LOG_LEVEL).upper())
+    logger.propagate = False
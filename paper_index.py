@@ -0,0 +1,244 @@
+"""
+paper_index.py - 取得済み論文のローカル意味検索インデックス
+
+arXivから取得した論文のアブストラクト埋め込みをメモリマップしたNumPy行列
+(`vectors.f32`, L2正規化済みのfloat32) に、論文情報をJSON Linesのサイドカー
+(`papers.jsonl`, 行番号 = 行列の行) に保存します。
+検索は行列とクエリベクトルの内積 (= コサイン類似度) を一括で計算して上位k件を返します。
+
+書き込みはベクトル → サイドカーの順に行うため、途中で落ちてもサイドカーの行数までが有効な行になります。
+同じディレクトリを複数のプロセス (APIのワーカーなど) で開く場合に備え、追加はロックファイル
+(`index.lock`) の排他ロックを取り、他のプロセスが追加した行を読み込んでから行います。
+検索の前にも他のプロセスが追加した行を読み込むため、行番号と行列の行がずれません。
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, TypedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows ではファイルロックを使わない (1つのプロセスだけで開くこと)
+    fcntl = None
+
+# 行列を拡張するときの最小の行数
+_INITIAL_CAPACITY = 1024
+
+
+class IndexedPaper(TypedDict):
+    arxiv_id: str
+    title: str
+    summary: str
+    url: str
+    fetched_at: float  # arXivから取得した時刻
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """各行をL2正規化する (内積がそのままコサイン類似度になる)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def near_duplicate_mask(vectors: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    先頭から順に見て、それより前に残した行とのコサイン類似度が threshold 以上の行を
+    重複とみなす。残す行が True のマスクを返す (vectors は正規化済みであること)
+    """
+    keep = np.ones(len(vectors), dtype=bool)
+    if len(vectors) < 2:
+        return keep
+    similarities = vectors @ vectors.T
+    for i in range(1, len(vectors)):
+        if np.any(similarities[i, :i][keep[:i]] >= threshold):
+            keep[i] = False
+    return keep
+
+
+class PaperIndex:
+    """arXiv IDをキーにした論文埋め込みのインデックス (スレッドセーフ)"""
+
+    def __init__(self, directory: str, dim: int, model: str):
+        self.directory = directory
+        self.dim = dim
+        self.model = model
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._papers_path = os.path.join(directory, "papers.jsonl")
+        self._lock_path = os.path.join(directory, "index.lock")
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._file_lock(exclusive=True):
+            self._check_meta()
+
+        self._papers: List[IndexedPaper] = []
+        self._positions: Dict[str, int] = {}
+        self._fetched_at = np.zeros(0, dtype=np.float64)
+        # papers.jsonl のうち読み込み済みのバイト数
+        self._papers_offset = 0
+        self._vectors = self._open_vectors(_INITIAL_CAPACITY)
+        with self._lock, self._file_lock(exclusive=False):
+            self._refresh()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        """プロセス間のロック (追加は排他、読み込みは共有)"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """
+        他のプロセスが追加した行を読み込む (self._lock とファイルロックを取って呼ぶ)
+        改行まで書き終わった行だけを読み、行列が足りなければ開き直す
+        """
+        if not os.path.exists(self._papers_path):
+            return
+        if os.path.getsize(self._papers_path) <= self._papers_offset:
+            return
+        with open(self._papers_path, "rb") as f:
+            f.seek(self._papers_offset)
+            data = f.read()
+        complete = data[: data.rfind(b"\n") + 1]
+        added = [
+            IndexedPaper(**json.loads(line))
+            for line in complete.decode("utf-8").splitlines()
+            if line.strip()
+        ]
+        self._papers_offset += len(complete)
+        self._append_rows(added)
+        if len(self._papers) > len(self._vectors):
+            self._vectors = self._open_vectors(len(self._papers))
+
+    def _append_rows(self, added: List[IndexedPaper]) -> None:
+        for i, paper in enumerate(added, start=len(self._papers)):
+            self._positions[paper["arxiv_id"]] = i
+        self._papers.extend(added)
+        self._fetched_at = np.concatenate(
+            [self._fetched_at, np.array([paper["fetched_at"] for paper in added])]
+        )
+
+    def _check_meta(self) -> None:
+        """埋め込みモデルや次元数の違うインデックスを誤って開かないようにする"""
+        meta_path = os.path.join(self.directory, "meta.json")
+        meta = {"model": self.model, "dim": self.dim}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(
+                    f"インデックスの埋め込み設定 {stored} が現在の設定 {meta} と"
+                    f"一致しません: {self.directory}"
+                )
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+    def _open_vectors(self, capacity: int) -> np.memmap:
+        """capacity 行分の大きさを確保して行列をメモリマップする"""
+        size = capacity * self.dim * np.dtype(np.float32).itemsize
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._papers)
+
+    def __contains__(self, arxiv_id: str) -> bool:
+        with self._lock:
+            return arxiv_id in self._positions
+
+    def add(self, papers: Sequence[dict], vectors: np.ndarray) -> int:
+        """
+        論文と埋め込みを追加する (登録済みのIDは飛ばす)。追加した件数を返す
+        papers は arxiv_id / title / summary / url を持つ辞書
+        """
+        vectors = normalize_rows(vectors)
+        now = time.time()
+        with self._lock, self._file_lock(exclusive=True):
+            # 他のプロセスが追加した行の後ろに書く
+            self._refresh()
+            new = [
+                (paper, vector)
+                for paper, vector in zip(papers, vectors)
+                if paper["arxiv_id"] not in self._positions
+            ]
+            if not new:
+                return 0
+            start = len(self._papers)
+            end = start + len(new)
+            if end > len(self._vectors):
+                self._vectors.flush()
+                self._vectors = self._open_vectors(max(end, len(self._vectors) * 2))
+            self._vectors[start:end] = np.stack([vector for _, vector in new])
+            self._vectors.flush()
+
+            added = [
+                IndexedPaper(
+                    arxiv_id=paper["arxiv_id"],
+                    title=paper["title"],
+                    summary=paper["summary"],
+                    url=paper["url"],
+                    fetched_at=now,
+                )
+                for paper, _ in new
+            ]
+            payload = "".join(
+                json.dumps(paper, ensure_ascii=False) + "\n" for paper in added
+            ).encode("utf-8")
+            with open(self._papers_path, "ab") as f:
+                f.write(payload)
+            self._papers_offset += len(payload)
+            self._append_rows(added)
+            return len(added)
+
+    def vectors_for(self, arxiv_ids: Sequence[str]) -> Optional[np.ndarray]:
+        """指定したIDの埋め込みを並べて返す (未登録のIDが含まれていれば None)"""
+        with self._lock, self._file_lock(exclusive=False):
+            self._refresh()
+            if any(arxiv_id not in self._positions for arxiv_id in arxiv_ids):
+                return None
+            rows = [self._positions[arxiv_id] for arxiv_id in arxiv_ids]
+            return np.array(self._vectors[rows])
+
+    def search(
+        self, query: np.ndarray, k: int, max_age_seconds: Optional[float] = None
+    ) -> List[Tuple[IndexedPaper, float]]:
+        """
+        クエリベクトルとのコサイン類似度が高い順に最大k件の (論文, 類似度) を返す
+        max_age_seconds を指定すると、それより前に取得した論文は対象外にする
+        """
+        query = normalize_rows(query)[0]
+        with self._lock, self._file_lock(exclusive=False):
+            self._refresh()
+            count = len(self._papers)
+            if count == 0 or k <= 0:
+                return []
+            scores = np.asarray(self._vectors[:count] @ query)
+            if max_age_seconds is not None:
+                stale = self._fetched_at < time.time() - max_age_seconds
+                scores = np.where(stale, -np.inf, scores)
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (self._papers[i], float(scores[i]))
+                for i in top
+                if np.isfinite(scores[i])
+            ]
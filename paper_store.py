@@ -0,0 +1,160 @@
+"""
+paper_store.py - 論文ごとの分析結果ストア
+
+別のキーワードから同じ論文がヒットしても再分析しなくて済むように、
+正規化したarXiv ID (バージョン番号なし) をキーにして分析結果をSQLiteへ保存します。
+同時に走る別の実行 (バッチの他のキーワードなど) が同じ論文を分析中の場合は、
+claim() で終わるのを待ってから保存された結果を使えます。
+claims に StateBackend を渡すと、同じバックエンドを使う別のワーカー (プロセス) の分析も待ちます。
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, TypedDict
+
+from state_backend import StateBackend
+
+# ワーカー間の占有の期限 (占有したワーカーが止まっても、この秒数が過ぎれば別のワーカーが分析する)
+PAPER_CLAIM_LEASE_SECONDS = float(os.getenv("PAPER_CLAIM_LEASE_SECONDS", "600"))
+# 別のワーカーが分析中のときに、占有できるか確かめ直す間隔 (秒)
+PAPER_CLAIM_POLL_SECONDS = 0.5
+
+_ARXIV_ID_PATTERN = re.compile(r"arxiv\.org/(?:abs|pdf)/(.+?)(?:\.pdf)?/?$")
+_VERSION_PATTERN = re.compile(r"v\d+$")
+
+
+def canonical_arxiv_id(url: str) -> str:
+    """
+    arXivのURL (entry_id / pdf_url) からバージョン番号を除いたIDを取り出す
+    例: http://arxiv.org/pdf/2301.00001v2 -> 2301.00001
+    """
+    match = _ARXIV_ID_PATTERN.search(url)
+    arxiv_id = match.group(1) if match else url
+    return _VERSION_PATTERN.sub("", arxiv_id)
+
+
+class StoredPaper(TypedDict):
+    arxiv_id: str
+    title: str
+    summary: str
+    analysis: str
+    web_search_logs: List[str]
+    model: str
+    updated_at: float
+
+
+class PaperStore:
+    """arXiv IDをキーにした分析結果の永続ストア (スレッドセーフ)"""
+
+    def __init__(self, path: str, claims: Optional[StateBackend] = None):
+        self.path = path
+        self.claims = claims
+        self._lock = threading.Lock()
+        # arXiv ID -> [分析中のロック, 待っている実行の数]
+        self._claims: Dict[str, list] = {}
+        self._claims_lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS papers (
+                arxiv_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                web_search_logs TEXT NOT NULL,
+                model TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, arxiv_id: str) -> Optional[StoredPaper]:
+        """保存済みの分析結果を返す。未分析の場合は None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT arxiv_id, title, summary, analysis, web_search_logs, model, "
+                "updated_at FROM papers WHERE arxiv_id = ?",
+                (arxiv_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredPaper(
+            arxiv_id=row[0],
+            title=row[1],
+            summary=row[2],
+            analysis=row[3],
+            web_search_logs=json.loads(row[4]),
+            model=row[5],
+            updated_at=row[6],
+        )
+
+    @contextmanager
+    def claim(self, arxiv_id: str) -> Iterator[None]:
+        """
+        同じ論文を同時に分析しないよう、arXiv IDごとの排他を取る
+        先に分析している実行があれば、その分析が終わって保存されるまで待つ
+        プロセス内はロックで待ち、claims があればワーカー間の占有もバックエンドで取る
+        """
+        with self._claims_lock:
+            claim = self._claims.setdefault(arxiv_id, [threading.Lock(), 0])
+            claim[1] += 1
+        try:
+            with claim[0]:
+                if self.claims is None:
+                    yield
+                else:
+                    with self._claim_shared(arxiv_id):
+                        yield
+        finally:
+            with self._claims_lock:
+                claim[1] -= 1
+                if claim[1] == 0:
+                    del self._claims[arxiv_id]
+
+    @contextmanager
+    def _claim_shared(self, arxiv_id: str) -> Iterator[None]:
+        """バックエンドで論文を占有する (別のワーカーが占有していれば、解かれるか期限が切れるまで待つ)"""
+        name = f"paper:{arxiv_id}"
+        owner = uuid.uuid4().hex
+        while not self.claims.try_claim(name, owner, PAPER_CLAIM_LEASE_SECONDS):
+            time.sleep(PAPER_CLAIM_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            self.claims.release_claim(name, owner)
+
+    def put(
+        self,
+        arxiv_id: str,
+        title: str,
+        summary: str,
+        analysis: str,
+        web_search_logs: List[str],
+        model: str,
+    ) -> None:
+        """分析結果を保存する (同じIDがあれば上書き)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO papers (arxiv_id, title, summary, analysis, "
+                "web_search_logs, model, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    arxiv_id,
+                    title,
+                    summary,
+                    analysis,
+                    json.dumps(web_search_logs, ensure_ascii=False),
+                    model,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
@@ -0,0 +1,85 @@
+"""
+ranking.py - 論文候補の関連度スコアリング
+
+分析 (LLM) に回す前に、キーワードと生成クエリに対する関連度で候補を並べ替えるための
+BM25 と、埋め込み類似度との融合を定義します。外部APIは呼ばずにローカルで計算します。
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Set
+
+# Unicode の単語文字 (英数字のほか、日本語やアクセント付きの文字も残す)
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """単語に分割する (全角/半角・大文字/小文字の違いは無視。英数字以外の文字も落とさない)"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _TOKEN_PATTERN.findall(text)
+
+
+def bm25_idf(n: int, document_frequency: int) -> float:
+    """n 件の文書のうち document_frequency 件に現れる語のIDF"""
+    return math.log(1 + (n - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def bm25_score(
+    query_terms: Set[str],
+    document: Sequence[str],
+    idf: Dict[str, float],
+    avg_length: float,
+    k1: float = 1.5,
+    b: float = 0.75,
+) -> float:
+    """1件の文書 (トークン列) のBM25スコア (idf は文書の集合全体で数えたもの)"""
+    counts = Counter(document)
+    norm = k1 * (1 - b + b * len(document) / avg_length)
+    return sum(
+        idf[term] * counts[term] * (k1 + 1) / (counts[term] + norm)
+        for term in query_terms
+        if term in counts
+    )
+
+
+def bm25_scores(
+    query: Sequence[str],
+    documents: Sequence[Sequence[str]],
+    k1: float = 1.5,
+    b: float = 0.75,
+) -> List[float]:
+    """トークン列の文書ごとに、クエリのトークン列に対するBM25スコアを返す"""
+    if not documents:
+        return []
+    avg_length = sum(len(doc) for doc in documents) / len(documents) or 1.0
+    document_frequency = Counter(term for doc in documents for term in set(doc))
+    n = len(documents)
+    idf = {term: bm25_idf(n, df) for term, df in document_frequency.items()}
+    query_terms = set(query)
+    return [bm25_score(query_terms, doc, idf, avg_length, k1, b) for doc in documents]
+
+
+def fuse_scores(
+    lexical: Sequence[float],
+    semantic: Optional[Sequence[float]],
+    semantic_weight: float,
+) -> List[float]:
+    """
+    BM25スコアを最大値で割って0〜1にそろえ、埋め込みのコサイン類似度と重み付きで足し合わせる
+    semantic が None の場合はBM25のみ (最も関連する候補が1.0になる)
+    """
+    top = max(lexical, default=0.0)
+    lexical = [score / top if top > 0 else 0.0 for score in lexical]
+    if semantic is None:
+        return lexical
+    return [
+        (1 - semantic_weight) * lex + semantic_weight * max(sem, 0.0)
+        for lex, sem in zip(lexical, semantic)
+    ]
+
+
+def normalize_title(title: str) -> str:
+    """同じ論文の別バージョン・別登録を見分けるためのタイトル表記"""
+    return " ".join(tokenize(title))
@@ -0,0 +1,48 @@
+"""
+ratelimit.py - 外部APIのレート制限
+
+複数スレッドから同時に呼ばれる外部API (arXivなど) へのリクエスト間隔を
+プロセス全体で制御するためのトークンバケットを定義します。
+共有の StateBackend を渡すと、同じバックエンドを使う全ワーカーで1つのバケットを共有します。
+"""
+
+import time
+from typing import Optional
+
+from state_backend import InMemoryBackend, StateBackend
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット
+
+    `interval` 秒ごとに1トークン補充され、最大 `capacity` 個まで貯まる。
+    `acquire()` はトークンが取れるまでブロックする。
+    トークンの残りは `backend` の `name` に保存する (省略時はこのインスタンス専用のメモリ)
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        capacity: int = 1,
+        backend: Optional[StateBackend] = None,
+        name: str = "default",
+    ):
+        if interval < 0:
+            raise ValueError("interval は0以上を指定してください")
+        if capacity < 1:
+            raise ValueError("capacity は1以上を指定してください")
+        self.interval = interval
+        self.capacity = capacity
+        self.backend = backend or InMemoryBackend()
+        self.name = name
+
+    def acquire(self) -> float:
+        """トークンを1つ消費する。待機した秒数を返す"""
+        waited = 0.0
+        while True:
+            wait = self.backend.take_token(self.name, self.interval, self.capacity)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,307 @@
+"""
+resilience.py - 外部API呼び出しの共通の耐障害性レイヤー
+
+OpenAI・arXiv (API・PDF)・DuckDuckGo への呼び出しに、サービスごとのタイムアウト、
+ジッター付き指数バックオフでのリトライ、サーキットブレーカー、ヘッジリクエストを適用します。
+障害中のサービスにはブレーカーが開いている間すぐに失敗を返し、
+タイムアウト待ちのリクエストが積み上がらないようにします。
+requests / httpx のクライアントをこの層に通すアダプターは http_clients.py にあります。
+"""
+
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from observability import EXTERNAL_RETRIES, REGISTRY, get_logger
+
+logger = get_logger("resilience")
+
+T = TypeVar("T")
+
+# サービスごとの1回の呼び出しのタイムアウト (秒)
+SERVICE_TIMEOUTS = {
+    "openai": float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60")),
+    "arxiv": float(os.getenv("ARXIV_TIMEOUT_SECONDS", "20")),
+    "duckduckgo": float(os.getenv("SEARCH_TIMEOUT_SECONDS", "15")),
+    "arxiv_pdf": float(os.getenv("ARXIV_PDF_TIMEOUT_SECONDS", "60")),
+}
+# リトライできる失敗のときに再試行する回数と、待ち時間の基準・上限 (秒)
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_SECONDS", "0.5"))
+UPSTREAM_RETRY_MAX_SECONDS = float(os.getenv("UPSTREAM_RETRY_MAX_SECONDS", "8"))
+# 連続してこの回数失敗したらブレーカーを開き、指定秒数の間はすぐに失敗を返す
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+_BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+BREAKER_STATE = REGISTRY.gauge(
+    "paper_agent_circuit_breaker_state",
+    "サーキットブレーカーの状態 (0: closed / 1: half_open / 2: open)",
+    ["service"],
+)
+BREAKER_REJECTIONS = REGISTRY.counter(
+    "paper_agent_circuit_breaker_rejections_total",
+    "ブレーカーが開いていたため送らなかった呼び出しの数",
+    ["service"],
+)
+HEDGED_REQUESTS = REGISTRY.counter(
+    "paper_agent_hedged_requests_total", "応答が遅いため追加で送ったリクエストの数", ["service"]
+)
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが開いているため、外部APIを呼ばずに失敗した"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(
+            f"{service} は一時的に利用できません (あと {math.ceil(retry_after)} 秒は呼び出しません)"
+        )
+        self.service = service
+        self.retry_after = retry_after
+
+
+class UpstreamTimeoutError(TimeoutError):
+    """外部API呼び出しがタイムアウトした"""
+
+
+class RetryableStatusError(Exception):
+    """リトライすべきHTTPステータス (429 / 5xx など) が返された"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None, response: Any = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+        self.response = response
+
+
+class CircuitBreaker:
+    """
+    サービスごとのサーキットブレーカー (スレッドセーフ)
+
+    closed: 通常どおり呼び出す。連続 failure_threshold 回失敗すると open へ
+    open: reset_seconds の間はすべて CircuitOpenError。経過後は half_open へ
+    half_open: 1件だけ試しに呼び出し、成功すれば closed、失敗すれば再び open へ
+    """
+
+    def __init__(self, service: str, failure_threshold: int, reset_seconds: float):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """呼び出してよいか確認する。だめなら CircuitOpenError"""
+        with self._lock:
+            if self.state == BREAKER_OPEN:
+                remaining = self.opened_at + self.reset_seconds - time.monotonic()
+                if remaining > 0:
+                    BREAKER_REJECTIONS.inc(service=self.service)
+                    raise CircuitOpenError(self.service, remaining)
+                self._set_state(BREAKER_HALF_OPEN)
+            if self.state == BREAKER_HALF_OPEN:
+                if self._probing:
+                    BREAKER_REJECTIONS.inc(service=self.service)
+                    raise CircuitOpenError(self.service, self.reset_seconds)
+                self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probing = False
+            if self.state != BREAKER_CLOSED:
+                logger.info("circuit closed", service=self.service)
+                self._set_state(BREAKER_CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.state == BREAKER_HALF_OPEN or (
+                self.state == BREAKER_CLOSED
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    "circuit opened",
+                    service=self.service,
+                    consecutive_failures=self.consecutive_failures,
+                )
+                self.opened_at = time.monotonic()
+                self._set_state(BREAKER_OPEN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ヘルスチェック用の状態"""
+        with self._lock:
+            retry_after = None
+            if self.state == BREAKER_OPEN:
+                retry_after = round(
+                    max(0.0, self.opened_at + self.reset_seconds - time.monotonic()), 1
+                )
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_after_seconds": retry_after,
+            }
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        BREAKER_STATE.set(_BREAKER_STATE_VALUES[state], service=self.service)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    """サービスごとにプロセス共有のブレーカーを返す (初回呼び出し時に生成)"""
+    with _breakers_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(
+                service, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS
+            )
+            BREAKER_STATE.set(0, service=service)
+        return _breakers[service]
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """すべてのサービスのブレーカーの状態 (まだ呼び出していないサービスも含む)"""
+    for service in SERVICE_TIMEOUTS:
+        get_breaker(service)
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.service: breaker.snapshot() for breaker in breakers}
+
+
+def backoff_delay(attempt: int) -> float:
+    """attempt 回目 (0始まり) の失敗後に待つ秒数 (full jitter の指数バックオフ)"""
+    cap = min(UPSTREAM_RETRY_MAX_SECONDS, UPSTREAM_RETRY_BASE_SECONDS * 2**attempt)
+    return random.uniform(0, cap)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """タイムアウト・接続エラー・429/5xx はリトライする (その他は呼び出し側の問題とみなす)"""
+    # requests / httpx は読み込みに時間がかかるため、ヘルスチェックだけで使う場合は読み込まない
+    import httpx
+    import requests
+
+    return isinstance(
+        error,
+        (
+            UpstreamTimeoutError,
+            RetryableStatusError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            httpx.TransportError,
+        ),
+    )
+
+
+# タイムアウト・ヘッジ用のスレッド (タイムアウトした呼び出しは裏で終わるまで動き続ける)
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream")
+
+
+def _submit(fn: Callable[[], T]):
+    # 呼び出し元のコンテキスト (使用量の集計先など) を引き継ぐ
+    return _executor.submit(copy_context().run, fn)
+
+
+def _with_timeout(fn: Callable[[], T], timeout: float) -> T:
+    future = _submit(fn)
+    done, _ = wait([future], timeout=timeout)
+    if not done:
+        future.cancel()
+        raise UpstreamTimeoutError(f"{timeout:.0f} 秒以内に応答がありませんでした")
+    return future.result()
+
+
+def call(
+    service: str,
+    fn: Callable[[], T],
+    *,
+    retryable: Callable[[BaseException], bool] = is_retryable,
+    timeout: Optional[float] = None,
+    max_retries: Optional[int] = None,
+) -> T:
+    """
+    ブレーカー・タイムアウト・リトライを適用して fn() を呼ぶ
+    timeout を指定すると、fn 自身にタイムアウトがなくてもその秒数で打ち切る。
+    リトライできない失敗 (400など) はサービスは応答しているとみなし、ブレーカーでは成功として扱う
+    """
+    breaker = get_breaker(service)
+    max_retries = UPSTREAM_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = _with_timeout(fn, timeout) if timeout else fn()
+        except Exception as e:
+            if not retryable(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, UPSTREAM_RETRY_MAX_SECONDS))
+            EXTERNAL_RETRIES.inc(service=service)
+            logger.info(
+                "retrying upstream call",
+                service=service,
+                attempt=attempt + 1,
+                delay=round(delay, 2),
+                error=str(e),
+            )
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+def hedge(
+    service: str,
+    fn: Callable[[], T],
+    after_seconds: float,
+    acquire: Optional[Callable[[], None]] = None,
+) -> T:
+    """
+    after_seconds 経っても応答がなければ同じ呼び出しをもう1つ送り、先に成功した結果を使う
+    (遅い1件に引きずられる裾のレイテンシを抑える)。0 以下ならそのまま呼ぶ
+    acquire を指定すると、それぞれの呼び出しの前に呼ぶ (レート制限のトークンを取る)。
+    待ち時間は after_seconds に含めないため、トークン待ちでヘッジが送られることはない
+    """
+    if acquire is not None:
+        acquire()
+    if after_seconds <= 0:
+        return fn()
+    primary = _submit(fn)
+    done, _ = wait([primary], timeout=after_seconds)
+    if done:
+        return primary.result()
+    HEDGED_REQUESTS.inc(service=service)
+    if acquire is not None:
+        # ヘッジも1リクエストとして、同じバケットのトークンを取ってから送る
+        acquire()
+    pending = {primary, _submit(fn)}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = error or future.exception()
+    raise error
@@ -0,0 +1,132 @@
+"""
+results.py - 完了した分析結果のコンテンツアドレス保存と部分取得
+
+完了したジョブの結果 (AnalysisResponse の内容) を、内容のSHA-256ハッシュをキーにして
+StateBackend に保存します。同じハッシュの結果は中身が変わらないため、
+`GET /results/{hash}` は中継キャッシュやブラウザにそのまま保存させられます。
+ハッシュはジョブの ETag にも使い、`If-None-Match` が一致すれば本文を組み立てずに 304 を返します。
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from state_backend import StateBackend
+
+# 保存した結果を参照できる期間 (最後に参照してから) と保存件数の上限
+RESULT_TTL_SECONDS = float(os.getenv("RESULT_TTL_SECONDS", str(30 * 24 * 3600)))
+RESULT_MAX_ENTRIES = int(os.getenv("RESULT_MAX_ENTRIES", "10000"))
+
+
+def content_hash(value: Any) -> str:
+    """JSONにできる値の内容のハッシュ (キーの順序によらない)"""
+    payload = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultStore:
+    """内容のハッシュをキーにした分析結果のストア (スレッドセーフ)"""
+
+    def __init__(
+        self,
+        backend: StateBackend,
+        ttl_seconds: float = RESULT_TTL_SECONDS,
+        max_entries: int = RESULT_MAX_ENTRIES,
+        namespace: str = "results",
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.namespace = namespace
+
+    def put(self, result: Dict[str, Any]) -> str:
+        """結果を保存し、そのハッシュを返す (同じ内容の結果は1件として保存される)"""
+        result_hash = content_hash(result)
+        self.backend.cache_set(
+            self.namespace,
+            result_hash,
+            json.dumps(result, ensure_ascii=False),
+            self.max_entries,
+        )
+        return result_hash
+
+    def get(self, result_hash: str) -> Optional[Dict[str, Any]]:
+        """ハッシュの結果を返す。保存されていない・期限切れの場合は None"""
+        value = self.backend.cache_get(self.namespace, result_hash, self.ttl_seconds)
+        return json.loads(value) if value is not None else None
+
+
+class Projection:
+    """
+    結果の部分取得の指定
+    fields: 返す AnalysisResponse のフィールド (None ならすべて)
+    include_abstracts: False なら論文の summary (アブストラクト) を除く
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None, include_abstracts: bool = True):
+        self.fields = fields
+        self.include_abstracts = include_abstracts
+
+    @classmethod
+    def parse(
+        cls, fields: Optional[str], include_abstracts: bool, allowed: List[str]
+    ) -> "Projection":
+        """カンマ区切りのフィールド名を読む (allowed にない名前があれば ValueError)"""
+        names = None
+        if fields:
+            names = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = [name for name in names if name not in allowed]
+            if unknown:
+                raise ValueError(
+                    f"不明なフィールドです: {', '.join(unknown)} "
+                    f"(指定できるフィールド: {', '.join(allowed)})"
+                )
+        return cls(names, include_abstracts)
+
+    @property
+    def is_full(self) -> bool:
+        return self.fields is None and self.include_abstracts
+
+    def key(self) -> str:
+        """ETag に加える部分取得の識別子 (すべて返す場合は空文字列)"""
+        if self.is_full:
+            return ""
+        spec = {"fields": sorted(self.fields or []), "abstracts": self.include_abstracts}
+        return content_hash(spec)[:12]
+
+    def apply(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """結果から指定されたフィールドだけを取り出す"""
+        if self.fields is not None:
+            result = {name: result[name] for name in self.fields if name in result}
+        if not self.include_abstracts and "papers" in result:
+            result = {
+                **result,
+                "papers": [
+                    {key: value for key, value in paper.items() if key != "summary"}
+                    for paper in result["papers"]
+                ],
+            }
+        return result
+
+
+def make_etag(base: str, projection: Projection) -> str:
+    """
+    内容のハッシュと部分取得の指定から ETag を作る
+    圧縮の有無・方式でバイト列は変わるが内容は同じなので、弱い検証子 (W/) にする
+    """
+    key = projection.key()
+    return f'W/"{base}.{key}"' if key else f'W/"{base}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match が etag に一致するか (弱い比較: W/ の有無は無視する)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    target = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == target
+        for candidate in if_none_match.split(",")
+    )
@@ -4,8 +4,20 @@ schemas.py - リクエスト/レスポンスのデータ構造を定義
 REST APIでは「リソースの表現（Representation）」が重要。
 Pydanticを使って、APIでやり取りするデータの形を明確に定義します。
 """
+import os
+
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Dict, List, Literal, Optional
+
+# 論文分析のモード
+# agent: 論文ごとにReActエージェントで分析する (従来どおり)
+# batched: 複数の論文をまとめて1回で要約し、Web検索が必要と判定された論文だけエージェントで分析する
+ANALYSIS_MODE_AGENT = "agent"
+ANALYSIS_MODE_BATCHED = "batched"
+
+# 関連度で絞り込む前に集める候補数 (多めに集めて rank_papers で上位だけ残す)
+# top_k はこれより大きくできない (候補より多くは分析できない)
+ARXIV_CANDIDATE_PAPERS = int(os.getenv("ARXIV_CANDIDATE_PAPERS", "20"))
 
 
 # === リクエスト（クライアント → サーバー） ===
@@ -19,15 +31,149 @@ class AnalysisRequest(BaseModel):
         description="分析したいトピックやキーワード",
         examples=["LLM efficiency", "transformer attention mechanism"]
     )
+    bypass_cache: bool = Field(
+        default=False,
+        description="Trueの場合、LLMキャッシュを使わずに再分析する（結果はキャッシュに上書き保存）"
+    )
+    analysis_mode: Literal["agent", "batched"] = Field(
+        default=ANALYSIS_MODE_AGENT,
+        description=(
+            "agent: 論文ごとにReActエージェントで分析 / "
+            "batched: まとめて1回で要約し、Web検索が必要な論文だけエージェントで分析"
+        )
+    )
+    full_text: bool = Field(
+        default=False,
+        description=(
+            "Trueの場合、PDFの本文から検索クエリに関連する箇所を選び、アブストラクトと合わせて分析する"
+            "（PDFを取得できなかった論文はアブストラクトのみ）"
+        )
+    )
+    top_k: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=ARXIV_CANDIDATE_PAPERS,
+        description=f"関連度の高い順に分析する論文数（1〜{ARXIV_CANDIDATE_PAPERS}、省略時: 10）"
+    )
+    min_score: Optional[float] = Field(
+        default=None,
+        ge=0,
+        le=1,
+        description="分析する論文の関連度スコア（0〜1）の下限（省略時: サーバーの設定値）"
+    )
+    max_tokens: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="リクエスト全体で使うLLMトークン数の上限（省略時: 無制限）"
+    )
+    max_tool_calls_per_paper: Optional[int] = Field(
+        default=None,
+        ge=0,
+        le=20,
+        description="1本の論文の分析で使えるWeb検索の回数（省略時: サーバーの設定値）"
+    )
+    max_seconds: Optional[float] = Field(
+        default=None,
+        gt=0,
+        description="リクエスト全体の実行時間の上限（秒、省略時: 無制限）"
+    )
+
+
+class BatchAnalysisRequest(BaseModel):
+    """まとめて分析するキーワードのリクエスト"""
+    items: List[AnalysisRequest] = Field(
+        ...,
+        min_length=1,
+        max_length=1000,
+        description="分析リクエストの一覧（同じ条件のキーワードは1回だけ分析する）"
+    )
+    batch_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=200,
+        description=(
+            "同じIDで送り直すと、完了済みの項目は結果だけを返し、"
+            "失敗・中断した項目は続きから実行する（省略時: 新しいID）"
+        )
+    )
 
 
 # === レスポンス（サーバー → クライアント） ===
 
 class PaperResponse(BaseModel):
     """論文情報のレスポンス"""
+    arxiv_id: str = Field(default="", description="arXiv ID（バージョン番号なし）")
     title: str
     summary: str
     url: str
+    relevance_score: Optional[float] = Field(
+        default=None,
+        description="キーワードとの関連度スコア（0〜1）"
+    )
+
+
+class NodeUsageResponse(BaseModel):
+    """ノードごとの使用量"""
+    llm_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    seconds: float
+
+
+class PaperUsageResponse(BaseModel):
+    """論文ごとの使用量"""
+    arxiv_id: str
+    source: str = Field(description="store / cache / fast / strong / agent / batch / skipped")
+    llm_calls: int
+    total_tokens: int = Field(description="batch の場合はまとめた論文数で等分した値")
+    tool_calls: int
+    seconds: float
+    degraded: Optional[str] = Field(
+        default=None,
+        description="予算切れで分析を省略・打ち切った理由（tokens / time / tool_calls）"
+    )
+    full_text: bool = Field(default=False, description="PDFの本文から選んだ箇所を分析に使ったか")
+
+
+class RouteAttemptResponse(BaseModel):
+    """モデルの振り分けで試した1つの tier"""
+    tier: str = Field(description="fast / strong / agent")
+    model: str
+    seconds: float
+    passed: bool = Field(description="出力が検査（長さ・日本語・主要な用語など）に通ったか")
+    reason: Optional[str] = Field(default=None, description="検査に落ちた理由（呼び出しに失敗した場合は error）")
+
+
+class RouteDecisionResponse(BaseModel):
+    """ノード・論文ごとのモデルの振り分け"""
+    node: str = Field(description="generate_queries / analyze_paper")
+    arxiv_id: Optional[str] = Field(default=None, description="analyze_paper の場合の論文")
+    tier: str = Field(description="結果を採用した tier")
+    escalated: bool = Field(description="先頭の tier の結果を使わず、次の tier に進んだか")
+    attempts: List[RouteAttemptResponse]
+
+
+class TierUsageResponse(BaseModel):
+    """tier ごとの試行回数と所要時間"""
+    calls: int
+    passed: int
+    seconds: float
+    avg_seconds: float
+
+
+class UsageResponse(BaseModel):
+    """リクエスト全体の使用量"""
+    total_tokens: int = Field(default=0, description="使用したLLMトークン数の合計")
+    elapsed_seconds: float = Field(default=0, description="パイプライン全体の実行時間（秒）")
+    budget_exhausted: Optional[str] = Field(
+        default=None,
+        description="予算を使い切った場合、その理由（tokens / time / tool_calls）"
+    )
+    nodes: Dict[str, NodeUsageResponse] = Field(default={}, description="ノードごとの使用量")
+    papers: List[PaperUsageResponse] = Field(default=[], description="論文ごとの使用量")
+    routing: List[RouteDecisionResponse] = Field(default=[], description="モデルの振り分けの記録")
+    tiers: Dict[str, TierUsageResponse] = Field(default={}, description="tier ごとの試行回数と所要時間")
 
 
 class AnalysisResponse(BaseModel):
@@ -35,12 +181,88 @@ class AnalysisResponse(BaseModel):
     keyword: str = Field(description="入力されたキーワード")
     queries: List[str] = Field(description="生成された検索クエリ")
     papers_count: int = Field(description="見つかった論文数")
+    candidates_count: int = Field(
+        default=0,
+        description="関連度で絞り込む前の候補数"
+    )
     papers: List[PaperResponse] = Field(description="論文一覧")
     report_markdown: str = Field(description="生成されたレポート（Markdown形式）")
     web_search_logs: List[str] = Field(
         default=[],
         description="実行されたWeb検索のログ"
     )
+    analysis_mode: str = Field(default="agent", description="使用した分析モード")
+    agent_analyzed_ids: List[str] = Field(
+        default=[],
+        description="ReActエージェントでの分析に回した論文のarXiv ID"
+    )
+    usage: UsageResponse = Field(
+        default_factory=UsageResponse,
+        description="トークン数・ツール呼び出し・実行時間の使用量"
+    )
+
+
+class StoredPaperResponse(BaseModel):
+    """保存済みの論文分析結果のレスポンス"""
+    arxiv_id: str = Field(description="arXiv ID（バージョン番号なし）")
+    title: str
+    summary: str
+    analysis: str = Field(description="LLMによる分析結果")
+    web_search_logs: List[str] = Field(
+        default=[],
+        description="分析時に実行されたWeb検索のログ"
+    )
+    model: str = Field(description="分析に使用したモデル")
+    updated_at: float = Field(description="分析日時（UNIX時間）")
+
+
+class AnalysisJobResponse(BaseModel):
+    """分析ジョブの状態のレスポンス"""
+    id: str = Field(description="ジョブID")
+    status: str = Field(description="queued / running / succeeded / failed")
+    keyword: str = Field(description="入力されたキーワード")
+    coalesced: bool = Field(
+        default=False,
+        description="同じキーワードで実行中のジョブに相乗りした場合 True"
+    )
+    current_node: Optional[str] = Field(
+        default=None,
+        description="実行中のLangGraphノード"
+    )
+    completed_nodes: List[str] = Field(
+        default=[],
+        description="完了したLangGraphノード"
+    )
+    result: Optional[AnalysisResponse] = Field(
+        default=None,
+        description="分析結果（status が succeeded の場合のみ）"
+    )
+    result_hash: Optional[str] = Field(
+        default=None,
+        description="分析結果の内容のハッシュ（`GET /results/{hash}` で取得できる。status が succeeded の場合のみ）"
+    )
+    error: Optional[str] = Field(
+        default=None,
+        description="エラーメッセージ（status が failed の場合のみ）"
+    )
+    created_at: float = Field(description="作成日時（UNIX時間）")
+    updated_at: float = Field(description="更新日時（UNIX時間）")
+
+
+class BatchItemResponse(BaseModel):
+    """バッチの1件の結果（NDJSONの1行）"""
+    index: int = Field(description="リクエストの items での位置")
+    id: str = Field(description="ジョブID（`GET /analyses/{id}` で参照できる）")
+    keyword: str = Field(description="入力されたキーワード")
+    status: str = Field(description="succeeded / failed")
+    result: Optional[AnalysisResponse] = Field(
+        default=None,
+        description="分析結果（status が succeeded の場合のみ）"
+    )
+    error: Optional[str] = Field(
+        default=None,
+        description="エラーメッセージ（status が failed の場合のみ）"
+    )
 
 
 class ErrorResponse(BaseModel):
@@ -0,0 +1,107 @@
+"""
+search_cache.py - Web検索結果のキャッシュ
+
+表記ゆれ (全角/半角・大文字/小文字・空白) を正規化したクエリをキーにして、
+検索結果をメモリ上のLRUと、任意でディスク (TTL付き) に保存します。
+同じクエリの検索が同時に走った場合は1回だけ実行し、結果を共有します (single-flight)。
+"""
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+from llm_cache import LLMCache
+
+
+def normalize_query(query: str) -> str:
+    """
+    全角/半角 (NFKC)・大文字/小文字・前後や連続する空白の違いを無視したクエリにする
+    Web検索のキャッシュのほか、同じ分析とみなすキーワードの判定 (ジョブの相乗り・バッチ・購読) にも使う
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class SearchStats:
+    """1回の分析で行われたWeb検索のキャッシュヒット数 (スレッドセーフ)"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def summary(self) -> Optional[str]:
+        """web_search_logs に載せる集計行 (検索がなければ None)"""
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return f"[検索キャッシュ] ヒット率 {self.hits}/{total} ({self.hits / total:.0%})"
+
+
+# 実行中の分析の集計先 (分析ノードで設定し、ツールを実行するスレッドへ引き継がれる)
+current_search_stats: ContextVar[Optional[SearchStats]] = ContextVar(
+    "current_search_stats", default=None
+)
+
+
+class SearchCache:
+    """メモリ上のLRU + 任意のディスクキャッシュ + 同時検索の合流"""
+
+    def __init__(self, max_entries: int, disk: Optional[LLMCache] = None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_fetch(self, query: str, fetch: Callable[[str], str]) -> Tuple[str, bool]:
+        """
+        キャッシュにあればそれを、なければ fetch(query) の結果を返す
+        (結果, キャッシュや実行中の同じ検索から得られたか) を返す。
+        fetch が例外を送出した場合はキャッシュせず、そのまま送出する
+        """
+        key = normalize_query(query)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key], True
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_owner:
+            # 同じクエリの検索がすでに実行中なら、その結果を待つ
+            return future.result(), True
+
+        try:
+            result = self.disk.get(key) if self.disk is not None else None
+            hit = result is not None
+            if result is None:
+                result = fetch(query)
+                if self.disk is not None:
+                    self.disk.set(key, result)
+            with self._lock:
+                self._memory[key] = result
+                while len(self._memory) > self.max_entries:
+                    self._memory.popitem(last=False)
+            future.set_result(result)
+            return result, hit
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
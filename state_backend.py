@@ -0,0 +1,318 @@
+"""
+state_backend.py - キャッシュ・ジョブ・レート制限の状態の保存先
+
+APIを複数のワーカー (プロセス・コンテナ) で動かしたときに、キャッシュのヒット、
+ジョブの状態、外部APIのレート制限をワーカー間で共有するための共通のインターフェースです。
+
+- `InMemoryBackend`: プロセス内に保持する (ワーカー間では共有しない)
+- `SQLiteBackend`: WALモードのSQLiteに保存する。共有ボリューム上の同じファイルを開いた
+  すべてのワーカーで状態を共有する (読み書きの整合は SQLite のロックで取る)
+
+同じ論文を複数のワーカーで同時に分析しないための期限付きの占有 (`try_claim`) も提供します。
+
+`get_state_backend(path)` はパスごとにプロセス共有のバックエンドを返します。
+ジョブの保存は jobs.py の `create_job_store(backend)` がバックエンドに合わせて用意します。
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+# 指定すると LLMキャッシュ・Web検索キャッシュ・ジョブ・レート制限をこのSQLite (WAL) に置き、
+# 同じファイルを開くすべてのワーカー (プロセス・コンテナ) で共有する
+STATE_BACKEND_PATH = os.getenv("STATE_BACKEND_PATH", "")
+
+_NAMESPACE_PATTERN = re.compile(r"^[a-z_]+$")
+
+
+def _check_namespace(namespace: str) -> None:
+    # SQLiteBackend ではテーブル名に使うので、英小文字と _ だけにする
+    if not _NAMESPACE_PATTERN.match(namespace):
+        raise ValueError(f"名前空間に使えない文字が含まれています: {namespace}")
+
+
+class StateBackend(ABC):
+    """状態の保存先のインターフェース (実装はスレッドセーフ)"""
+
+    # --- キャッシュ (名前空間ごとの TTL + LRU) ---
+
+    @abstractmethod
+    def cache_get(self, namespace: str, key: str, ttl_seconds: float) -> Optional[str]:
+        """値を返して最終参照時刻を更新する。見つからない・期限切れの場合は None"""
+
+    @abstractmethod
+    def cache_set(self, namespace: str, key: str, value: str, max_entries: int) -> None:
+        """値を保存し、max_entries を超えた分を最終参照が古い順に削除する"""
+
+    @abstractmethod
+    def cache_count(self, namespace: str) -> int:
+        ...
+
+    # --- レート制限 (名前ごとのトークンバケット) ---
+
+    @abstractmethod
+    def take_token(self, name: str, interval: float, capacity: int) -> float:
+        """
+        トークンを1つ消費できれば 0 を、できなければ次のトークンが貯まるまでの秒数を返す
+        トークンは interval 秒ごとに1つ補充され、最大 capacity 個まで貯まる
+        """
+
+    # --- 排他 (名前ごとの期限付きの占有) ---
+
+    @abstractmethod
+    def try_claim(self, name: str, owner: str, lease_seconds: float) -> bool:
+        """
+        name を owner が占有できれば True を返す (すでに owner が占有していれば期限を延ばす)
+        他の owner の占有は lease_seconds を過ぎたら (占有したワーカーが止まったとみなして) 奪える
+        """
+
+    @abstractmethod
+    def release_claim(self, name: str, owner: str) -> None:
+        """owner の占有を解く (他の owner に奪われていれば何もしない)"""
+
+
+class InMemoryBackend(StateBackend):
+    """プロセス内の辞書に状態を保持する (再起動で消える)"""
+
+    def __init__(self):
+        self._caches: Dict[str, "OrderedDict[str, Tuple[str, float]]"] = {}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._claims: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def cache_get(self, namespace: str, key: str, ttl_seconds: float) -> Optional[str]:
+        with self._lock:
+            entries = self._caches.get(namespace)
+            entry = entries.get(key) if entries is not None else None
+            if entry is None:
+                return None
+            if time.time() - entry[1] > ttl_seconds:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return entry[0]
+
+    def cache_set(self, namespace: str, key: str, value: str, max_entries: int) -> None:
+        with self._lock:
+            entries = self._caches.setdefault(namespace, OrderedDict())
+            entries[key] = (value, time.time())
+            entries.move_to_end(key)
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def cache_count(self, namespace: str) -> int:
+        with self._lock:
+            return len(self._caches.get(namespace, ()))
+
+    def take_token(self, name: str, interval: float, capacity: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(name, (float(capacity), now))
+            tokens = _refill(tokens, now - updated_at, interval, capacity)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) * interval
+            self._buckets[name] = (tokens - 1 if wait == 0 else tokens, now)
+            return wait
+
+    def try_claim(self, name: str, owner: str, lease_seconds: float) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            holder = self._claims.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self._claims[name] = (owner, now + lease_seconds)
+            return True
+
+    def release_claim(self, name: str, owner: str) -> None:
+        with self._lock:
+            holder = self._claims.get(name)
+            if holder is not None and holder[0] == owner:
+                del self._claims[name]
+
+
+def _refill(tokens: float, elapsed: float, interval: float, capacity: int) -> float:
+    if interval == 0:
+        return float(capacity)
+    return min(capacity, tokens + max(elapsed, 0.0) / interval)
+
+
+class SQLiteBackend(StateBackend):
+    """
+    WALモードのSQLiteに状態を保存する (プロセス・コンテナ間で共有できる)
+    読み取りと更新をまとめて行う処理は BEGIN IMMEDIATE で書き込みロックを取ってから行うので、
+    同じファイルを開いた複数のプロセスから同時に呼んでも整合する。
+    キャッシュは名前空間ごとのテーブル (LLMキャッシュは従来の llm_cache テーブル) に置く
+    """
+
+    # 他のプロセスが書き込み中のときにロックの解放を待つ秒数
+    BUSY_TIMEOUT_SECONDS = 30
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._tables: Set[str] = set()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # トランザクションは transaction() で明示的に始める
+        self._conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=self.BUSY_TIMEOUT_SECONDS,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS claims (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """書き込みロックを取ったトランザクション (抜けるときにコミット、例外ならロールバック)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _cache_table(self, namespace: str) -> str:
+        _check_namespace(namespace)
+        with self._lock:
+            if namespace not in self._tables:
+                self._conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {namespace} (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )
+                    """
+                )
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{namespace}_accessed "
+                    f"ON {namespace} (accessed_at)"
+                )
+                self._tables.add(namespace)
+        return namespace
+
+    def cache_get(self, namespace: str, key: str, ttl_seconds: float) -> Optional[str]:
+        table = self._cache_table(namespace)
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                f"SELECT value, created_at FROM {table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > ttl_seconds:
+                conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+                return None
+            conn.execute(f"UPDATE {table} SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def cache_set(self, namespace: str, key: str, value: str, max_entries: int) -> None:
+        table = self._cache_table(namespace)
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            conn.execute(
+                f"""
+                DELETE FROM {table} WHERE key IN (
+                    SELECT key FROM {table} ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (max_entries,),
+            )
+
+    def cache_count(self, namespace: str) -> int:
+        table = self._cache_table(namespace)
+        with self._lock:
+            (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        return count
+
+    def take_token(self, name: str, interval: float, capacity: int) -> float:
+        if interval == 0:
+            return 0.0
+        # プロセス・ホストをまたいで比べるので、単調時計ではなく時刻を使う
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE name = ?", (name,)
+            ).fetchone()
+            tokens = (
+                float(capacity)
+                if row is None
+                else _refill(row[0], now - row[1], interval, capacity)
+            )
+            wait = 0.0 if tokens >= 1 else (1 - tokens) * interval
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) "
+                "VALUES (?, ?, ?)",
+                (name, tokens - 1 if wait == 0 else tokens, now),
+            )
+        return wait
+
+    def try_claim(self, name: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT owner, expires_at FROM claims WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO claims (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, owner, now + lease_seconds),
+            )
+        return True
+
+    def release_claim(self, name: str, owner: str) -> None:
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM claims WHERE name = ? AND owner = ?", (name, owner))
+
+
+_state_backends: Dict[str, StateBackend] = {}
+_state_backends_lock = threading.Lock()
+
+
+def get_state_backend(path: str = "") -> StateBackend:
+    """
+    状態の保存先を返す (同じパスには同じインスタンス)
+    STATE_BACKEND_PATH が指定されていれば、path に関係なくすべての状態をその共有のSQLiteに置く。
+    なければ path のSQLite、path が空ならプロセス内のメモリを使う
+    """
+    path = STATE_BACKEND_PATH or path
+    with _state_backends_lock:
+        if path not in _state_backends:
+            _state_backends[path] = SQLiteBackend(path) if path else InMemoryBackend()
+        return _state_backends[path]
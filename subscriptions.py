@@ -0,0 +1,156 @@
+"""
+subscriptions.py - トピックの購読 (新着論文だけを分析する差分実行) の状態
+
+同じキーワードを毎日実行する場合に、前回までに見た論文を覚えておき、
+新しく投稿された論文だけを分析してレポートファイルに追記するための状態をSQLiteへ保存します。
+
+- 最高水位 (watermark): これまでに分析した論文のうち最も新しい投稿日時。
+  次回はarXivを投稿日の新しい順に検索し、watermark まで来たら取得を打ち切る
+- 見た (分析した) 論文のarXiv ID: 投稿日時が watermark と同じ・少し前の論文 (公開が遅れた論文など) を
+  取りこぼさないよう、watermark から SUBSCRIPTION_OVERLAP_SECONDS だけさかのぼって取得し、
+  その範囲で見たことのある論文を除く
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, TypedDict
+
+from search_cache import normalize_query
+
+SUBSCRIPTIONS_PATH = os.getenv("SUBSCRIPTIONS_PATH", ".cache/subscriptions.sqlite3")
+# watermark からさかのぼって取得し直す秒数 (投稿日時より遅れて公開される論文のため)
+SUBSCRIPTION_OVERLAP_SECONDS = float(
+    os.getenv("SUBSCRIPTION_OVERLAP_SECONDS", str(2 * 24 * 60 * 60))
+)
+
+
+def topic_key(keyword: str) -> str:
+    """購読のキー (全角/半角・大文字/小文字・空白の違いは同じトピックとみなす)"""
+    return normalize_query(keyword)
+
+
+class Subscription(TypedDict):
+    topic: str
+    keyword: str
+    queries: List[str]  # 初回に生成した検索クエリ (以降の実行でも同じクエリで検索する)
+    watermark: Optional[str]  # 分析した論文のうち最も新しい投稿日時 (ISO 8601)
+    report_path: Optional[str]  # 新着論文を追記するレポートファイル
+    created_at: float
+    updated_at: float
+
+
+class SubscriptionStore:
+    """トピックごとの watermark と見た論文の永続ストア (スレッドセーフ)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                topic TEXT PRIMARY KEY,
+                keyword TEXT NOT NULL,
+                queries TEXT NOT NULL,
+                watermark TEXT,
+                report_path TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS seen_papers (
+                topic TEXT NOT NULL,
+                arxiv_id TEXT NOT NULL,
+                published TEXT NOT NULL,
+                PRIMARY KEY (topic, arxiv_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, keyword: str) -> Optional[Subscription]:
+        """キーワードの購読を返す。まだ一度も実行していなければ None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT topic, keyword, queries, watermark, report_path, created_at, "
+                "updated_at FROM subscriptions WHERE topic = ?",
+                (topic_key(keyword),),
+            ).fetchone()
+        if row is None:
+            return None
+        return Subscription(
+            topic=row[0],
+            keyword=row[1],
+            queries=json.loads(row[2]),
+            watermark=row[3],
+            report_path=row[4],
+            created_at=row[5],
+            updated_at=row[6],
+        )
+
+    def since(self, subscription: Optional[Subscription]) -> Optional[str]:
+        """今回の取得で遡る投稿日時 (watermark - 重なり)。初回は None"""
+        if subscription is None or subscription["watermark"] is None:
+            return None
+        watermark = datetime.fromisoformat(subscription["watermark"])
+        return (watermark - timedelta(seconds=SUBSCRIPTION_OVERLAP_SECONDS)).isoformat()
+
+    def seen_ids(self, keyword: str, since: Optional[str]) -> List[str]:
+        """投稿日時が since 以降の、見たことのある論文のarXiv ID"""
+        if since is None:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT arxiv_id FROM seen_papers WHERE topic = ? AND published >= ?",
+                (topic_key(keyword), since),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def record(
+        self,
+        keyword: str,
+        queries: List[str],
+        published: Dict[str, str],
+        report_path: Optional[str],
+    ) -> None:
+        """
+        実行の結果を記録する
+        published (分析した論文のarXiv ID -> 投稿日時) を見た論文に加え、
+        watermark をその最も新しい投稿日時まで進める
+        """
+        topic = topic_key(keyword)
+        now = time.time()
+        newest = max(published.values()) if published else None
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO seen_papers (topic, arxiv_id, published) VALUES (?, ?, ?)",
+                [(topic, arxiv_id, date) for arxiv_id, date in published.items()],
+            )
+            self._conn.execute(
+                """
+                INSERT INTO subscriptions
+                    (topic, keyword, queries, watermark, report_path, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (topic) DO UPDATE SET
+                    queries = excluded.queries,
+                    watermark = CASE
+                        WHEN subscriptions.watermark IS NULL THEN excluded.watermark
+                        WHEN excluded.watermark IS NULL THEN subscriptions.watermark
+                        ELSE max(subscriptions.watermark, excluded.watermark)
+                    END,
+                    report_path = coalesce(excluded.report_path, subscriptions.report_path),
+                    updated_at = excluded.updated_at
+                """,
+                (topic, keyword, json.dumps(queries, ensure_ascii=False), newest, report_path, now, now),
+            )
+            self._conn.commit()